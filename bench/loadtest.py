@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+"""
+Replays a corpus of reports against the converter at a set concurrency and,
+optionally, a fixed arrival rate, and writes throughput, latency percentiles,
+resident memory over time and cache hit ratios as JSON.
+
+The targets are a warm pool of worker processes calling convert_sources (the
+work a long-running service does per report), one convert.py process per
+report (the CLI batch path) and the --watch daemon, fed by dropping reports
+into its folder. Without --rate each of --concurrency clients sends its next
+report as soon as the last one returns; with --rate reports arrive on a fixed
+schedule and latency counts from the scheduled arrival, so time spent queued
+behind a slow conversion is not hidden. Memory is the summed resident size of
+the processes the harness started, sampled every --sample-interval seconds.
+
+Run from the repository root, for example:
+python bench/loadtest.py --synthetic 12 --requests 200 --concurrency 4
+python bench/loadtest.py --corpus reports/ --target cli --rate 2 --output load.json
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from convert import VERSION, convert_sources
+from report_cache import ReportCache
+from scheduler import percentile
+from snapshot import load_snapshot
+from sources import is_archive
+from utils import enable_normalization_cache, get_normalization_stats
+from watch import is_candidate
+from xml_parser_bench import synthetic_report
+
+CONVERT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'convert.py')
+
+TARGETS = ('pool', 'cli', 'watch')
+
+# Seconds between checks for a report the watch daemon has moved to done/.
+WATCH_CHECK_INTERVAL = 0.05
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def build_corpus(directory, count):
+    """
+    Writes count synthetic reports of different sizes and contents, from a
+    few hundred KB to a few MB, and returns their paths.
+    """
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'synthetic-{:03d}.xml'.format(i))
+        with open(path, 'wb') as fd:
+            fd.write(synthetic_report((1, 10, 100)[i % 3] + i, (256 << 10) << (i % 3)))
+        paths.append(path)
+    return paths
+
+
+def read_corpus(directory):
+    paths = [os.path.join(directory, x) for x in sorted(os.listdir(directory)) if is_candidate(x)]
+    if not paths:
+        raise ValueError('ERROR: no reports or bundles in {}'.format(directory))
+    return paths
+
+
+def descendants(pid):
+    """
+    Pids of every process below pid, from the parent pids in /proc.
+    """
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as fd:
+                # The command name in parentheses may itself hold spaces
+                ppid = int(fd.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    found, pending = [], [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def process_rss(pid):
+    try:
+        with open('/proc/{}/statm'.format(pid)) as fd:
+            return int(fd.read().split()[1]) * PAGE_SIZE
+    except (IOError, OSError):
+        # Exited since it was listed
+        return 0
+
+
+class RssSampler(threading.Thread):
+    """
+    Samples the summed resident size of the harness's child processes.
+    """
+    def __init__(self, interval):
+        super(RssSampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.samples = []
+        self.started_at = time.time()
+        self.stopped = threading.Event()
+
+    def sample(self):
+        rss = sum(process_rss(x) for x in descendants(os.getpid()))
+        self.samples.append([round(time.time() - self.started_at, 3), rss])
+
+    def run(self):
+        self.sample()
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def conversion_args(options, xml_file, out_file):
+    return argparse.Namespace(
+        xml_file=xml_file, out_file=out_file, pdf_out_file=None, vcf_out_file=None, sv_vcf_out_file=None,
+        removed_out_file=None, manifest_file=None, fhir_url=None, json_format='compact', sections=None,
+        no_hgvs=options.fasta is None, project_id=options.project_id, subject_id=None, file_url=None,
+        sequence_id=None, fasta=options.fasta, genes=options.genes)
+
+
+def output_path(out_dir, number, xml_file):
+    # Bundles are written to a directory of per-report files
+    return os.path.join(out_dir, str(number) if is_archive(xml_file) else '{}.json'.format(number))
+
+
+_worker = {}
+
+
+def _init_pool_worker(options):
+    enable_normalization_cache()
+    _worker['options'] = options
+    _worker['cache'] = ReportCache(options.report_cache) if options.report_cache is not None else None
+
+
+def _pool_convert(number, xml_file, out_dir):
+    options, cache = _worker['options'], _worker['cache']
+    error = None
+    try:
+        convert_sources(conversion_args(options, xml_file, output_path(out_dir, number, xml_file)), cache=cache)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    return {
+        'error': error,
+        'pid': os.getpid(),
+        'normalization': dict(get_normalization_stats()),
+        'report_cache': {'hits': cache.hits, 'misses': cache.misses} if cache is not None else None
+    }
+
+
+def hit_ratio(hits, misses):
+    return {'hits': hits, 'misses': misses, 'ratio': float(hits) / (hits + misses) if hits + misses else None}
+
+
+class PoolTarget(object):
+    """
+    A pool of worker processes, forked once after the snapshot is loaded,
+    that convert reports in process and keep their caches between them.
+    """
+    def __init__(self, options, work_dir):
+        self.out_dir = os.path.join(work_dir, 'out')
+        os.makedirs(self.out_dir)
+        if options.snapshot_file is not None:
+            enable_normalization_cache()
+            load_snapshot(options.snapshot_file, options.fasta, options.genes, VERSION)
+        self.pool = Pool(options.concurrency, _init_pool_worker, (options,))
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def request(self, number, xml_file):
+        result = self.pool.apply(_pool_convert, (number, xml_file, self.out_dir))
+        lookups = lambda x: sum(x['normalization'].values()) + sum((x['report_cache'] or {}).values())
+        with self.lock:
+            # The counters are cumulative per worker, so its latest result
+            # counts; results of one worker may come back out of order
+            latest = self.workers.get(result['pid'])
+            if latest is None or lookups(result) >= lookups(latest):
+                self.workers[result['pid']] = result
+        return result['error']
+
+    def cache_stats(self):
+        stats = {'normalization': None, 'report': None}
+        workers = list(self.workers.values())
+        if workers:
+            stats['normalization'] = hit_ratio(sum(x['normalization']['hits'] for x in workers),
+                                               sum(x['normalization']['misses'] for x in workers))
+        if workers and workers[0]['report_cache'] is not None:
+            stats['report'] = hit_ratio(sum(x['report_cache']['hits'] for x in workers),
+                                        sum(x['report_cache']['misses'] for x in workers))
+        return stats
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def convert_options(options):
+    command = ['-p', options.project_id, '--json-format', 'compact']
+    if options.fasta is None:
+        command.append('--no-hgvs')
+    else:
+        command.extend(['-r', options.fasta, '-g', options.genes])
+    if options.snapshot_file is not None:
+        command.extend(['--snapshot', options.snapshot_file])
+    if options.report_cache is not None:
+        command.extend(['--report-cache', options.report_cache])
+    return command + shlex.split(options.convert_args or '')
+
+
+class CliTarget(object):
+    """
+    One convert.py process per report, at most --concurrency at a time, so
+    every report pays for interpreter start-up and cold caches.
+    """
+    def __init__(self, options, work_dir):
+        self.options = options
+        self.out_dir = os.path.join(work_dir, 'out')
+        os.makedirs(self.out_dir)
+        self.slots = threading.Semaphore(options.concurrency)
+
+    def request(self, number, xml_file):
+        command = [sys.executable, CONVERT, '-x', xml_file, '-o', output_path(self.out_dir, number, xml_file)]
+        with self.slots:
+            process = subprocess.Popen(command + convert_options(self.options), stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+        if process.returncode != 0:
+            return 'exit status {}: {}'.format(process.returncode, output.decode('utf-8', 'replace').strip()[-500:])
+        return None
+
+    def cache_stats(self):
+        # The caches die with each process
+        return {'normalization': None, 'report': None}
+
+    def close(self):
+        pass
+
+
+class WatchTarget(object):
+    """
+    A convert.py --watch daemon with --concurrency workers. Each report is
+    copied in under a hidden name and renamed into the watched folder, and
+    is complete once the daemon has moved it to done/ or failed/.
+    """
+    def __init__(self, options, work_dir):
+        self.options = options
+        self.inbox = os.path.join(work_dir, 'inbox')
+        self.done_dir = os.path.join(self.inbox, 'done')
+        self.failed_dir = os.path.join(self.inbox, 'failed')
+        os.makedirs(self.inbox)
+        command = [sys.executable, CONVERT, '--watch', self.inbox, '-o', os.path.join(work_dir, 'out'),
+                   '--watch-workers', str(options.concurrency), '--settle-time', '0',
+                   '--poll-interval', str(options.poll_interval)]
+        self.log = open(os.path.join(work_dir, 'watch.log'), 'wb')
+        self.process = subprocess.Popen(command + convert_options(options), stdout=self.log,
+                                        stderr=subprocess.STDOUT)
+        deadline = time.time() + options.timeout
+        while not os.path.isdir(self.failed_dir):
+            if self.process.poll() is not None or time.time() > deadline:
+                raise ValueError('ERROR: the watch daemon did not start, see {}'.format(self.log.name))
+            time.sleep(WATCH_CHECK_INTERVAL)
+
+    def request(self, number, xml_file):
+        name = '{}-{}'.format(number, os.path.basename(xml_file))
+        staged = os.path.join(self.inbox, '.' + name)
+        shutil.copyfile(xml_file, staged)
+        os.rename(staged, os.path.join(self.inbox, name))
+
+        deadline = time.time() + self.options.timeout
+        while time.time() < deadline:
+            if os.path.exists(os.path.join(self.done_dir, name)):
+                return None
+            if os.path.exists(os.path.join(self.failed_dir, name)):
+                with open(os.path.join(self.failed_dir, name + '.error')) as fd:
+                    return fd.read().strip().splitlines()[-1]
+            time.sleep(WATCH_CHECK_INTERVAL)
+        return 'timed out after {} seconds'.format(self.options.timeout)
+
+    def cache_stats(self):
+        # The daemon's workers do not report their caches
+        return {'normalization': None, 'report': None}
+
+    def close(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait()
+        self.log.close()
+
+
+def run_load(target, corpus, requests, concurrency, rate):
+    """
+    Sends requests reports, cycling through the corpus, and returns a
+    (latency, error) pair per report and the seconds the run took.
+    """
+    results = [None] * requests
+    start = time.time()
+
+    def send(number, arrival):
+        error = target.request(number, corpus[number % len(corpus)])
+        results[number] = (time.time() - arrival, error)
+
+    threads = []
+    if rate is None:
+        # Closed loop: each client sends its next report when the last returns
+        numbers = iter(range(requests))
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    number = next(numbers, None)
+                if number is None:
+                    return
+                send(number, time.time())
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+    else:
+        # Open loop: reports arrive on schedule however far behind the target is
+        for number in range(requests):
+            arrival = start + number / rate
+            time.sleep(max(0, arrival - time.time()))
+            thread = threading.Thread(target=send, args=(number, arrival))
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results, time.time() - start
+
+
+def summarize(options, results, seconds, sampler, cache):
+    latencies = [x[0] for x in results if x[1] is None]
+    errors = [x[1] for x in results if x[1] is not None]
+    return {
+        'target': options.target,
+        'concurrency': options.concurrency,
+        'rate': options.rate,
+        'requests': len(results),
+        'completed': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:10],
+        'seconds': seconds,
+        'throughput': len(latencies) / seconds if seconds else None,
+        'latency': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None
+        },
+        'rss': {
+            'peak': max(x[1] for x in sampler.samples),
+            'samples': sampler.samples
+        },
+        'cache': cache
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load tests the converter with a corpus of reports.')
+    parser.add_argument('--target', dest='target', choices=TARGETS, default='pool',
+                        help='What converts the reports (default: %(default)s)')
+    parser.add_argument('--corpus', dest='corpus_dir', default=None,
+                        help='Directory of reports and bundles to replay')
+    parser.add_argument('--synthetic', dest='synthetic', type=int, default=8,
+                        help='Synthetic reports to generate when no corpus is given (default: %(default)s)')
+    parser.add_argument('--requests', dest='requests', type=int, default=100,
+                        help='Reports to send, cycling through the corpus (default: %(default)s)')
+    parser.add_argument('--concurrency', dest='concurrency', type=int, default=4,
+                        help='Clients, CLI processes or daemon workers (default: %(default)s)')
+    parser.add_argument('--rate', dest='rate', type=float, default=None,
+                        help='Reports per second; by default each client sends back to back')
+    parser.add_argument('-r, --reference', dest='fasta', default=None,
+                        help='Reference genome; without it short variants are skipped')
+    parser.add_argument('-g, --genes', dest='genes', default='/opt/app/refGene.hg19.txt',
+                        help='Genes file (default: %(default)s)')
+    parser.add_argument('-p, --project', dest='project_id', default='loadtest',
+                        help='Project the reports are converted for (default: %(default)s)')
+    parser.add_argument('--snapshot', dest='snapshot_file', default=None,
+                        help='Snapshot the converters load before the run')
+    parser.add_argument('--report-cache', dest='report_cache', default=None,
+                        help='Report cache directory the converters share')
+    parser.add_argument('--convert-args', dest='convert_args', default=None,
+                        help='Extra convert.py options for the cli and watch targets')
+    parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=1.0,
+                        help='Watch daemon poll interval in seconds (default: %(default)s)')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=600.0,
+                        help='Seconds before a watched report counts as failed (default: %(default)s)')
+    parser.add_argument('--sample-interval', dest='sample_interval', type=float, default=0.5,
+                        help='Seconds between memory samples (default: %(default)s)')
+    parser.add_argument('--output', dest='out_file', default=None,
+                        help='File for the JSON results, stdout by default')
+    options = parser.parse_args()
+    if options.rate is not None and options.rate <= 0:
+        parser.error('--rate must be positive')
+
+    work_dir = tempfile.mkdtemp(prefix='loadtest-')
+    try:
+        if options.corpus_dir is not None:
+            corpus = [os.path.abspath(x) for x in read_corpus(options.corpus_dir)]
+        else:
+            corpus_dir = os.path.join(work_dir, 'corpus')
+            os.makedirs(corpus_dir)
+            corpus = build_corpus(corpus_dir, options.synthetic)
+
+        target = {'pool': PoolTarget, 'cli': CliTarget, 'watch': WatchTarget}[options.target](options, work_dir)
+        sampler = RssSampler(options.sample_interval)
+        sampler.start()
+        try:
+            results, seconds = run_load(target, corpus, options.requests, options.concurrency, options.rate)
+            cache = target.cache_stats()
+        finally:
+            sampler.stop()
+            target.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+    summary = summarize(options, results, seconds, sampler, cache)
+    if options.out_file is None:
+        json.dump(summary, sys.stdout, sort_keys=True, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(options.out_file, 'w') as fd:
+            json.dump(summary, fd, sort_keys=True, indent=2)
+
+
+if __name__ == '__main__':
+    main()
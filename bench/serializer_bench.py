@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Times save_json's serializer backends on synthetic multi-thousand-resource
+reports. Run from the repository root: python bench/serializer_bench.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from convert import create_copy_number_observation, create_rearrangement_observation
+from serializers import available_backends, dumps_json
+
+
+def synthetic_resources(count):
+    cnv = create_copy_number_observation('project1', 'subject1', 'specimen1', 'sample1', 'sequence1')
+    rearrangement = create_rearrangement_observation('project1', 'subject1', 'specimen1', 'sample1', 'sequence1')
+    resources = []
+    for i in range(count):
+        if i % 2:
+            resources.append(cnv({
+                '@gene': 'GENE{}'.format(i),
+                '@position': 'chr12:{}-{}'.format(58093932 + i, 58188144 + i),
+                '@copy-number': '44',
+                '@status': 'known',
+                '@type': 'amplification',
+                '@number-of-exons': '5 of 5'
+            }))
+        else:
+            resources.append(rearrangement({
+                '@status': 'known',
+                '@targeted-gene': 'GENE{}'.format(i),
+                '@type': 'truncation',
+                '@pos1': 'chr17:{}-29887856'.format(29557687 + i),
+                '@pos2': 'chr6:66426718-66427149'
+            }))
+    return resources
+
+
+def main():
+    # The backend save_json uses; a named backend is always the one that runs
+    print('default backend: {}'.format(available_backends()[0]))
+    for count in (1000, 5000, 20000):
+        resources = synthetic_resources(count)
+        for backend in available_backends():
+            for pretty in (True, False):
+                seconds = min(timeit.repeat(lambda: dumps_json(resources, pretty, backend), number=1, repeat=5))
+                size = len(dumps_json(resources, pretty, backend))
+                print('{:>6} resources  {:<7} {:<8} {:8.1f} ms  {:>10} bytes'.format(
+                    count, backend, 'pretty' if pretty else 'compact', seconds * 1000, size))
+
+
+if __name__ == '__main__':
+    main()
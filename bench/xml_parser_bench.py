@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Times read_xml's parser backends on synthetic large reports built by
+repeating the short variants of test/data/sample.xml and padding the PDF.
+Run from the repository root: python bench/xml_parser_bench.py
+"""
+import io
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from parsers import available_backends, parse_xml
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'data', 'sample.xml')
+
+
+def synthetic_report(copies, pdf_bytes):
+    with open(SAMPLE, 'rb') as fd:
+        report = fd.read()
+    variants = re.search(br'(<short-variant .*?</short-variant>\s*)+', report, re.S)
+    report = report[:variants.start()] + variants.group(0) * copies + report[variants.end():]
+    pdf = re.search(br'<ReportPDF>(.*?)</ReportPDF>', report, re.S)
+    return report[:pdf.start(1)] + b'A' * pdf_bytes + report[pdf.end(1):]
+
+
+def main():
+    for copies, pdf_bytes in ((1, 1 << 20), (100, 4 << 20), (1000, 16 << 20)):
+        report = synthetic_report(copies, pdf_bytes)
+        for backend in available_backends():
+            for skip in ((), (('rr:ResultsPayload', 'ReportPDF'),)):
+                seconds = min(timeit.repeat(lambda: parse_xml(io.BytesIO(report), skip, backend), number=1, repeat=3))
+                print('{:>10} bytes  {:<9} {:<9} {:8.1f} ms'.format(
+                    len(report), backend, 'no-pdf' if skip else 'full', seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 #!/bin/sh
 
-grep "^#" ./unsorted.vcf > $1 && grep -v "^#" ./unsorted.vcf | \
-  sort -V -k1,1 -k2,2n >> $1
\ No newline at end of file
+UNSORTED=${2:-./unsorted.vcf}
+
+grep "^#" "$UNSORTED" > $1 && grep -v "^#" "$UNSORTED" | \
+  sort -V -k1,1 -k2,2n >> $1
@@ -0,0 +1,252 @@
+import os
+import re
+import struct
+import zlib
+
+
+# Uncompressed bytes per BGZF block, as written by htslib.
+BGZF_BLOCK_SIZE = 0xff00
+
+# gzip header with the BC extra subfield holding the compressed block size.
+BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+BGZF_TRAILER = struct.Struct('<II')
+BGZF_EOF = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00'
+            b'\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+# Binning scheme shared by .tbi and .csi: 16 kb windows, 6 levels.
+INDEX_MIN_SHIFT = 14
+INDEX_DEPTH = 5
+
+# tabix configuration for VCF: format, sequence, begin and end columns,
+# meta character and lines to skip.
+TABIX_VCF_CONF = struct.Struct('<6i')
+TABIX_FORMAT_VCF = 2
+
+INDEX_FORMATS = ('tbi', 'csi')
+
+_END = re.compile(r'(?:^|;)END=([0-9]+)(?:;|$)')
+
+
+def natural_key(value):
+    return [int(part) if part.isdigit() else part for part in re.split(r'([0-9]+)', value)]
+
+
+def record_key(line):
+    chrom, pos = line.split('\t', 2)[:2]
+    return natural_key(chrom), int(pos)
+
+
+def sort_records(lines):
+    """
+    Orders VCF data lines by contig and position, the same order sort.sh
+    produces with sort -V -k1,1 -k2,2n.
+    """
+    return sorted(lines, key=record_key)
+
+
+def record_span(line):
+    """
+    Zero-based half-open interval a VCF record covers: REF's length, or the
+    INFO END of symbolic alleles.
+    """
+    fields = line.split('\t', 8)
+    start = int(fields[1]) - 1
+    end = start + len(fields[3])
+    if len(fields) > 7:
+        match = _END.search(fields[7])
+        if match is not None:
+            end = max(end, int(match.group(1)))
+    return fields[0], start, end
+
+
+def reg2bin(start, end, min_shift=INDEX_MIN_SHIFT, depth=INDEX_DEPTH):
+    end -= 1
+    level, shift = depth, min_shift
+    offset = ((1 << (depth * 3)) - 1) // 7
+    while level > 0:
+        if start >> shift == end >> shift:
+            return offset + (start >> shift)
+        level -= 1
+        shift += 3
+        offset -= 1 << (level * 3)
+    return 0
+
+
+def bin_first_window(bin, min_shift=INDEX_MIN_SHIFT, depth=INDEX_DEPTH):
+    level, offset = 0, 0
+    while bin >= offset + (1 << (level * 3)):
+        offset += 1 << (level * 3)
+        level += 1
+    return (bin - offset) << ((depth - level) * 3)
+
+
+class BgzfWriter(object):
+    """
+    Writes BGZF, the blocked gzip htslib reads, and reports the virtual
+    offset (compressed block start << 16 | offset in block) of the next byte
+    so records can be indexed as they are written.
+    """
+    def __init__(self, fd, level=6):
+        self.fd = fd
+        self.level = level
+        self.block_start = 0
+        self.buffer = []
+        self.buffered = 0
+
+    def tell(self):
+        return (self.block_start << 16) | self.buffered
+
+    def write(self, data):
+        while data:
+            chunk = data[:BGZF_BLOCK_SIZE - self.buffered]
+            data = data[len(chunk):]
+            self.buffer.append(chunk)
+            self.buffered += len(chunk)
+            if self.buffered == BGZF_BLOCK_SIZE:
+                self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        data = b''.join(self.buffer)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        size = BGZF_HEADER.size + len(compressed) + BGZF_TRAILER.size
+        self.fd.write(BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, size - 1))
+        self.fd.write(compressed)
+        self.fd.write(BGZF_TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data)))
+        self.block_start += size
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.fd.write(BGZF_EOF)
+        self.block_start += len(BGZF_EOF)
+
+
+class VcfIndex(object):
+    """
+    Collects the bins, chunks and 16 kb linear index of a coordinate sorted
+    BGZF VCF from the virtual offsets of each record, and serializes them as
+    a tabix (.tbi) or CSI (.csi) index.
+    """
+    def __init__(self):
+        self.names = []
+        self.references = {}
+
+    def add(self, chrom, start, end, begin_offset, end_offset):
+        reference = self.references.get(chrom)
+        if reference is None:
+            reference = self.references[chrom] = ({}, [])
+            self.names.append(chrom)
+        bins, linear = reference
+
+        chunks = bins.setdefault(reg2bin(start, end), [])
+        if chunks and chunks[-1][1] == begin_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([begin_offset, end_offset])
+
+        last_window = (max(end, start + 1) - 1) >> INDEX_MIN_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(start >> INDEX_MIN_SHIFT, last_window + 1):
+            if linear[window] is None:
+                linear[window] = begin_offset
+
+    def linear_index(self, chrom):
+        offsets, previous = [], 0
+        for offset in self.references[chrom][1]:
+            previous = previous if offset is None else offset
+            offsets.append(previous)
+        return offsets
+
+    def tabix_header(self):
+        names = b''.join(name.encode('utf-8') + b'\0' for name in self.names)
+        return TABIX_VCF_CONF.pack(TABIX_FORMAT_VCF, 1, 2, 0, ord('#'), 0) + struct.pack('<i', len(names)) + names
+
+    def tbi(self):
+        data = [b'TBI\1', struct.pack('<i', len(self.names)), self.tabix_header()]
+        for name in self.names:
+            bins = self.references[name][0]
+            data.append(struct.pack('<i', len(bins)))
+            for bin in sorted(bins):
+                data.append(struct.pack('<Ii', bin, len(bins[bin])))
+                data.extend(struct.pack('<QQ', begin, end) for begin, end in bins[bin])
+            linear = self.linear_index(name)
+            data.append(struct.pack('<i', len(linear)))
+            data.extend(struct.pack('<Q', offset) for offset in linear)
+        return b''.join(data)
+
+    def csi(self):
+        aux = self.tabix_header()
+        data = [b'CSI\1', struct.pack('<iii', INDEX_MIN_SHIFT, INDEX_DEPTH, len(aux)), aux,
+                struct.pack('<i', len(self.names))]
+        for name in self.names:
+            bins = self.references[name][0]
+            linear = self.linear_index(name)
+            data.append(struct.pack('<i', len(bins)))
+            for bin in sorted(bins):
+                window = bin_first_window(bin)
+                loffset = linear[window] if window < len(linear) else bins[bin][0][0]
+                data.append(struct.pack('<IQi', bin, min(loffset, bins[bin][0][0]), len(bins[bin])))
+                data.extend(struct.pack('<QQ', begin, end) for begin, end in bins[bin])
+        return b''.join(data)
+
+
+def write_bgzf_vcf(header, records, vcf_out_file, index_format='tbi', presorted=False):
+    """
+    Sorts the records and writes them after the header lines as BGZF to
+    vcf_out_file, building the .tbi or .csi index in the same pass. Both
+    files are written beside their final paths and renamed into place.
+    Presorted records are streamed from the iterable as they are written.
+    """
+    if index_format not in INDEX_FORMATS:
+        raise ValueError('ERROR: unknown VCF index format {}'.format(index_format))
+
+    index = VcfIndex()
+    tmp_file = '{}.tmp'.format(vcf_out_file)
+    with open(tmp_file, 'wb') as fd:
+        writer = BgzfWriter(fd)
+        writer.write(''.join(header).encode('utf-8'))
+        for line in records if presorted else sort_records(records):
+            chrom, start, end = record_span(line)
+            begin_offset = writer.tell()
+            writer.write(line.encode('utf-8'))
+            index.add(chrom, start, end, begin_offset, writer.tell())
+        writer.close()
+
+    index_file = '{}.{}'.format(vcf_out_file, index_format)
+    tmp_index_file = '{}.tmp'.format(index_file)
+    with open(tmp_index_file, 'wb') as fd:
+        writer = BgzfWriter(fd)
+        writer.write(index.tbi() if index_format == 'tbi' else index.csi())
+        writer.close()
+
+    os.rename(tmp_file, vcf_out_file)
+    os.rename(tmp_index_file, index_file)
+
+
+def write_sorted_vcf(header, records, vcf_out_file, index_format=None, presorted=False):
+    """
+    Writes the header and sorted records as plain text, or as indexed BGZF
+    when index_format is given.
+    """
+    if index_format is not None:
+        write_bgzf_vcf(header, records, vcf_out_file, index_format, presorted)
+        return
+
+    tmp_file = '{}.tmp'.format(vcf_out_file)
+    with open(tmp_file, 'w') as fd:
+        fd.writelines(header)
+        fd.writelines(records if presorted else sort_records(records))
+    os.rename(tmp_file, vcf_out_file)
+
+
+def sort_vcf(unsorted_file, vcf_out_file, index_format='tbi'):
+    header, records = [], []
+    with open(unsorted_file) as fd:
+        for line in fd:
+            (header if line.startswith('#') else records).append(line)
+    write_bgzf_vcf(header, records, vcf_out_file, index_format)
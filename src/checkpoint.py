@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DONE = 'done'
+FAILED = 'failed'
+
+# Records buffered, and seconds they may wait, before the journal is written
+# and fsynced.
+JOURNAL_BATCH_SIZE = 100
+JOURNAL_INTERVAL = 5.0
+
+
+class CheckpointJournal(object):
+    """
+    Append-only journal of a batch run: one JSON line per converted or failed
+    report with its key, input digest, output paths and status. Records are
+    buffered and written with one fsync per batch, so a crash loses at most
+    the last batch and those reports are converted again on restart. A
+    restarted run skips the reports whose latest record is done for the same
+    input digest and converts the rest.
+    """
+    def __init__(self, path, batch_size=JOURNAL_BATCH_SIZE, interval=JOURNAL_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.reports = {}
+        torn = False
+        if os.path.isfile(path):
+            torn = self.load()
+        self.fd = open(path, 'a')
+        if torn:
+            self.fd.write('\n')
+        self.buffer = []
+        self.last_flush = time.time()
+
+    def load(self):
+        """
+        Reads the latest record of every report. Returns True when the last
+        line was cut short, so the next record must start on a new line.
+        """
+        line = '\n'
+        with open(self.path) as fd:
+            for number, line in enumerate(fd, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record torn by a crash mid-write
+                    logger.warning('Ignoring unreadable line %d of checkpoint journal %s', number, self.path)
+                    continue
+                self.reports[record['key']] = record
+        logger.info('Loaded %d reports from checkpoint journal %s', len(self.reports), self.path)
+        return not line.endswith('\n')
+
+    def is_done(self, key, xml_digest=None):
+        """
+        Whether the latest record of a report is done and, when xml_digest is
+        given, was made for the same input.
+        """
+        record = self.reports.get(key, {})
+        return record.get('status') == DONE and xml_digest in (None, record.get('xml_digest'))
+
+    def record(self, key, xml_digest, status, outputs=(), error=None):
+        record = {
+            'key': key,
+            'xml_digest': xml_digest,
+            'status': status,
+            'outputs': list(outputs),
+            'error': error,
+            'time': time.time()
+        }
+        self.reports[key] = record
+        self.buffer.append(json.dumps(record, sort_keys=True) + '\n')
+        if len(self.buffer) >= self.batch_size or time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.fd.write(''.join(self.buffer))
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+            self.buffer = []
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.fd.close()
@@ -0,0 +1,171 @@
+import gzip
+import heapq
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from bgzf import natural_key, write_sorted_vcf
+
+
+logger = logging.getLogger(__name__)
+
+# Inputs merged in one pass. Larger cohorts are merged in groups first so the
+# number of open files stays bounded.
+MAX_MERGE_INPUTS = 256
+
+MISSING_GENOTYPE = './.'
+
+# INFO fields describing a single sample rather than the site; the same
+# values are kept per sample in FORMAT DP and AD.
+SAMPLE_INFO = ('DP', 'AF', 'NS')
+
+NS_INFO = '##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of Samples With Data">\n'
+
+
+def open_vcf(path):
+    if path.lower().endswith(('.gz', '.bgz')):
+        return io.TextIOWrapper(gzip.open(path, 'rb'))
+    return open(path)
+
+
+class VcfInput(object):
+    """
+    A sorted VCF read one position at a time, keyed by (contig, pos, ref,
+    alt).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = open_vcf(path)
+        self.header = []
+        self.samples = []
+        for line in self.fd:
+            if line.startswith('#CHROM'):
+                self.samples = line.rstrip('\n').split('\t')[9:]
+                break
+            self.header.append(line)
+
+    def records(self, number):
+        # Inputs are sorted by contig and position only, so the few records
+        # sharing a position are ordered by ref and alt before they are merged
+        position, records = None, []
+        for line in self.fd:
+            fields = line.rstrip('\n').split('\t')
+            key = (natural_key(fields[0]), int(fields[1]))
+            if key != position:
+                if position is not None and key < position:
+                    raise ValueError('ERROR: {} is not sorted at {}:{}'.format(self.path, fields[0], fields[1]))
+                for record in sorted(records):
+                    yield record
+                position, records = key, []
+            records.append((key + (fields[3], fields[4]), number, fields))
+        for record in sorted(records):
+            yield record
+
+    def close(self):
+        self.fd.close()
+
+
+def cohort_header(inputs):
+    header = [line for line in inputs[0].header if not line.startswith('##INFO=<ID=NS,')]
+    info = [i for i, line in enumerate(header) if line.startswith('##INFO=')]
+    header.insert(info[-1] + 1 if info else len(header), NS_INFO)
+
+    samples, seen = [], set()
+    for vcf in inputs:
+        for sample in vcf.samples:
+            name, suffix = sample, 1
+            while name in seen:
+                suffix += 1
+                name = '{}_{}'.format(sample, suffix)
+            if name != sample:
+                logger.warning('Renamed duplicate sample %s from %s to %s', sample, vcf.path, name)
+            seen.add(name)
+            samples.append(name)
+    header.append('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT'] + samples) + '\n')
+    return header
+
+
+def sample_columns(fields, format_keys):
+    if len(fields) < 9 or fields[8] == ':'.join(format_keys):
+        return fields[9:]
+    keys = fields[8].split(':')
+    columns = []
+    for column in fields[9:]:
+        values = dict(zip(keys, column.split(':')))
+        columns.append(':'.join(values.get(key, '.') for key in format_keys))
+    return columns
+
+
+def merged_record(inputs, records):
+    first = records[min(records)]
+    format_keys = first[8].split(':') if len(first) > 8 else ['GT']
+
+    columns = []
+    for number, vcf in enumerate(inputs):
+        if number in records:
+            columns.extend(sample_columns(records[number], format_keys))
+        else:
+            columns.extend([MISSING_GENOTYPE] * len(vcf.samples))
+    called = sum(1 for column in columns if not column.startswith(MISSING_GENOTYPE))
+
+    info = [x for x in first[7].split(';') if x != '.' and x.split('=', 1)[0] not in SAMPLE_INFO]
+    info.append('NS={}'.format(called))
+    ids = [fields[2] for fields in records.values() if fields[2] != '.']
+    return '\t'.join(first[:2] + [ids[0] if ids else '.'] + first[3:7] +
+                     [';'.join(info), ':'.join(format_keys)] + columns) + '\n'
+
+
+def merge_records(inputs):
+    """
+    Streams the cohort records: a k-way merge of the inputs on (contig, pos,
+    ref, alt) holding one position per input, with missing genotypes
+    filled for the inputs that lack a site.
+    """
+    current_key, records = None, {}
+    for key, number, fields in heapq.merge(*[vcf.records(i) for i, vcf in enumerate(inputs)]):
+        if records and (key != current_key or number in records):
+            yield merged_record(inputs, records)
+            records = {}
+        current_key = key
+        records[number] = fields
+    if records:
+        yield merged_record(inputs, records)
+
+
+def merge_vcfs(vcf_files, out_file, index_format=None):
+    """
+    Merges sorted single or multi-sample VCFs into one multi-sample VCF,
+    BGZF-compressed with a .tbi or .csi index when index_format is given.
+    """
+    if not vcf_files:
+        raise ValueError('ERROR: no VCF files to merge into {}'.format(out_file))
+
+    if len(vcf_files) > MAX_MERGE_INPUTS:
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_file)))
+        try:
+            parts = []
+            for i in range(0, len(vcf_files), MAX_MERGE_INPUTS):
+                parts.append(os.path.join(tmp_dir, 'part{}.vcf'.format(len(parts))))
+                merge_vcfs(vcf_files[i:i + MAX_MERGE_INPUTS], parts[-1])
+            merge_vcfs(parts, out_file, index_format)
+        finally:
+            shutil.rmtree(tmp_dir)
+        return
+
+    inputs = []
+    try:
+        for path in vcf_files:
+            inputs.append(VcfInput(path))
+        write_sorted_vcf(cohort_header(inputs), merge_records(inputs), out_file, index_format, presorted=True)
+    finally:
+        for vcf in inputs:
+            vcf.close()
+    logger.info('Merged %d VCF files into %s', len(vcf_files), out_file)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    merge_vcfs(sys.argv[2:], sys.argv[1], 'tbi' if sys.argv[1].lower().endswith(('.gz', '.bgz')) else None)
@@ -0,0 +1,118 @@
+import logging
+import os
+import uuid
+from collections import OrderedDict
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# Rows buffered per table and project before they are written as one row
+# group (Parquet) or record batch (Arrow).
+ROW_GROUP_SIZE = 65536
+
+# Columns of each exported table, typed by pyarrow type factory name. Files
+# are partitioned by project, Hive style (<table>/project_id=<project>/), so
+# the project is not repeated inside them.
+TABLES = OrderedDict([
+    ('short_variants', [
+        ('report_id', 'string'), ('sample', 'string'), ('chrom', 'string'), ('pos', 'int64'),
+        ('ref', 'string'), ('alt', 'string'), ('gene', 'string'), ('transcript', 'string'),
+        ('cds_effect', 'string'), ('protein_effect', 'string'), ('functional_effect', 'string'),
+        ('depth', 'int64'), ('allele_fraction', 'float64'), ('status', 'string'), ('equivocal', 'bool_')
+    ]),
+    ('copy_numbers', [
+        ('report_id', 'string'), ('sample', 'string'), ('gene', 'string'), ('chrom', 'string'),
+        ('start', 'int64'), ('end', 'int64'), ('copy_number', 'int64'), ('ratio', 'float64'),
+        ('type', 'string'), ('exons', 'string'), ('status', 'string'), ('equivocal', 'bool_')
+    ]),
+    ('rearrangements', [
+        ('report_id', 'string'), ('sample', 'string'), ('target_gene', 'string'), ('other_gene', 'string'),
+        ('type', 'string'), ('pos1', 'string'), ('pos2', 'string'), ('in_frame', 'string'),
+        ('supporting_read_pairs', 'int64'), ('status', 'string'), ('equivocal', 'bool_')
+    ]),
+    ('biomarkers', [
+        ('report_id', 'string'), ('sample', 'string'), ('name', 'string'), ('status', 'string'),
+        ('score', 'float64'), ('unit', 'string')
+    ])
+])
+
+
+def partition_name(project_id):
+    return 'project_id={}'.format(str(project_id).replace('/', '_'))
+
+
+class ColumnarWriter(object):
+    """
+    Writes the rows extracted from reports as Parquet or Arrow IPC files, one
+    open file per table and project. Rows are buffered until row_group_size
+    of them are ready, so memory stays bounded however many reports are
+    exported. Files are written under a temporary name and renamed into
+    place on close.
+    """
+    def __init__(self, out_dir, file_format='parquet', row_group_size=ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise ImportError('Columnar export requires the pyarrow package')
+        if file_format not in COLUMNAR_FORMATS:
+            raise ValueError('ERROR: unknown columnar format {}'.format(file_format))
+        self.out_dir = out_dir
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.tables = tuple(TABLES)
+        self.schemas = dict((table, pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in columns]))
+                            for table, columns in TABLES.items())
+        self.buffers = {}
+        self.writers = {}
+        self.rows = 0
+
+    def write(self, table, project_id, row):
+        buffer = self.buffers.setdefault((table, project_id), [])
+        buffer.append(row)
+        self.rows += 1
+        if len(buffer) >= self.row_group_size:
+            self.flush(table, project_id)
+
+    def open(self, table, project_id):
+        directory = os.path.join(self.out_dir, table, partition_name(project_id))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, 'part-{}.{}'.format(uuid.uuid4().hex, self.file_format))
+        tmp_path = '{}.tmp'.format(path)
+        if self.file_format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(tmp_path, self.schemas[table])
+        else:
+            writer = pyarrow.ipc.new_file(tmp_path, self.schemas[table])
+        self.writers[(table, project_id)] = (writer, tmp_path, path)
+        return writer
+
+    def flush(self, table, project_id):
+        rows = self.buffers.pop((table, project_id), [])
+        if not rows:
+            return
+        writer = self.writers[(table, project_id)][0] if (table, project_id) in self.writers else \
+            self.open(table, project_id)
+        schema = self.schemas[table]
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array([row.get(field.name) for row in rows], type=field.type) for field in schema], schema=schema)
+        if self.file_format == 'parquet':
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+
+    def close(self):
+        for table, project_id in list(self.buffers):
+            self.flush(table, project_id)
+        for writer, tmp_path, path in self.writers.values():
+            writer.close()
+            os.rename(tmp_path, path)
+            logger.info('Saved %s', path)
+        self.writers = {}
+        logger.info('Exported %d rows to %s', self.rows, self.out_dir)
@@ -1,15 +1,33 @@
 #!/usr/bin/env python
 import argparse
 import base64
+import copy
 import json
 import logging
 import uuid
-import xmltodict
 import os
 import gzip
+import hashlib
+import io
+import time
 import datetime
 import shutil
-from utils import parse_hgvs, parse_splice
+import tempfile
+from collections import OrderedDict
+from utils import (parse_hgvs, parse_splice, plan_reference_windows, reference_window,
+                   enable_normalization_cache, get_normalization_cache, get_normalization_stats)
+from transcripts import plan_transcripts, transcript_accession
+from intervals import get_transcript_index
+from manifest import Manifest, file_digest
+from snapshot import build_snapshot, load_snapshot
+from serializers import dumps_json
+from bgzf import INDEX_FORMATS, sort_vcf
+from checkpoint import DONE, FAILED, CheckpointJournal
+from sv import VCF_CONTIGS, parse_position, sv_records, write_sv_vcf
+from parsers import parse_xml
+from maf import MafWriter
+from report_cache import ReportCache
+from sources import DigestReader, STDIN, is_archive, open_sources, report_name
 from subprocess import call
 
 
@@ -17,15 +35,117 @@ logging.basicConfig(level=logging.INFO,
                     format='[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s')
 logger = logging.getLogger(__name__)
 
-
-def read_xml(xml_file):
-    with open(xml_file) as fd:
-        return xmltodict.parse(fd.read())
-
-
-def save_json(fhir_resources, out_file):
+# Bump whenever the FHIR mappings change; incremental runs reconvert every
+# report produced by a different version.
+VERSION = '1.0.0'
+
+# Where process() stages a report's VCF unless told otherwise; conversions
+# stage in a temporary file of their own.
+UNSORTED_VCF = './unsorted.vcf'
+
+
+# Report sections that --sections can select, and the (parent, element) each
+# one is read from.
+SECTIONS = OrderedDict([
+    ('short-variant', ('variant-report', 'short-variants')),
+    ('cnv', ('variant-report', 'copy-number-alterations')),
+    ('rearrangement', ('variant-report', 'rearrangements')),
+    ('biomarkers', ('variant-report', 'biomarkers')),
+    ('pdf', ('rr:ResultsPayload', 'ReportPDF'))
+])
+
+
+def parse_sections(value):
+    sections = [x.strip() for x in value.split(',') if x.strip()]
+    unknown = [x for x in sections if x not in SECTIONS]
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown sections {}, choose from {}'.format(
+            ', '.join(unknown), ', '.join(SECTIONS)))
+    return sections
+
+
+def project_setting(kind, minimum, exclusive=False):
+    """
+    argparse type for PROJECT=VALUE options, with VALUE of kind and at least
+    minimum, or above it when exclusive.
+    """
+    def parse(value):
+        project, _, setting = value.rpartition('=')
+        try:
+            setting = kind(setting)
+        except ValueError:
+            project = None
+        if not project:
+            raise argparse.ArgumentTypeError('expected PROJECT={}, got {}'.format(kind.__name__.upper(), value))
+        # Written to hold for NaN too, which compares false with everything
+        if not (setting > minimum if exclusive else setting >= minimum) or setting == float('inf'):
+            raise argparse.ArgumentTypeError('expected a finite value {} {} in {}'.format(
+                'above' if exclusive else 'of at least', minimum, value))
+        return project, setting
+    return parse
+
+
+def positive_int(value):
+    """
+    argparse type for counts that must be at least 1.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError('expected an integer of at least 1, got {}'.format(value))
+    return number
+
+
+def get_sections(args):
+    sections = set(getattr(args, 'sections', None) or SECTIONS)
+    if getattr(args, 'no_hgvs', False):
+        sections.discard('short-variant')
+    return sections
+
+
+def options_digest(args):
+    """
+    Digest of the options that change the FHIR resources converted from a
+    report, kept in the manifest so a run with other options converts every
+    report again.
+    """
+    sections = get_sections(args)
+    sections.discard('pdf')
+    options = [args.project_id, args.subject_id, args.file_url, args.sequence_id, sorted(sections),
+               args.vcf_out_file is None, getattr(args, 'deterministic_ids', False), args.fasta, args.genes]
+    return hashlib.sha256(json.dumps(options).encode('utf-8')).hexdigest()
+
+
+def read_xml(xml_file, skip=(), backend=None):
+    if not hasattr(xml_file, 'read'):
+        with open(xml_file, 'rb') as fd:
+            return read_xml(fd, skip, backend)
+    return parse_xml(xml_file, skip, backend)
+
+
+# Namespace for deterministic (UUIDv5) resource IDs. Changing it changes every
+# ID produced with --deterministic-ids.
+ID_NAMESPACE = uuid.UUID('5d6f3a52-8c1e-4f0b-9a57-2b8e4c1d7e90')
+
+
+def create_id(id_seed, *parts):
+    if id_seed is None:
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(ID_NAMESPACE, ':'.join([id_seed] + [str(x) for x in parts])))
+
+
+def get_report_id(results_payload_dict):
+    report_id = results_payload_dict['FinalReport'].get('ReportId')
+    if isinstance(report_id, dict):
+        report_id = report_id.get('#text')
+    return report_id
+
+
+def save_json(fhir_resources, out_file, pretty=True):
     with open(out_file, 'wb') as fd:
-        json.dump(fhir_resources, fd, indent=4)
+        fd.write(dumps_json(fhir_resources, pretty))
 
 
 def unzip(zipped_file):
@@ -39,9 +159,10 @@ def unzip(zipped_file):
     return unzipped_file
 
 
-def create_microsatallite_observation(project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id):
+def create_microsatallite_observation(project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id,
+                                      id_seed=None):
     def create(variant_dict):
-        observation_id = str(uuid.uuid4())
+        observation_id = create_id(id_seed, 'Observation', 'microsatellite-instability')
 
         values = {
             'MSI-H': 'MSI-H',
@@ -125,9 +246,10 @@ def create_microsatallite_observation(project_id, subject_id, specimen_id, effec
     return create
 
 
-def create_tumor_mutation_observation(project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id):
+def create_tumor_mutation_observation(project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id,
+                                      id_seed=None):
     def create(variant_dict):
-        observation_id = str(uuid.uuid4())
+        observation_id = create_id(id_seed, 'Observation', 'tumor-mutation-burden')
 
         codes = {
             'high': 'TMB-H',
@@ -232,9 +354,11 @@ def create_tumor_mutation_observation(project_id, subject_id, specimen_id, effec
     return create
 
 
-def create_rearrangement_observation(project_id, subject_id, specimen_id, specimen_name, sequence_id):
+def create_rearrangement_observation(project_id, subject_id, specimen_id, specimen_name, sequence_id, id_seed=None):
     def create(variant_dict):
-        observation_id = str(uuid.uuid4())
+        observation_id = create_id(id_seed, 'Observation', 'rearrangement',
+                                   variant_dict.get('@targeted-gene', variant_dict.get('@target-gene')),
+                                   variant_dict['@type'], variant_dict['@pos1'], variant_dict['@pos2'])
 
         observation = {
             'resourceType': 'Observation',
@@ -350,9 +474,10 @@ def create_rearrangement_observation(project_id, subject_id, specimen_id, specim
     return create
 
 
-def create_copy_number_observation(project_id, subject_id, specimen_id, specimen_name, sequence_id):
+def create_copy_number_observation(project_id, subject_id, specimen_id, specimen_name, sequence_id, id_seed=None):
     def create(variant_dict):
-        observation_id = str(uuid.uuid4())
+        observation_id = create_id(id_seed, 'Observation', 'copy-number', variant_dict['@gene'],
+                                   variant_dict['@type'], variant_dict['@position'])
         position_value = variant_dict['@position']
         region, position = position_value.split(':')
 
@@ -518,19 +643,40 @@ def create_copy_number_observation(project_id, subject_id, specimen_id, specimen
     return create
 
 
-def hgvs_2_vcf (variant_name, genes, functional_effect, cds_effect, position_value, strand, fasta):
+def hgvs_2_vcf(variant_name, genes, functional_effect, cds_effect, position_value, strand, fasta):
+    cache = get_normalization_cache()
+    if cache is None:
+        return resolve_hgvs(variant_name, genes, functional_effect, cds_effect, position_value, strand, fasta)
+
+    key = (fasta, genes, variant_name, functional_effect, cds_effect, position_value, strand)
+    stats = get_normalization_stats()
+    if key in cache:
+        stats['hits'] += 1
+    else:
+        stats['misses'] += 1
+        cache[key] = resolve_hgvs(variant_name, genes, functional_effect, cds_effect, position_value, strand, fasta)
+    return cache[key]
+
+
+def resolve_hgvs(variant_name, genes, functional_effect, cds_effect, position_value, strand, fasta):
     if functional_effect in ['splice', 'frameshift', 'nonframeshift']:
         return parse_splice(cds_effect, position_value, strand, fasta)
-    else:
-        try:
-            return parse_hgvs(variant_name, fasta, genes)
-        except:
+
+    # pyhgvs can only resolve the variant through a transcript that covers it
+    index = get_transcript_index(genes)
+    if index is not None:
+        chrom, position = position_value.split(':')
+        if transcript_accession(variant_name.split(':')[0]) not in index.transcripts_at(chrom, int(position)):
             return parse_splice(cds_effect, position_value, strand, fasta)
 
+    try:
+        return parse_hgvs(variant_name, fasta, genes)
+    except:
+        return parse_splice(cds_effect, position_value, strand, fasta)
+
 
-def create_observation(fasta, genes, project_id, subject_id, specimen_id, specimen_name, sequence_id):
+def create_observation(fasta, genes, project_id, subject_id, specimen_id, specimen_name, sequence_id, id_seed=None):
     def create(variant_dict):
-        observation_id = str(uuid.uuid4())
         position_value = variant_dict['@position']
         functional_effect = variant_dict['@functional-effect']
         strand = variant_dict['@strand']
@@ -539,6 +685,9 @@ def create_observation(fasta, genes, project_id, subject_id, specimen_id, specim
         cds_effect = variant_dict['@cds-effect'].replace('&gt;', '>')
         variant_name = '{}:c.{}'.format(transcript, cds_effect)
         chrom, offset, ref, alt = hgvs_2_vcf(variant_name, genes, functional_effect, cds_effect, position_value, strand, fasta)
+        # The same change can be reported on several transcripts, so the
+        # transcript keeps their Observation IDs apart
+        observation_id = create_id(id_seed, 'Observation', '{}:{}:{}:{}'.format(chrom, offset, ref, alt), transcript)
         variantReadCount = int(round(int(variant_dict['@depth']) * float(variant_dict['@allele-fraction'])))
 
         observation = {
@@ -744,8 +893,8 @@ def create_observation(fasta, genes, project_id, subject_id, specimen_id, specim
 
 
 def create_report(results_payload_dict, project_id, subject_id, specimen_id, specimen_name, effective_date,
-                  file_url=None, sequence_id=None):
-    report_id = str(uuid.uuid4())
+                  file_url=None, sequence_id=None, id_seed=None):
+    report_id = create_id(id_seed, 'DiagnosticReport')
 
     report = {
         'resourceType': 'DiagnosticReport',
@@ -807,9 +956,9 @@ def create_report(results_payload_dict, project_id, subject_id, specimen_id, spe
     return report
 
 
-def create_subject(results_payload_dict, project_id):
-    subject_id = str(uuid.uuid4())
+def create_subject(results_payload_dict, project_id, id_seed=None):
     pmi_dict = results_payload_dict['FinalReport']['PMI']
+    subject_id = create_id(id_seed, 'Patient', pmi_dict['MRN'])
 
     subject = {
         'resourceType': 'Patient',
@@ -846,8 +995,8 @@ def create_subject(results_payload_dict, project_id):
     return subject, subject_id
 
 
-def create_sequence(project_id, subject_id, specimen_id, specimen_name):
-    sequence_id = str(uuid.uuid4())
+def create_sequence(project_id, subject_id, specimen_id, specimen_name, id_seed=None):
+    sequence_id = create_id(id_seed, 'Sequence', specimen_name)
 
     sequence = {
         'resourceType': 'Sequence',
@@ -895,9 +1044,9 @@ def get_specimen_name(results_payload_dict):
     return specimen_name
 
 
-def create_specimen(results_payload_dict, project_id, subject_id):
+def create_specimen(results_payload_dict, project_id, subject_id, id_seed=None):
     specimen_name = get_specimen_name(results_payload_dict)
-    specimen_id = str(uuid.uuid4())
+    specimen_id = create_id(id_seed, 'Specimen', specimen_name)
 
     specimen = {
         'resourceType': 'Specimen',
@@ -930,8 +1079,8 @@ def create_specimen(results_payload_dict, project_id, subject_id):
     return specimen, specimen_id, specimen_name
 
 
-def write_vcf(variants, specimen_name, fasta, genes, vcf_out_file):
-    with open('./unsorted.vcf', 'w+') as vcf_file:
+def write_vcf(variants, specimen_name, fasta, genes, unsorted_vcf_file=UNSORTED_VCF):
+    with open(unsorted_vcf_file, 'w+') as vcf_file:
         vcf_file.write('##fileformat=VCFv4.2\n')
         vcf_file.write('##source=foundation-xml-fhir\n')
         vcf_file.write('##reference=file://{}\n'.format(fasta))
@@ -941,31 +1090,8 @@ def write_vcf(variants, specimen_name, fasta, genes, vcf_out_file):
         vcf_file.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
         vcf_file.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">\n')
         vcf_file.write('##FORMAT=<ID=AD,Number=.,Type=Integer,Description="Number of reads harboring allele (in order specified by GT)">\n')
-        vcf_file.write('##contig=<ID=chr1,length=248956422>\n')
-        vcf_file.write('##contig=<ID=chr2,length=242193529>\n')
-        vcf_file.write('##contig=<ID=chr3,length=198295559>\n')
-        vcf_file.write('##contig=<ID=chr4,length=190214555>\n')
-        vcf_file.write('##contig=<ID=chr5,length=181538259>\n')
-        vcf_file.write('##contig=<ID=chr6,length=170805979>\n')
-        vcf_file.write('##contig=<ID=chr7,length=159345973>\n')
-        vcf_file.write('##contig=<ID=chr8,length=145138636>\n')
-        vcf_file.write('##contig=<ID=chr9,length=138394717>\n')
-        vcf_file.write('##contig=<ID=chr10,length=133797422>\n')
-        vcf_file.write('##contig=<ID=chr11,length=135086622>\n')
-        vcf_file.write('##contig=<ID=chr12,length=133275309>\n')
-        vcf_file.write('##contig=<ID=chr13,length=114364328>\n')
-        vcf_file.write('##contig=<ID=chr14,length=107043718>\n')
-        vcf_file.write('##contig=<ID=chr15,length=101991189>\n')
-        vcf_file.write('##contig=<ID=chr16,length=90338345>\n')
-        vcf_file.write('##contig=<ID=chr17,length=83257441>\n')
-        vcf_file.write('##contig=<ID=chr18,length=80373285>\n')
-        vcf_file.write('##contig=<ID=chr19,length=58617616>\n')
-        vcf_file.write('##contig=<ID=chr20,length=64444167>\n')
-        vcf_file.write('##contig=<ID=chr21,length=46709983>\n')
-        vcf_file.write('##contig=<ID=chr22,length=50818468>\n')
-        vcf_file.write('##contig=<ID=chrX,length=156040895>\n')
-        vcf_file.write('##contig=<ID=chrY,length=57227415>\n')
-        vcf_file.write('##contig=<ID=chrM,length=16569>\n')
+        for chrom, length in VCF_CONTIGS:
+            vcf_file.write('##contig=<ID={},length={}>\n'.format(chrom, length))
         vcf_file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n'.format(specimen_name))
 
         status = {
@@ -994,13 +1120,25 @@ def write_vcf(variants, specimen_name, fasta, genes, vcf_out_file):
             vcf_file.write('{}\t{}\t.\t{}\t{}\t.\tPASS\tDP={};AF={};VENDSIG={}\tGT:DP:AD\t{}:{}:{}\n'.format(chrom, offset, ref, alt, dp, af, vendsig, gt, dp, ad))
 
 
-def process(results_payload_dict, args):
+def process(results_payload_dict, args, unsorted_vcf_file=UNSORTED_VCF):
+    """
+    Creates the FHIR resources of a report. With -v the report's short
+    variants are staged in unsorted_vcf_file for sorting, or only the VCF
+    header when short variants are not converted.
+    """
     fhir_resources = []
     subject_id = args.subject_id
 
+    id_seed = None
+    if getattr(args, 'deterministic_ids', False):
+        report_id = get_report_id(results_payload_dict)
+        if report_id is None:
+            raise ValueError('ERROR: deterministic IDs require a FinalReport ReportId')
+        id_seed = '{}:{}'.format(args.project_id, report_id)
+
     if subject_id is None:
         subject, subject_id = create_subject(
-            results_payload_dict, args.project_id)
+            results_payload_dict, args.project_id, id_seed)
         fhir_resources.append(subject)
 
     specimen_name = None
@@ -1009,9 +1147,9 @@ def process(results_payload_dict, args):
 
     if (args.vcf_out_file is None):
         specimen, specimen_id, specimen_name = create_specimen(
-            results_payload_dict, args.project_id, subject_id)
+            results_payload_dict, args.project_id, subject_id, id_seed)
         sequence, sequence_id = create_sequence(
-            args.project_id, subject_id, specimen_id, specimen_name)
+            args.project_id, subject_id, specimen_id, specimen_name, id_seed)
         fhir_resources.append(specimen)
         fhir_resources.append(sequence)
 
@@ -1022,10 +1160,15 @@ def process(results_payload_dict, args):
         effective_date = results_payload_dict['FinalReport']['PMI']['CollDate']
 
     report = create_report(results_payload_dict, args.project_id,
-                           subject_id, specimen_id, specimen_name, effective_date, args.file_url, args.sequence_id)
+                           subject_id, specimen_id, specimen_name, effective_date, args.file_url, args.sequence_id,
+                           id_seed)
 
     observations = []
-    if ('short-variants' in results_payload_dict['variant-report'].keys()):
+    cnvs, rearrangements = [], []
+    vcf_written = False
+    sections = get_sections(args)
+    if ('short-variant' in sections and
+            'short-variants' in results_payload_dict['variant-report'].keys()):
 
         variants = []
 
@@ -1034,49 +1177,61 @@ def process(results_payload_dict, args):
             variants_dict = results_payload_dict['variant-report']['short-variants']['short-variant']
             variants = variants_dict if isinstance(variants_dict, list) else [variants_dict]
 
+        plan_reference_windows(args.fasta, [reference_window(x['@cds-effect'].replace('&gt;', '>'), x['@position'])
+                                            for x in variants])
+        plan_transcripts(args.genes, [x['@transcript'] for x in variants])
+
         if (args.vcf_out_file is not None):
             specimen_name = get_specimen_name(results_payload_dict)
-            write_vcf(variants, specimen_name, args.fasta, args.genes, args.vcf_out_file)
+            write_vcf(variants, specimen_name, args.fasta, args.genes, unsorted_vcf_file)
+            vcf_written = True
 
-        observations = list(map(create_observation(args.fasta, args.genes, args.project_id, subject_id, specimen_id, specimen_name, sequence_id or args.sequence_id),
+        observations = list(map(create_observation(args.fasta, args.genes, args.project_id, subject_id, specimen_id, specimen_name, sequence_id or args.sequence_id, id_seed),
                             variants))
 
-    if ('copy-number-alterations' in results_payload_dict['variant-report'].keys()):
-
-        cnvs = []
+    if ('cnv' in sections and
+            'copy-number-alterations' in results_payload_dict['variant-report'].keys()):
 
         if (results_payload_dict['variant-report']['copy-number-alterations'] is not None and
             'copy-number-alteration' in results_payload_dict['variant-report']['copy-number-alterations'].keys()):
             cnv_dict = results_payload_dict['variant-report']['copy-number-alterations']['copy-number-alteration']
             cnvs = cnv_dict if isinstance(cnv_dict, list) else [cnv_dict]
 
-        observations.extend(list(map(create_copy_number_observation(args.project_id, subject_id, specimen_id, specimen_name, sequence_id or args.sequence_id),
+        observations.extend(list(map(create_copy_number_observation(args.project_id, subject_id, specimen_id, specimen_name, sequence_id or args.sequence_id, id_seed),
                                 cnvs)))
 
-    if ('rearrangements' in results_payload_dict['variant-report'].keys()):
-
-        rearrangements = []
+    if ('rearrangement' in sections and
+            'rearrangements' in results_payload_dict['variant-report'].keys()):
 
         if (results_payload_dict['variant-report']['rearrangements'] is not None and
             'rearrangement' in results_payload_dict['variant-report']['rearrangements'].keys()):
             rearrangement_dict = results_payload_dict['variant-report']['rearrangements']['rearrangement']
             rearrangements = rearrangement_dict if isinstance(rearrangement_dict, list) else [rearrangement_dict]
 
-        observations.extend(list(map(create_rearrangement_observation(args.project_id, subject_id, specimen_id, specimen_name, sequence_id or args.sequence_id),
+        observations.extend(list(map(create_rearrangement_observation(args.project_id, subject_id, specimen_id, specimen_name, sequence_id or args.sequence_id, id_seed),
                                 rearrangements)))
-    if ('biomarkers' in results_payload_dict['variant-report'].keys()):
+    if ('biomarkers' in sections and
+            'biomarkers' in results_payload_dict['variant-report'].keys()):
 
         if (results_payload_dict['variant-report']['biomarkers'] is not None and
             'microsatellite-instability' in results_payload_dict['variant-report']['biomarkers'].keys()):
             microsatellite_dict = results_payload_dict['variant-report']['biomarkers']['microsatellite-instability']
-            observations.append(create_microsatallite_observation(args.project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id or args.sequence_id)(microsatellite_dict))
+            observations.append(create_microsatallite_observation(args.project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id or args.sequence_id, id_seed)(microsatellite_dict))
 
         if (results_payload_dict['variant-report']['biomarkers'] is not None and
             'tumor-mutation-burden' in results_payload_dict['variant-report']['biomarkers'].keys()):
             tumor_dict = results_payload_dict['variant-report']['biomarkers']['tumor-mutation-burden']
-            observations.append(create_tumor_mutation_observation(args.project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id or args.sequence_id)(tumor_dict))
+            observations.append(create_tumor_mutation_observation(args.project_id, subject_id, specimen_id, effective_date, specimen_name, sequence_id or args.sequence_id, id_seed)(tumor_dict))
 
 
+    if args.vcf_out_file is not None and not vcf_written:
+        write_vcf([], get_specimen_name(results_payload_dict), args.fasta, args.genes, unsorted_vcf_file)
+
+    if getattr(args, 'sv_vcf_out_file', None) is not None:
+        write_sv_vcf(sv_records(cnvs, rearrangements), get_specimen_name(results_payload_dict), args.fasta,
+                     args.sv_vcf_out_file, get_vcf_index(args, args.sv_vcf_out_file))
+        logger.info('Saved structural variants to %s', args.sv_vcf_out_file)
+
     report['result'] = [
         {'reference': 'Observation/{}'.format(x['id'])} for x in observations]
 
@@ -1091,54 +1246,794 @@ def process(results_payload_dict, args):
     return fhir_resources
 
 
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _section_items(results_payload_dict, section, element):
+    section_dict = results_payload_dict['variant-report'].get(section)
+    return _as_list(section_dict.get(element)) if section_dict is not None else []
+
+
+def _equivocal(item):
+    return item.get('@equivocal') == 'true' if '@equivocal' in item else None
+
+
+def _number(value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_rows(results_payload_dict, args, tables=None):
+    """
+    Yields (table, row) for the columnar and MAF exports: the normalized short
+    variants, copy number alterations, rearrangements and biomarkers of the
+    sections being converted, with the columns listed in columnar.TABLES.
+    tables limits the rows to those tables.
+    """
+    sections = get_sections(args)
+    for section, table in (('short-variant', 'short_variants'), ('cnv', 'copy_numbers'),
+                           ('rearrangement', 'rearrangements'), ('biomarkers', 'biomarkers')):
+        if tables is not None and table not in tables:
+            sections.discard(section)
+    report = {
+        'report_id': get_report_id(results_payload_dict),
+        'sample': get_specimen_name(results_payload_dict)
+    }
+
+    if 'short-variant' in sections:
+        for variant in _section_items(results_payload_dict, 'short-variants', 'short-variant'):
+            cds_effect = variant['@cds-effect'].replace('&gt;', '>')
+            variant_name = '{}:c.{}'.format(variant['@transcript'], cds_effect)
+            chrom, pos, ref, alt = hgvs_2_vcf(variant_name, args.genes, variant['@functional-effect'], cds_effect,
+                                              variant['@position'], variant['@strand'], args.fasta)
+            row = dict(report, chrom=chrom, pos=int(pos), ref=ref, alt=alt, gene=variant.get('@gene'),
+                       transcript=variant['@transcript'], cds_effect=cds_effect,
+                       protein_effect=variant.get('@protein-effect'), functional_effect=variant['@functional-effect'],
+                       depth=_number(variant.get('@depth'), int),
+                       allele_fraction=_number(variant.get('@allele-fraction'), float),
+                       status=variant.get('@status'), equivocal=_equivocal(variant))
+            yield 'short_variants', row
+
+    if 'cnv' in sections:
+        for cnv in _section_items(results_payload_dict, 'copy-number-alterations', 'copy-number-alteration'):
+            chrom, start, end = parse_position(cnv['@position'])
+            row = dict(report, gene=cnv.get('@gene'), chrom=chrom, start=start, end=end,
+                       copy_number=_number(cnv.get('@copy-number'), int), ratio=_number(cnv.get('@ratio'), float),
+                       type=cnv.get('@type'), exons=cnv.get('@number-of-exons'), status=cnv.get('@status'),
+                       equivocal=_equivocal(cnv))
+            yield 'copy_numbers', row
+
+    if 'rearrangement' in sections:
+        for rearrangement in _section_items(results_payload_dict, 'rearrangements', 'rearrangement'):
+            row = dict(report, target_gene=rearrangement.get('@targeted-gene', rearrangement.get('@target-gene')),
+                       other_gene=rearrangement.get('@other-gene'), type=rearrangement.get('@type'),
+                       pos1=rearrangement.get('@pos1'), pos2=rearrangement.get('@pos2'),
+                       in_frame=rearrangement.get('@in-frame'),
+                       supporting_read_pairs=_number(rearrangement.get('@supporting-read-pairs'), int),
+                       status=rearrangement.get('@status'), equivocal=_equivocal(rearrangement))
+            yield 'rearrangements', row
+
+    if 'biomarkers' in sections:
+        biomarkers = results_payload_dict['variant-report'].get('biomarkers') or {}
+        for name in ('microsatellite-instability', 'tumor-mutation-burden'):
+            if isinstance(biomarkers.get(name), dict):
+                biomarker = biomarkers[name]
+                row = dict(report, name=name, status=biomarker.get('@status'),
+                           score=_number(biomarker.get('@score'), float), unit=biomarker.get('@unit'))
+                yield 'biomarkers', row
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog='foundation-xml-fhir', description='Converts FoundationOne XML reports into FHIR resources.')
     parser.add_argument('-r, --reference', dest='fasta',
-                        required=True, help='Path to reference genome')
+                        required=False, help='Path to reference genome')
     parser.add_argument('-g, --genes', dest='genes',
                         required=False, help='Path to genes file', default='/opt/app/refGene.hg19.txt')
     parser.add_argument('-x, --xml', dest='xml_file',
-                        required=True, help='Path to the XML file')
-    parser.add_argument('-p, --project', dest='project_id', required=True,
+                        required=False, help='Path to the XML file, optionally gzipped, or - for stdin; a zip or tar '
+                                             'bundle converts every report in it and -o, -d, -v and --sv-vcf-output '
+                                             'name directories')
+    parser.add_argument('-p, --project', dest='project_id', required=False,
                         help='The ID of the project to link the resources to')
     parser.add_argument('-s, --subject', dest='subject_id', required=False,
                         help='The ID of the subject/patient to link the resources to')
     parser.add_argument('-o, --output', dest='out_file',
-                        required=True, help='Path to write the FHIR JSON resources')
+                        required=False, help='Path to write the FHIR JSON resources')
     parser.add_argument('-f, --file', dest='file_url',
                         required=False, help='The URL to the PDF Report in the PHC')
     parser.add_argument('-d, --pdf-output', dest='pdf_out_file',
                         required=False, help='Path to write the PDF file', default=None)
     parser.add_argument('-v, --vcf-output', dest='vcf_out_file',
                         required=False, help='Path to write the VCF file', default=None)
+    parser.add_argument('--vcf-index', dest='vcf_index', choices=INDEX_FORMATS, default=None,
+                        help='Write the VCF BGZF-compressed with a tabix (tbi) or CSI (csi) index beside it; '
+                             'implied as tbi when the VCF path ends in .gz or .bgz')
+    parser.add_argument('--sv-vcf-output', dest='sv_vcf_out_file', required=False, default=None,
+                        help='Path to write copy number alterations and rearrangements as a structural variant VCF')
+    parser.add_argument('--cohort-vcf', dest='cohort_vcf_file', required=False, default=None,
+                        help='With a bundle for -x, merge the reports\' VCFs into one multi-sample VCF at this path')
     parser.add_argument('-i, --sequence-id', dest='sequence_id',
                         required=False, help='The sequence id to add to the Diagnostic Report', default=None)
+    parser.add_argument('--deterministic-ids', dest='deterministic_ids', action='store_true',
+                        help='Derive resource IDs from the project, report ID and variant so re-conversion is idempotent')
+    parser.add_argument('--manifest', dest='manifest_file', required=False, default=None,
+                        help='Path to the incremental manifest; unchanged reports are skipped and only changed resources are written')
+    parser.add_argument('--checkpoint', dest='checkpoint_file', required=False, default=None,
+                        help='Append-only journal of the reports converted from a bundle; a restarted run skips the '
+                             'reports it records as done and retries the failed ones')
+    parser.add_argument('--removed-output', dest='removed_out_file', required=False, default=None,
+                        help='Path to write references of resources removed since the last incremental run')
+    parser.add_argument('--fhir-url', dest='fhir_url', required=False, default=None,
+                        help='Base URL of a FHIR server to upload the resources to (bearer token read from FHIR_TOKEN)')
+    parser.add_argument('--fhir-batch-size', dest='fhir_batch_size', type=positive_int, default=100,
+                        help='Number of resources per transaction Bundle')
+    parser.add_argument('--fhir-concurrency', dest='fhir_concurrency', type=positive_int, default=4,
+                        help='Number of Bundles uploaded concurrently')
+    parser.add_argument('--json-format', dest='json_format', choices=['pretty', 'compact'], default='pretty',
+                        help='Layout of the FHIR JSON output, indented by two spaces when pretty')
+    parser.add_argument('--snapshot', dest='snapshot_file', required=False, default=None,
+                        help='Path to a snapshot of preloaded state written by --build-snapshot')
+    parser.add_argument('--build-snapshot', dest='build_snapshot_file', required=False, default=None,
+                        help='Write a snapshot of the transcript tables, reference index and normalization cache '
+                             'and exit; with -x the report is converted first to warm the cache')
+    parser.add_argument('--no-hgvs', dest='no_hgvs', action='store_true',
+                        help='Skip short variants so pyhgvs, pyfaidx and the reference genome are never loaded')
+    parser.add_argument('--sections', dest='sections', type=parse_sections, default=None,
+                        help='Comma separated report sections to convert, from {} (default all); other sections '
+                             'are not parsed'.format(', '.join(SECTIONS)))
+    parser.add_argument('--columnar-output', dest='columnar_out_dir', required=False, default=None,
+                        help='Directory to export short variants, copy numbers, rearrangements and biomarkers to as '
+                             'tables partitioned by project (requires pyarrow)')
+    parser.add_argument('--columnar-format', dest='columnar_format', choices=['parquet', 'arrow'], default='parquet',
+                        help='File format of the columnar export')
+    parser.add_argument('--row-group-size', dest='row_group_size', type=int, default=65536,
+                        help='Rows per Parquet row group or Arrow record batch in the columnar export')
+    parser.add_argument('--maf-output', dest='maf_out_file', required=False, default=None,
+                        help='Path to write the short variants of every converted report as one MAF file')
+    parser.add_argument('--xml-backend', dest='xml_backend', choices=['lxml', 'xmltodict'], default=None,
+                        help='XML parser to use (default lxml when installed, otherwise xmltodict)')
+    parser.add_argument('--report-cache', dest='report_cache', required=False, default=None,
+                        help='Directory caching parsed reports by XML digest so unchanged reports are not parsed again')
+    parser.add_argument('--report-cache-size', dest='report_cache_size', type=int, default=1024,
+                        help='Size in MB above which the least recently used cached reports are evicted')
+    parser.add_argument('--watch', dest='watch_dir', required=False, default=None,
+                        help='Run as a daemon converting the reports and bundles dropped into this directory; '
+                             '-o, -d and -v name output directories')
+    parser.add_argument('--watch-workers', dest='watch_workers', type=int, default=2,
+                        help='Number of worker processes converting watched reports')
+    parser.add_argument('--memory-budget', dest='memory_budget', type=int, default=None,
+                        help='Resident memory in MB the watch workers may use together; reports are admitted against '
+                             'it by estimated size, largest first')
+    parser.add_argument('--project-weight', dest='project_weights', type=project_setting(float, 0, exclusive=True),
+                        action='append', default=[],
+                        help='PROJECT=WEIGHT share of the watch or queue workers a project gets while others have '
+                             'work too (default 1); repeatable')
+    parser.add_argument('--project-max-running', dest='project_caps', type=project_setting(int, 1), action='append',
+                        default=[], help='PROJECT=N reports of a project converted at once by the watch or queue '
+                                         'workers; repeatable')
+    parser.add_argument('--metrics-file', dest='metrics_file', required=False, default=None,
+                        help='Path the watch or queue mode keeps per project queue depth, wait and latency metrics '
+                             'in as JSON')
+    parser.add_argument('--done-dir', dest='done_dir', required=False, default=None,
+                        help='Directory converted reports are moved to (default done/ in the watched directory)')
+    parser.add_argument('--failed-dir', dest='failed_dir', required=False, default=None,
+                        help='Directory reports that failed are moved to (default failed/ in the watched directory)')
+    parser.add_argument('--settle-time', dest='settle_time', type=float, default=None,
+                        help='Seconds a watched file must stay unchanged before it is converted (default 5)')
+    parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=None,
+                        help='Seconds between scans of the watched directory when inotify is not available '
+                             '(default 10)')
+    parser.add_argument('--queue', dest='queue_file', required=False, default=None,
+                        help='sqlite work queue on shared storage; leases and converts queued reports until the queue '
+                             'is drained, -o, -d and -v naming output directories')
+    parser.add_argument('--enqueue', dest='enqueue', action='store_true',
+                        help='Add -x, or the reports and bundles in the -x directory, to the --queue and exit')
+    parser.add_argument('--lease-time', dest='lease_time', type=float, default=None,
+                        help='Seconds a queue worker holds a report without renewing its lease (default 300)')
 
     args = parser.parse_args()
+    required = [('-x, --xml', args.xml_file), ('-p, --project', args.project_id), ('-o, --output', args.out_file)]
+    if args.watch_dir is not None:
+        required.pop(0)
+    elif args.queue_file is not None:
+        # Reports are queued with their project, which workers convert them for
+        required = required[:2] if args.enqueue else required[2:]
+    if 'short-variant' in get_sections(args) and not args.enqueue:
+        required.insert(0, ('-r, --reference', args.fasta))
+    if (args.build_snapshot_file is None or args.xml_file is not None) and any(value is None for _, value in required):
+        parser.error('the following arguments are required: {}'.format(
+            ', '.join(name for name, value in required if value is None)))
+    if args.enqueue and args.queue_file is None:
+        parser.error('--enqueue requires --queue')
+    if args.watch_dir is not None or args.queue_file is not None:
+        if any(x is not None for x in (args.maf_out_file, args.cohort_vcf_file, args.manifest_file,
+                                       args.checkpoint_file)):
+            parser.error('--watch and --queue cannot be combined with --maf-output, --cohort-vcf, --manifest or '
+                         '--checkpoint')
+    else:
+        for name, value in (('--cohort-vcf', args.cohort_vcf_file), ('--checkpoint', args.checkpoint_file)):
+            if value is not None and not is_archive(args.xml_file):
+                parser.error('{} requires a zip or tar bundle for -x, --xml'.format(name))
+        if args.cohort_vcf_file is not None and args.checkpoint_file is not None and args.vcf_out_file is None:
+            parser.error('--cohort-vcf with --checkpoint requires -v, --vcf-output to keep the reports\' VCFs')
+
     logger.info('Converting XML to FHIR with args: %s',
                 json.dumps(args.__dict__))
 
     # pyfaidx has a bug with bgzipped files.  Unzip the genome for now
     # https://github.com/mdshw5/pyfaidx/issues/125
-    if (args.fasta.lower().endswith('.bgz') or
-            args.fasta.lower().endswith('.gz')):
+    if args.fasta is not None and (args.fasta.lower().endswith('.bgz') or
+                                   args.fasta.lower().endswith('.gz')):
         args.fasta = unzip(args.fasta)
 
-    xml_dict = read_xml(args.xml_file)
-    fhir_resources = process(
-        xml_dict['rr:ResultsReport']['rr:ResultsPayload'], args)
-    save_json(fhir_resources, args.out_file)
+    enable_normalization_cache()
+    if args.snapshot_file is not None:
+        load_snapshot(args.snapshot_file, args.fasta, args.genes, VERSION)
+
+    if args.build_snapshot_file is not None:
+        if args.xml_file is not None:
+            convert(args)
+        build_snapshot(args.build_snapshot_file, args.fasta, args.genes, VERSION)
+        return
+
+    if args.queue_file is not None:
+        if args.enqueue:
+            enqueue(args)
+        else:
+            drain_queue(args)
+        return
+
+    if args.watch_dir is not None:
+        watch(args)
+        return
+
+    convert(args)
+
+
+def get_vcf_index(args, vcf_file=None):
+    """
+    Index format for the VCF output, or None for plain text. A .gz or .bgz
+    output path selects BGZF with a tabix index unless --vcf-index says
+    otherwise.
+    """
+    vcf_file = vcf_file or args.vcf_out_file
+    index_format = getattr(args, 'vcf_index', None)
+    if index_format is None and vcf_file.lower().endswith(('.gz', '.bgz')):
+        index_format = 'tbi'
+    return index_format
+
+
+def batch_args(args, name):
+    """
+    Per-report copy of args for a member of a bundle: -o, -d and -v name
+    directories and each report is written as <member>.json, .pdf and .vcf,
+    keeping the member's directories within the bundle.
+    """
+    report_args = copy.copy(args)
+    base = report_name(name)
+    vcf_ext = 'vcf' if getattr(args, 'vcf_index', None) is None else 'vcf.gz'
+    for dest, ext in (('out_file', 'json'), ('pdf_out_file', 'pdf'), ('vcf_out_file', vcf_ext),
+                      ('sv_vcf_out_file', 'sv.' + vcf_ext)):
+        directory = getattr(args, dest, None)
+        if directory is None:
+            continue
+        out_file = os.path.join(directory, '{}.{}'.format(base, ext))
+        if not os.path.isdir(os.path.dirname(out_file)):
+            os.makedirs(os.path.dirname(out_file))
+        setattr(report_args, dest, out_file)
+    report_args.removed_out_file = None
+    return report_args
+
+
+def fhir_uploader(args):
+    """
+    The FHIR uploader for --fhir-url, or None without it.
+    """
+    if getattr(args, 'fhir_url', None) is None:
+        return None
+    from upload import FhirUploader
+
+    return FhirUploader(args.fhir_url, args.fhir_batch_size, args.fhir_concurrency, token=os.environ.get('FHIR_TOKEN'))
+
+
+def convert(args, uploader=None):
+    """
+    Converts the report or bundle named by -x. The watch and queue modes pass
+    the uploader they keep for all their reports; otherwise one is made for
+    the run.
+    """
+    manifest = None
+    if args.manifest_file is not None:
+        if args.xml_file == STDIN:
+            # Reports are tracked by path, so every report read from stdin
+            # would be diffed against the unrelated one read before it
+            raise ValueError('ERROR: --manifest cannot be used with -x - (stdin)')
+        args.deterministic_ids = True
+        manifest = Manifest(args.manifest_file)
+
+    cache = None
+    if getattr(args, 'report_cache', None) is not None:
+        cache = ReportCache(args.report_cache, getattr(args, 'report_cache_size', 1024) << 20)
+
+    journal = None
+    if getattr(args, 'checkpoint_file', None) is not None:
+        journal = CheckpointJournal(args.checkpoint_file)
+
+    exporters = []
+    own_uploader = None
+    try:
+        if uploader is None:
+            uploader = own_uploader = fhir_uploader(args)
+        if getattr(args, 'columnar_out_dir', None) is not None:
+            from columnar import ColumnarWriter
+
+            exporters.append(ColumnarWriter(args.columnar_out_dir, getattr(args, 'columnar_format', 'parquet'),
+                                            getattr(args, 'row_group_size', 65536)))
+        if getattr(args, 'maf_out_file', None) is not None:
+            exporters.append(MafWriter(args.maf_out_file))
+        convert_sources(args, manifest, cache, exporters, journal, uploader)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        if own_uploader is not None:
+            own_uploader.close()
+        if journal is not None:
+            journal.close()
+        # Once per run, rather than per report of a bundle; the reports
+        # converted before a failure are kept
+        if manifest is not None:
+            manifest.save()
+
+
+def convert_sources(args, manifest=None, cache=None, exporters=(), journal=None, uploader=None):
+    if is_archive(args.xml_file):
+        convert_bundle(args, manifest, cache, exporters, journal, uploader)
+        return
+
+    # Reports are tracked by absolute path, so a run from another directory
+    # finds them in the manifest
+    key = args.xml_file if args.xml_file == STDIN else os.path.abspath(args.xml_file)
+    xml_digest = None
+    if (manifest is not None or cache is not None) and args.xml_file != STDIN:
+        xml_digest = file_digest(args.xml_file)
+        # Unchanged reports still feed the exports, so they are skipped in
+        # convert_report once parsed
+        if (manifest is not None and not exporters and
+                manifest.is_current(key, xml_digest, VERSION, options_digest(args))):
+            logger.info('Skipping unchanged report %s', args.xml_file)
+            return
+
+    for _, xml_fd in open_sources(args.xml_file):
+        convert_report(args, xml_fd, key, manifest, xml_digest, cache, exporters, uploader)
+
+
+def convert_bundle(args, manifest=None, cache=None, exporters=(), journal=None, uploader=None):
+    """
+    Converts every report in a bundle. With --cohort-vcf the per-report VCFs,
+    kept in a temporary directory unless -v names one, are merged into one
+    multi-sample VCF afterwards. With a checkpoint journal, reports it records
+    as done are skipped and a report that fails is recorded and does not stop
+    the rest of the bundle.
+    """
+    cohort_vcf_file = getattr(args, 'cohort_vcf_file', None)
+    tmp_dir = None
+    if cohort_vcf_file is not None and args.vcf_out_file is None:
+        args = copy.copy(args)
+        args.vcf_out_file = tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(cohort_vcf_file)))
+
+    try:
+        logger.info('Converting reports in bundle %s', args.xml_file)
+        vcf_files, failed = [], 0
+        for name, xml_fd in open_sources(args.xml_file):
+            key = '{}!{}'.format(os.path.abspath(args.xml_file), name)
+            report_args = batch_args(args, name)
+            if journal is None:
+                logger.info('Converting %s', name)
+                convert_report(report_args, xml_fd, key, manifest, cache=cache, exporters=exporters,
+                               uploader=uploader)
+            else:
+                # Members are only read once, so one is held in memory to
+                # check its digest against the journal before converting it
+                data = xml_fd.read()
+                xml_digest = hashlib.sha256(data).hexdigest()
+                if journal.is_done(key, xml_digest):
+                    logger.info('Skipping %s, done in the checkpoint journal', name)
+                    export_unchanged(report_args, io.BytesIO(data), exporters, cache, xml_digest)
+                else:
+                    logger.info('Converting %s', name)
+                    try:
+                        convert_report(report_args, io.BytesIO(data), key, manifest, xml_digest, cache, exporters,
+                                       uploader)
+                    except Exception as e:
+                        logger.exception('Failed to convert %s', key)
+                        journal.record(key, xml_digest, FAILED, error=str(e))
+                        failed += 1
+                        continue
+                    outputs = [getattr(report_args, dest, None)
+                               for dest in ('out_file', 'pdf_out_file', 'vcf_out_file', 'sv_vcf_out_file')]
+                    journal.record(key, xml_digest, DONE, [x for x in outputs if x and os.path.isfile(x)])
+            if report_args.vcf_out_file is not None and os.path.isfile(report_args.vcf_out_file):
+                vcf_files.append(report_args.vcf_out_file)
+
+        if cohort_vcf_file is not None:
+            from cohort import merge_vcfs
+
+            merge_vcfs(vcf_files, cohort_vcf_file, get_vcf_index(args, cohort_vcf_file))
+        if failed:
+            raise ValueError('ERROR: {} reports in {} failed, see {}'.format(failed, args.xml_file, journal.path))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+def convert_report(args, xml_fd, key, manifest=None, xml_digest=None, cache=None, exporters=(), uploader=None):
+    sections = get_sections(args)
+    if args.pdf_out_file is None:
+        sections.discard('pdf')
+    skip = [element for section, element in SECTIONS.items() if section not in sections]
+    backend = getattr(args, 'xml_backend', None)
+
+    # A cache lookup needs the digest before parsing, so streamed reports are
+    # read into memory first; otherwise they are fingerprinted while parsed
+    if cache is not None and xml_digest is None:
+        data = xml_fd.read()
+        xml_digest = hashlib.sha256(data).hexdigest()
+        xml_fd = io.BytesIO(data)
+    if manifest is not None and xml_digest is not None and manifest.is_current(key, xml_digest, VERSION, options_digest(args)):
+        logger.info('Skipping unchanged report %s', key)
+        export_unchanged(args, xml_fd, exporters, cache, xml_digest)
+        return
+
+    payload = cache.get(xml_digest) if cache is not None else None
+    if payload is not None:
+        logger.info('Loaded parsed report %s from cache', key)
+        if 'pdf' in sections:
+            pdf_only = [element for section, element in SECTIONS.items() if section != 'pdf']
+            pdf_payload = read_xml(xml_fd, pdf_only, backend)['rr:ResultsReport']['rr:ResultsPayload']
+            if 'ReportPDF' in pdf_payload:
+                payload['ReportPDF'] = pdf_payload['ReportPDF']
+    elif cache is not None:
+        # Cached payloads must serve any later selection of sections
+        payload = read_xml(xml_fd, [] if 'pdf' in sections else [SECTIONS['pdf']], backend)
+        payload = payload['rr:ResultsReport']['rr:ResultsPayload']
+        cache.put(xml_digest, payload)
+    elif manifest is not None and xml_digest is None:
+        reader = DigestReader(xml_fd)
+        payload = read_xml(reader, skip, backend)['rr:ResultsReport']['rr:ResultsPayload']
+        xml_digest = reader.hexdigest()
+        if manifest.is_current(key, xml_digest, VERSION, options_digest(args)):
+            logger.info('Skipping unchanged report %s', key)
+            export_rows(args, payload, exporters)
+            return
+    else:
+        payload = read_xml(xml_fd, skip, backend)['rr:ResultsReport']['rr:ResultsPayload']
+    # Staged per call, so concurrent conversions sharing a working directory
+    # never sort each other's variants
+    unsorted_vcf_file = None
+    if args.vcf_out_file is not None:
+        fd, unsorted_vcf_file = tempfile.mkstemp(prefix='unsorted.', suffix='.vcf')
+        os.close(fd)
+    try:
+        fhir_resources = process(payload, args, unsorted_vcf_file)
+        save_outputs(args, payload, key, fhir_resources, sections, manifest, xml_digest, exporters,
+                     unsorted_vcf_file, uploader)
+    finally:
+        if unsorted_vcf_file is not None:
+            os.remove(unsorted_vcf_file)
+
+
+def export_rows(args, payload, exporters):
+    """
+    Writes a report's rows to the columnar and MAF exports. Reports skipped
+    as unchanged are exported too, as every run writes its tables anew.
+    """
+    if exporters:
+        tables = set(table for exporter in exporters for table in exporter.tables)
+        for table, row in extract_rows(payload, args, tables):
+            for exporter in exporters:
+                exporter.write(table, args.project_id, row)
+
+
+def export_unchanged(args, xml_fd, exporters, cache=None, xml_digest=None):
+    """
+    Exports a report that is not converted again, from the report cache when
+    it has it and otherwise parsed without its PDF.
+    """
+    if not exporters:
+        return
+    payload = cache.get(xml_digest) if cache is not None and xml_digest is not None else None
+    if payload is None:
+        sections = get_sections(args)
+        skip = [element for section, element in SECTIONS.items() if section not in sections or section == 'pdf']
+        payload = read_xml(xml_fd, skip, getattr(args, 'xml_backend', None))['rr:ResultsReport']['rr:ResultsPayload']
+    export_rows(args, payload, exporters)
+
+
+def save_outputs(args, payload, key, fhir_resources, sections, manifest, xml_digest, exporters, unsorted_vcf_file,
+                 uploader=None):
+    """
+    Writes a converted report's exports, FHIR JSON, upload, PDF and sorted
+    VCF, and records it in the manifest.
+    """
+    # One extraction feeds every export, so short variants reuse the
+    # normalizations made for the FHIR and VCF output
+    export_rows(args, payload, exporters)
+
+    changed, removed = fhir_resources, []
+    if manifest is not None:
+        changed, removed = manifest.diff(key, fhir_resources)
+        logger.info('%d of %d FHIR resources changed, %d removed', len(changed), len(fhir_resources), len(removed))
+        if removed:
+            removed_out_file = args.removed_out_file or '{}.removed.json'.format(os.path.splitext(args.out_file)[0])
+            save_json(removed, removed_out_file, args.json_format == 'pretty')
+            logger.info('Saved removed resource references to %s', removed_out_file)
+    save_json(changed, args.out_file, args.json_format == 'pretty')
     logger.info('Saved FHIR resources to %s', args.out_file)
 
-    if args.pdf_out_file is not None and 'ReportPDF' in xml_dict['rr:ResultsReport']['rr:ResultsPayload']:
-        pdf = base64.b64decode(xml_dict['rr:ResultsReport']['rr:ResultsPayload']['ReportPDF'])
-        with open(args.pdf_out_file, "w") as pdf_file:
+    if uploader is not None:
+        uploader.upload(changed, removed)
+
+    if 'pdf' in sections and 'ReportPDF' in payload:
+        pdf = base64.b64decode(payload['ReportPDF'])
+        with open(args.pdf_out_file, "wb") as pdf_file:
             pdf_file.write(pdf)
         logger.info('Saved PDF report to %s', args.pdf_out_file)
 
     if args.vcf_out_file is not None:
-        call(['/opt/app/sort.sh', args.vcf_out_file])
+        index_format = get_vcf_index(args)
+        if index_format is None:
+            call(['/opt/app/sort.sh', args.vcf_out_file, unsorted_vcf_file])
+        else:
+            sort_vcf(unsorted_vcf_file, args.vcf_out_file, index_format)
+            logger.info('Saved BGZF VCF with %s index to %s', index_format, args.vcf_out_file)
+
+    if manifest is not None:
+        manifest.record(key, xml_digest, VERSION, fhir_resources, options_digest(args))
+
+
+
+def enqueue(args):
+    from scheduler import estimate_memory
+    from watch import is_candidate
+    from work_queue import WorkQueue
+
+    if os.path.isdir(args.xml_file):
+        paths = [os.path.join(args.xml_file, name) for name in sorted(os.listdir(args.xml_file)) if is_candidate(name)]
+    else:
+        paths = [args.xml_file]
+    queue = WorkQueue(args.queue_file)
+    try:
+        weights, caps = dict(getattr(args, 'project_weights', [])), dict(getattr(args, 'project_caps', []))
+        for project in set(weights) | set(caps):
+            queue.set_project(project, weights.get(project), caps.get(project))
+        added = queue.add([os.path.abspath(path) for path in paths], args.project_id, estimate_memory)
+    finally:
+        queue.close()
+    logger.info('Queued %d of %d reports for %s in %s', added, len(paths), args.project_id, args.queue_file)
+
+
+def drain_queue(args):
+    """
+    Queue worker: leases reports from the shared --queue and converts them
+    until none are queued or leased to other workers, renewing the lease in
+    the background while each report converts. Any number of workers on
+    any number of hosts can drain one queue; a report whose worker dies is
+    leased again once its lease expires. Each report is converted for the
+    project it was queued for.
+    """
+    import socket
+    import traceback
+    from scheduler import METRICS_INTERVAL, write_metrics
+    from work_queue import LEASE_TIME, LEASED, LeaseHeartbeat, WorkQueue
+
+    lease_time = args.lease_time if args.lease_time is not None else LEASE_TIME
+    make_output_dirs(args)
+    owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+    queue = WorkQueue(args.queue_file, lease_time)
+    metrics_file = getattr(args, 'metrics_file', None)
+    metrics_written = time.time()
+    uploader = fhir_uploader(args)
+    try:
+        while True:
+            job = queue.lease(owner)
+            if job is None:
+                if not queue.counts().get(LEASED):
+                    break
+                time.sleep(min(lease_time, 10))
+                continue
+
+            job_id, xml_file, project = job
+            logger.info('Leased %s for %s', xml_file, project)
+            heartbeat = LeaseHeartbeat(queue, job_id, owner)
+            heartbeat.start()
+            try:
+                convert(source_args(args, xml_file, project), uploader)
+            except Exception:
+                logger.exception('Failed to convert %s', xml_file)
+                heartbeat.stop()
+                queue.fail(job_id, owner, traceback.format_exc())
+            else:
+                heartbeat.stop()
+                if not queue.complete(job_id, owner):
+                    logger.warning('Converted %s after its lease was lost', xml_file)
+            if metrics_file is not None and time.time() - metrics_written >= METRICS_INTERVAL:
+                write_metrics(metrics_file, queue.metrics())
+                metrics_written = time.time()
+        metrics = queue.metrics()
+        if metrics_file is not None:
+            write_metrics(metrics_file, metrics)
+        logger.info('Queue drained: %s', json.dumps(metrics, sort_keys=True))
+    finally:
+        if uploader is not None:
+            uploader.close()
+        queue.close()
+
+
+_watch_args = None
+_watch_uploader = None
+
+
+def _init_watch_worker(args):
+    global _watch_args, _watch_uploader
+    import signal
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _watch_args = args
+    # Made after the fork, so each worker keeps its own connections
+    _watch_uploader = fhir_uploader(args)
+
+
+def source_args(args, xml_file, project=None):
+    """
+    Args converting one report or bundle picked up by the watch or queue
+    modes, where -o, -d and -v name output directories. Reports of a project
+    other than -p are written to a subdirectory named after it.
+    """
+    if project is not None and project != args.project_id:
+        args = copy.copy(args)
+        args.project_id = project
+        for dest in OUTPUT_DIRS:
+            if getattr(args, dest, None) is not None:
+                setattr(args, dest, os.path.join(getattr(args, dest), project))
+        make_output_dirs(args)
+    report_args = copy.copy(args) if is_archive(xml_file) else batch_args(args, os.path.basename(xml_file))
+    report_args.xml_file = xml_file
+    return report_args
+
+
+OUTPUT_DIRS = ('out_file', 'pdf_out_file', 'vcf_out_file', 'sv_vcf_out_file')
+
+
+def make_output_dirs(args):
+    for dest in OUTPUT_DIRS:
+        directory = getattr(args, dest, None)
+        if directory is None or os.path.isdir(directory):
+            continue
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another worker in the meantime
+            if not os.path.isdir(directory):
+                raise
+
+
+def watch_project(args, xml_file):
+    """
+    Project of a watched file: the subdirectory of the watched directory it
+    was dropped into, or -p for files dropped into the directory itself.
+    """
+    directory = os.path.dirname(os.path.abspath(xml_file))
+    if directory == os.path.abspath(args.watch_dir):
+        return args.project_id
+    return os.path.basename(directory)
+
+
+def _watch_convert(xml_file):
+    import traceback
+
+    try:
+        convert(source_args(_watch_args, xml_file, watch_project(_watch_args, xml_file)), _watch_uploader)
+    except Exception:
+        logger.exception('Failed to convert %s', xml_file)
+        return traceback.format_exc()
+    return None
+
+
+def watch(args, stop=None):
+    """
+    Daemon mode: converts the reports and bundles that settle in the watched
+    directory on a pool of worker processes, forked once after the snapshot
+    is loaded so transcript tables and normalization caches stay warm across
+    reports. Files dropped into a subdirectory are converted for the project
+    it is named after, and projects share the workers through per-project
+    queues with weighted fair scheduling. Converted inputs are moved to the
+    done directory and failed ones, with a .error file holding the
+    traceback, to the failed directory. Runs until SIGTERM, an interrupt or
+    stop() returning True.
+    """
+    import multiprocessing
+    import signal
+    from scheduler import MemoryScheduler, current_rss, estimate_memory, write_metrics
+    from watch import POLL_INTERVAL, SETTLE_TIME, FolderWatcher, move_to
+
+    done_dir = args.done_dir or os.path.join(args.watch_dir, 'done')
+    failed_dir = args.failed_dir or os.path.join(args.watch_dir, 'failed')
+    for directory in (done_dir, failed_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    make_output_dirs(args)
+
+    stopping = []
+    if stop is None:
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        stop = lambda: bool(stopping)
+
+    def finish(xml_file, error):
+        if error is None:
+            logger.info('Converted %s', xml_file)
+            move_to(xml_file, done_dir)
+            return
+        with open(os.path.join(failed_dir, '{}.error'.format(os.path.basename(xml_file))), 'w') as fd:
+            fd.write(error)
+        move_to(xml_file, failed_dir)
+
+    # The budget is shared by the workers' own resident memory, taken as this
+    # process's before they are forked, and the reports they convert
+    budget = None
+    if getattr(args, 'memory_budget', None) is not None:
+        baseline = current_rss()
+        budget = (args.memory_budget << 20) - args.watch_workers * baseline
+        if budget <= 0:
+            logger.warning('--memory-budget leaves no memory for reports after %d workers of %d MB, converting one '
+                           'at a time', args.watch_workers, baseline >> 20)
+            budget = 0
+    scheduler = MemoryScheduler(args.watch_workers, budget, dict(getattr(args, 'project_weights', [])),
+                                dict(getattr(args, 'project_caps', [])))
+    metrics_file = getattr(args, 'metrics_file', None)
+
+    def report(xml_file, result):
+        error = result.get()
+        scheduler.finished(xml_file, error is not None)
+        finish(xml_file, error)
+        if metrics_file is not None:
+            write_metrics(metrics_file, scheduler.metrics())
+
+    settle_time = args.settle_time if args.settle_time is not None else SETTLE_TIME
+    poll_interval = args.poll_interval if args.poll_interval is not None else POLL_INTERVAL
+    watcher = FolderWatcher(args.watch_dir, settle_time, poll_interval, exclude=(done_dir, failed_dir))
+    pool = multiprocessing.Pool(args.watch_workers, _init_watch_worker, (args,))
+    results = {}
+    logger.info('Watching %s with %d workers', args.watch_dir, args.watch_workers)
+    try:
+        while not stop():
+            for xml_file in watcher.poll():
+                scheduler.add(xml_file, estimate_memory(xml_file), watch_project(args, xml_file))
+            xml_file = scheduler.next()
+            while xml_file is not None:
+                results[xml_file] = pool.apply_async(_watch_convert, (xml_file,))
+                xml_file = scheduler.next()
+            for xml_file, result in list(results.items()):
+                if result.ready():
+                    del results[xml_file]
+                    report(xml_file, result)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Reports not started yet stay in the watched directory for the next run
+        logger.info('Stopping, waiting for %d conversions', len(results))
+        pool.close()
+        pool.join()
+        for xml_file, result in results.items():
+            report(xml_file, result)
+        logger.info('Project metrics: %s', json.dumps(scheduler.metrics(), sort_keys=True))
+        watcher.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import os
+from array import array
+
+from transcripts import open_transcript_table, parse_refgene_row, transcript_accession
+
+
+_indexes = {}
+_index_loaders = {}
+
+
+class IntervalTree(object):
+    """
+    Static centered interval tree over closed (start, end, value) intervals,
+    answering point overlap queries in O(log n + k).
+    """
+    def __init__(self, intervals):
+        self.root = self._build(sorted(intervals, key=lambda x: (x[0], x[1])))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+
+        center = intervals[len(intervals) // 2][0]
+        left = [x for x in intervals if x[1] < center]
+        right = [x for x in intervals if x[0] > center]
+        overlapping = [x for x in intervals if x[0] <= center <= x[1]]
+        return (center,
+                overlapping,
+                sorted(overlapping, key=lambda x: x[1], reverse=True),
+                self._build(left),
+                self._build(right))
+
+    def find(self, position):
+        found = []
+        node = self.root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if position < center:
+                for start, _, value in by_start:
+                    if start > position:
+                        break
+                    found.append(value)
+                node = left
+            elif position > center:
+                for _, end, value in by_end:
+                    if end < position:
+                        break
+                    found.append(value)
+                node = right
+            else:
+                found.extend(x[2] for x in by_start)
+                break
+        return found
+
+
+class TranscriptIndex(object):
+    """
+    Interval trees over the transcript spans of a genes file, in 1-based
+    closed coordinates. A chromosome's tree is built the first time it is
+    looked up, from the packed transcript table when there is one and from
+    the genes file rows otherwise, so a process only holds the trees of the
+    chromosomes its reports touch.
+    """
+    def __init__(self, genes, table=None):
+        self.genes = genes
+        self.table = table if table is not None else open_transcript_table(genes)
+        # Per chromosome, the table rows or genes file offsets of its transcripts
+        self.locations = None
+        self.trees = {}
+
+    def find_locations(self):
+        locations = {}
+        if self.table is not None:
+            for i in range(self.table.transcript_count):
+                locations.setdefault(self.table.span(i)[0], array('L')).append(i)
+            return locations
+
+        with open(self.genes, 'rb') as fd:
+            offset = 0
+            for line in iter(fd.readline, b''):
+                fields = line.split(b'\t', 3)
+                if not line.startswith(b'#') and len(fields) > 3:
+                    locations.setdefault(fields[2].decode('utf-8'), array('L')).append(offset)
+                offset += len(line)
+        return locations
+
+    def spans(self, chrom):
+        locations = self.locations.get(chrom, ())
+        if self.table is not None:
+            for i in locations:
+                _, start, end, accession = self.table.span(i)
+                yield start + 1, end, accession
+            return
+
+        with open(self.genes, 'rb') as fd:
+            for offset in locations:
+                fd.seek(offset)
+                record = parse_refgene_row(fd.readline().decode('utf-8'))
+                if record is not None:
+                    yield record['start'] + 1, record['end'], transcript_accession(record['id'])
+
+    def transcripts_at(self, chrom, position):
+        if chrom not in self.trees:
+            if self.locations is None:
+                self.locations = self.find_locations()
+            self.trees[chrom] = IntervalTree(self.spans(chrom)) if chrom in self.locations else None
+        tree = self.trees[chrom]
+        return tree.find(position) if tree is not None else []
+
+
+def set_transcript_index_loader(genes, loader):
+    _index_loaders[genes] = loader
+    _indexes.pop(genes, None)
+
+
+def get_transcript_index(genes):
+    if genes not in _indexes:
+        if genes in _index_loaders:
+            _indexes[genes] = _index_loaders.pop(genes)()
+        else:
+            _indexes[genes] = TranscriptIndex(genes) if os.path.isfile(genes) else None
+    return _indexes[genes]
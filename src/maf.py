@@ -0,0 +1,126 @@
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+MAF_VERSION = '2.4'
+
+MAF_COLUMNS = [
+    'Hugo_Symbol', 'Entrez_Gene_Id', 'Center', 'NCBI_Build', 'Chromosome', 'Start_Position', 'End_Position',
+    'Strand', 'Variant_Classification', 'Variant_Type', 'Reference_Allele', 'Tumor_Seq_Allele1',
+    'Tumor_Seq_Allele2', 'Tumor_Sample_Barcode', 'HGVSc', 'HGVSp_Short', 'Transcript_ID', 't_depth',
+    't_ref_count', 't_alt_count', 'FMI_Status', 'FMI_Report_ID'
+]
+
+MAF_CENTER = 'foundationmedicine.com'
+
+# Foundation functional effects and the MAF Variant_Classification they map
+# to; frameshift and in-frame effects also depend on the variant type.
+VARIANT_CLASSIFICATIONS = {
+    'missense': 'Missense_Mutation',
+    'nonsense': 'Nonsense_Mutation',
+    'splice': 'Splice_Site',
+    'promoter': "5'Flank",
+    'synonymous': 'Silent',
+    'nonstop': 'Nonstop_Mutation',
+    'start': 'Translation_Start_Site'
+}
+
+
+def maf_alleles(pos, ref, alt):
+    """
+    Converts VCF coordinates and alleles to MAF ones: the shared leading
+    bases are trimmed, '-' stands for an empty allele and insertions are
+    placed between the two flanking positions. Returns (start, end, ref, alt,
+    variant type).
+    """
+    common = 0
+    while common < min(len(ref), len(alt)) and ref[common] == alt[common]:
+        common += 1
+    if common == len(ref) == len(alt):
+        common = 0
+    ref, alt = ref[common:] or '-', alt[common:] or '-'
+    start = pos + common
+
+    if ref == '-':
+        return start - 1, start, ref, alt, 'INS'
+    end = start + len(ref) - 1
+    if alt == '-' or len(ref) > len(alt):
+        return start, end, ref, alt, 'DEL'
+    if len(alt) > len(ref):
+        return start, end, ref, alt, 'INS'
+    return start, end, ref, alt, {1: 'SNP', 2: 'DNP', 3: 'TNP'}.get(len(ref), 'ONP')
+
+
+def variant_classification(functional_effect, variant_type):
+    effect = (functional_effect or '').lower()
+    if effect == 'frameshift':
+        return 'Frame_Shift_Ins' if variant_type == 'INS' else 'Frame_Shift_Del'
+    if effect == 'nonframeshift':
+        return 'In_Frame_Ins' if variant_type == 'INS' else 'In_Frame_Del'
+    for name, classification in VARIANT_CLASSIFICATIONS.items():
+        if effect.startswith(name):
+            return classification
+    return 'Unknown'
+
+
+def maf_row(row, ncbi_build):
+    start, end, ref, alt, variant_type = maf_alleles(row['pos'], row['ref'], row['alt'])
+    depth, allele_fraction = row.get('depth'), row.get('allele_fraction')
+    alt_count = int(round(depth * allele_fraction)) if depth is not None and allele_fraction is not None else None
+    values = {
+        'Hugo_Symbol': row.get('gene'),
+        'Entrez_Gene_Id': 0,
+        'Center': MAF_CENTER,
+        'NCBI_Build': ncbi_build,
+        'Chromosome': row['chrom'],
+        'Start_Position': start,
+        'End_Position': end,
+        'Strand': '+',
+        'Variant_Classification': variant_classification(row.get('functional_effect'), variant_type),
+        'Variant_Type': variant_type,
+        'Reference_Allele': ref,
+        'Tumor_Seq_Allele1': ref,
+        'Tumor_Seq_Allele2': alt,
+        'Tumor_Sample_Barcode': row.get('sample'),
+        'HGVSc': 'c.{}'.format(row['cds_effect']) if row.get('cds_effect') else None,
+        'HGVSp_Short': 'p.{}'.format(row['protein_effect']) if row.get('protein_effect') else None,
+        'Transcript_ID': row.get('transcript'),
+        't_depth': depth,
+        't_ref_count': depth - alt_count if alt_count is not None else None,
+        't_alt_count': alt_count,
+        'FMI_Status': row.get('status'),
+        'FMI_Report_ID': row.get('report_id')
+    }
+    return '\t'.join('' if values[x] is None else str(values[x]) for x in MAF_COLUMNS) + '\n'
+
+
+class MafWriter(object):
+    """
+    Streams the short variant rows of every converted report to one MAF file,
+    written under a temporary name and renamed into place on close. Takes
+    the same (table, project, row) calls as the columnar export and ignores
+    the other tables.
+    """
+    tables = ('short_variants',)
+
+    def __init__(self, maf_out_file, ncbi_build='GRCh37'):
+        self.maf_out_file = maf_out_file
+        self.ncbi_build = ncbi_build
+        self.tmp_file = '{}.tmp'.format(maf_out_file)
+        self.fd = open(self.tmp_file, 'w')
+        self.fd.write('#version {}\n'.format(MAF_VERSION))
+        self.fd.write('\t'.join(MAF_COLUMNS) + '\n')
+        self.rows = 0
+
+    def write(self, table, project_id, row):
+        if table not in self.tables:
+            return
+        self.fd.write(maf_row(row, self.ncbi_build))
+        self.rows += 1
+
+    def close(self):
+        self.fd.close()
+        os.rename(self.tmp_file, self.maf_out_file)
+        logger.info('Saved %d MAF rows to %s', self.rows, self.maf_out_file)
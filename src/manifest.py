@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+
+
+MANIFEST_VERSION = 1
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for block in iter(lambda: fd.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def resource_digest(resource):
+    content = json.dumps(resource, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def resource_reference(resource):
+    return '{}/{}'.format(resource['resourceType'], resource['id'])
+
+
+class Manifest(object):
+    """
+    Records, per input report, the XML digest, the converter version, a
+    digest of the conversion options and a content hash for every FHIR
+    resource produced from it, so a later run with the same options can skip
+    unchanged reports and emit only the resources that changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.reports = {}
+        if os.path.isfile(path):
+            with open(path) as fd:
+                manifest = json.load(fd)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.reports = manifest['reports']
+
+    def is_current(self, key, xml_digest, converter_version, options_digest=None):
+        entry = self.reports.get(key)
+        return (entry is not None and entry['xml_digest'] == xml_digest and
+                entry['converter_version'] == converter_version and entry.get('options_digest') == options_digest)
+
+    def diff(self, key, fhir_resources):
+        previous = self.reports.get(key, {}).get('resources', {})
+        changed = [x for x in fhir_resources
+                   if previous.get(resource_reference(x)) != resource_digest(x)]
+        current = set(resource_reference(x) for x in fhir_resources)
+        removed = sorted(x for x in previous if x not in current)
+        return changed, removed
+
+    def record(self, key, xml_digest, converter_version, fhir_resources, options_digest=None):
+        self.reports[key] = {
+            'xml_digest': xml_digest,
+            'converter_version': converter_version,
+            'options_digest': options_digest,
+            'resources': dict((resource_reference(x), resource_digest(x)) for x in fhir_resources)
+        }
+
+    def save(self):
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fd:
+            json.dump({'version': MANIFEST_VERSION, 'reports': self.reports}, fd, sort_keys=True)
+        os.rename(tmp_path, self.path)
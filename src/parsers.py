@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from xml.parsers import expat
+
+# The parser libraries are imported on use so --no-hgvs start-up stays fast;
+# lxml is preferred whenever it is installed.
+
+
+class SkippingParser(object):
+    """
+    Wraps an expat parser so the elements named in skip, as (parent, element)
+    pairs, and everything below them are dropped before the handlers see
+    them.
+    """
+    HANDLERS = ('StartElementHandler', 'EndElementHandler', 'CharacterDataHandler')
+
+    def __init__(self, parser, skip):
+        self.__dict__.update(parser=parser, skip=skip, path=[], skipping=0, handlers={})
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+
+    def __getattr__(self, name):
+        return getattr(self.parser, name)
+
+    def __setattr__(self, name, value):
+        if name in self.HANDLERS:
+            self.handlers[name] = value
+        else:
+            setattr(self.parser, name, value)
+
+    def start_element(self, name, attrs):
+        if self.skipping or (self.path[-1] if self.path else None, name) in self.skip:
+            self.__dict__['skipping'] += 1
+            return
+        self.path.append(name)
+        self.handlers['StartElementHandler'](name, attrs)
+
+    def end_element(self, name):
+        if self.skipping:
+            self.__dict__['skipping'] -= 1
+            return
+        self.path.pop()
+        self.handlers['EndElementHandler'](name)
+
+    def character_data(self, data):
+        if not self.skipping:
+            self.handlers['CharacterDataHandler'](data)
+
+
+class SkippingExpat(object):
+    """
+    Stands in for the expat module given to xmltodict.parse so skipped
+    subtrees are never materialized.
+    """
+    def __init__(self, skip):
+        self.skip = skip
+
+    def __getattr__(self, name):
+        return getattr(expat, name)
+
+    def ParserCreate(self, *args, **kwargs):
+        return SkippingParser(expat.ParserCreate(*args, **kwargs), self.skip)
+
+
+def _has_lxml():
+    try:
+        import lxml.etree
+    except ImportError:
+        return False
+    return True
+
+
+def _has_xmltodict():
+    try:
+        import xmltodict
+    except ImportError:
+        return False
+    return True
+
+
+def _parse_xmltodict(fd, skip):
+    import xmltodict
+
+    if skip:
+        return xmltodict.parse(fd, expat=SkippingExpat(skip))
+    return xmltodict.parse(fd)
+
+
+def _qualified_name(name, element):
+    if name[0] != '{':
+        return name
+    uri, local = name[1:].split('}', 1)
+    if name == element.tag:
+        prefix = element.prefix
+    else:
+        prefix = dict((uri, prefix) for prefix, uri in element.nsmap.items()).get(uri)
+    return '{}:{}'.format(prefix, local) if prefix else local
+
+
+def _add_child(children, name, value):
+    if name not in children:
+        children[name] = value
+    elif isinstance(children[name], list):
+        children[name].append(value)
+    else:
+        children[name] = [children[name], value]
+
+
+def _convert_element(element, name, declarations, skip):
+    value = OrderedDict()
+    if element in declarations:
+        for prefix, uri in declarations[element]:
+            value['@xmlns:{}'.format(prefix) if prefix else '@xmlns'] = uri
+    for key, attr in element.items():
+        value['@' + (key if key[0] != '{' else _qualified_name(key, element))] = attr
+
+    text = element.text or ''
+    for child in element:
+        if child.tail:
+            text += child.tail
+        child_name = child.tag
+        if child_name[0] == '{':
+            child_name = _qualified_name(child_name, child)
+        if (name, child_name) not in skip:
+            _add_child(value, child_name, _convert_element(child, child_name, declarations, skip))
+
+    text = text.strip() or None
+    if not value:
+        return text
+    if text is not None:
+        value['#text'] = text
+    return value
+
+
+def _parse_lxml(fd, skip):
+    """
+    Builds the same structure as xmltodict.parse (prefixed names, '@'
+    attributes, '#text', lists for repeated elements and namespace
+    declarations as '@xmlns' attributes) from an lxml tree. Skipped subtrees
+    are cleared as soon as libxml2 has read them, so they are never kept or
+    converted. Entities are not resolved and reports with a DOCTYPE are
+    rejected, as xmltodict rejects entity declarations, which leaves
+    huge_tree only lifting the 10 MB limit on text such as embedded PDFs.
+    """
+    from lxml import etree
+
+    # lxml only exposes the namespaces in scope, so the declarations made on
+    # each element are collected from the parse events
+    declarations = {}
+    pending = []
+    path = []
+    skipping = 0
+    events = etree.iterparse(fd, events=('start-ns', 'start', 'end'), resolve_entities=False, no_network=True,
+                             huge_tree=True, remove_comments=True, remove_pis=True)
+    for event, item in events:
+        if event == 'start-ns':
+            pending.append(item)
+            continue
+        if event == 'end':
+            path.pop()
+            if skipping:
+                skipping -= 1
+                item.clear(keep_tail=True)
+            continue
+
+        if not path and item.getroottree().docinfo.doctype:
+            raise ValueError('ERROR: reports with a DOCTYPE are not supported')
+        if pending:
+            declarations[item] = pending
+            pending = []
+        name = _qualified_name(item.tag, item)
+        if skipping or (path[-1] if path else None, name) in skip:
+            skipping += 1
+        path.append(name)
+
+    root = events.root
+    name = _qualified_name(root.tag, root)
+    if (None, name) in skip:
+        return OrderedDict()
+    return OrderedDict([(name, _convert_element(root, name, declarations, skip))])
+
+
+XML_BACKENDS = [
+    ('lxml', _has_lxml, _parse_lxml),
+    ('xmltodict', _has_xmltodict, _parse_xmltodict)
+]
+
+
+def available_backends():
+    return [name for name, available, _ in XML_BACKENDS if available()]
+
+
+def parse_xml(fd, skip=(), backend=None):
+    """
+    Parses a report into nested dicts with lxml when it is installed, falling
+    back to xmltodict, unless a backend is named. Elements listed in skip as
+    (parent, element) pairs are dropped along with their subtrees.
+    """
+    for name, available, parse in XML_BACKENDS:
+        if backend in (None, name) and available():
+            return parse(fd, set(skip))
+    raise ValueError('ERROR: XML backend {} is not available'.format(backend))
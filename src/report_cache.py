@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_MAGIC = b'FXRC'
+REPORT_CACHE_VERSION = 2
+
+# magic, version
+REPORT_CACHE_HEADER = struct.Struct('<4sI')
+
+REPORT_CACHE_SUFFIX = '.report'
+
+
+class ReportCache(object):
+    """
+    Directory of parsed rr:ResultsPayload structures keyed by the digest of
+    the XML they were parsed from. Entries are zlib compressed JSON without
+    the ReportPDF blob, so a shared cache directory holds only data. Reading
+    an entry touches it, and once the entries add up to more than max_bytes
+    the least recently used ones are evicted. Unreadable entries are misses
+    and a cache that cannot be written is only read.
+    """
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, xml_digest):
+        return os.path.join(self.directory, xml_digest + REPORT_CACHE_SUFFIX)
+
+    def get(self, xml_digest):
+        path = self.path(xml_digest)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        try:
+            magic, version = REPORT_CACHE_HEADER.unpack_from(data, 0)
+            if magic != REPORT_CACHE_MAGIC or version != REPORT_CACHE_VERSION:
+                logger.warning('Ignoring report cache entry %s written by another version', path)
+                self.misses += 1
+                return None
+            payload = json.loads(zlib.decompress(data[REPORT_CACHE_HEADER.size:]).decode('utf-8'),
+                                 object_pairs_hook=OrderedDict)
+        except (struct.error, zlib.error, ValueError) as e:
+            logger.warning('Ignoring unreadable report cache entry %s: %s', path, e)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            # A read-only cache keeps its eviction order
+            pass
+        self.hits += 1
+        return payload
+
+    def put(self, xml_digest, payload):
+        payload = payload.copy()
+        payload.pop('ReportPDF', None)
+        data = zlib.compress(json.dumps(payload).encode('utf-8'))
+
+        try:
+            # Unique per writer, so concurrent puts of a report never mix
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        except OSError as e:
+            logger.warning('Not caching report %s: %s', xml_digest, e)
+            return
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(REPORT_CACHE_HEADER.pack(REPORT_CACHE_MAGIC, REPORT_CACHE_VERSION))
+                tmp_file.write(data)
+            os.rename(tmp_path, self.path(xml_digest))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(REPORT_CACHE_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, _, size in entries)
+        for _, name, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            logger.debug('Evicted report cache entry %s', name)
@@ -0,0 +1,224 @@
+import gzip
+import json
+import logging
+import math
+import os
+import struct
+import time
+import zlib
+from collections import deque
+
+from sources import is_report
+
+
+logger = logging.getLogger(__name__)
+
+# Memory a report takes while it is converted, per byte of XML: the parsed
+# payload is about 5.5 times the XML (test/data/sample.xml with lxml) and the
+# decoded PDF and serialized JSON add to it.
+XML_MEMORY_FACTOR = 8
+
+# Memory per reported variant, for its normalization, FHIR resources and
+# their JSON.
+VARIANT_MEMORY = 16 << 10
+
+VARIANT_TAGS = (b'<short-variant ', b'<copy-number-alteration ', b'<rearrangement ')
+
+# The variants come before the embedded PDF, so the pre-scan stops here.
+VARIANT_REPORT_END = b'</variant-report>'
+
+SCAN_BLOCK_SIZE = 1 << 20
+
+# Recent reports per project kept for the wait and latency percentiles.
+METRICS_WINDOW = 1000
+
+# Seconds between rewrites of the metrics file by a queue worker.
+METRICS_INTERVAL = 10.0
+
+
+def count_variants(fd):
+    """
+    Counts the variant elements of a report by scanning its bytes up to the
+    end of the variant report, without parsing it.
+    """
+    count, tail = 0, b''
+    overlap = max(len(x) for x in VARIANT_TAGS + (VARIANT_REPORT_END,)) - 1
+    for block in iter(lambda: fd.read(SCAN_BLOCK_SIZE), b''):
+        data = tail + block
+        end = data.find(VARIANT_REPORT_END)
+        if end >= 0:
+            data = data[:end]
+        # Tags that started in the previous block's tail were counted there
+        count += sum(data.count(tag) - tail.count(tag) for tag in VARIANT_TAGS)
+        if end >= 0:
+            break
+        tail = data[-overlap:]
+    return count
+
+
+def estimate_memory(path):
+    """
+    Estimated memory, in bytes, to convert a report or bundle: its XML size
+    and a pre-scan of its variant count for reports, the archive size for
+    bundles, whose reports are converted one at a time. Unreadable files are
+    estimated at 0 and left to fail in conversion.
+    """
+    try:
+        size = os.path.getsize(path)
+        if not is_report(path):
+            return size * XML_MEMORY_FACTOR
+        if path.lower().endswith('.gz'):
+            with open(path, 'rb') as fd:
+                # Uncompressed size modulo 2**32, from the gzip trailer
+                fd.seek(-4, os.SEEK_END)
+                size = max(size, struct.unpack('<I', fd.read(4))[0])
+            with gzip.open(path, 'rb') as fd:
+                variants = count_variants(fd)
+        else:
+            with open(path, 'rb') as fd:
+                variants = count_variants(fd)
+    except (IOError, OSError, EOFError, struct.error, zlib.error) as e:
+        logger.warning('Could not estimate the memory to convert %s: %s', path, e)
+        return 0
+    return size * XML_MEMORY_FACTOR + variants * VARIANT_MEMORY
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+
+        # Peak rather than current resident size where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss << 10
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile q (0-100) of values, or None when there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(q / 100.0 * len(values))) - 1)]
+
+
+class ProjectMetrics(object):
+    """
+    Counts and recent wait and latency times of one project's reports: wait
+    from arrival to start, latency from arrival to finish.
+    """
+    def __init__(self, window=METRICS_WINDOW):
+        self.done = 0
+        self.failed = 0
+        self.waits = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def summary(self, queued, running):
+        return {
+            'queued': queued,
+            'running': running,
+            'done': self.done,
+            'failed': self.failed,
+            'wait_p50': percentile(self.waits, 50),
+            'wait_p95': percentile(self.waits, 95),
+            'latency_p50': percentile(self.latencies, 50),
+            'latency_p95': percentile(self.latencies, 95)
+        }
+
+
+class MemoryScheduler(object):
+    """
+    Admits reports for conversion against a memory budget, with a queue per
+    project. Projects share the workers by weighted fair queueing: the next
+    report comes from the project that has started the least estimated
+    memory per unit of weight, among those below their concurrency cap, and
+    a project that becomes active starts level with the others rather than
+    with the credit of its idle time. Within a project the largest reports
+    go first.
+
+    A report starts once a worker is free and its estimate fits in what the
+    running reports leave of the budget; smaller reports do not overtake a
+    large one that is waiting for memory, so it is not starved. A report
+    estimated above the whole budget runs alone.
+    """
+    def __init__(self, workers, budget=None, weights=None, caps=None):
+        self.workers = workers
+        self.budget = budget
+        self.weights = weights or {}
+        self.caps = caps or {}
+        self.pending = {}
+        self.running = {}
+        self.served = {}
+        self.arrivals = {}
+        self.projects = {}
+
+    def active(self, project):
+        return bool(self.pending.get(project)) or any(x[0] == project for x in self.running.values())
+
+    def add(self, path, cost, project=None):
+        if not self.active(project):
+            served = self.served.get(project, 0)
+            active = [self.served[x] for x in self.served if x != project and self.active(x)]
+            self.served[project] = max(served, min(active)) if active else served
+        pending = self.pending.setdefault(project, [])
+        pending.append((cost, path))
+        # Stable, so reports of the same size start in arrival order
+        pending.sort(key=lambda x: -x[0])
+        self.arrivals[path] = time.time()
+        self.projects.setdefault(project, ProjectMetrics())
+
+    def running_count(self, project):
+        return sum(1 for x in self.running.values() if x[0] == project)
+
+    def next(self):
+        """
+        Returns the path of the next report to start, or None when none can
+        start yet.
+        """
+        if len(self.running) >= self.workers:
+            return None
+        eligible = [project for project, pending in self.pending.items() if pending and
+                    (self.caps.get(project) is None or self.running_count(project) < self.caps[project])]
+        if not eligible:
+            return None
+        project = min(eligible, key=lambda x: (self.served[x], x or ''))
+
+        cost, path = self.pending[project][0]
+        if self.budget is not None and self.running and \
+                cost > self.budget - sum(x[1] for x in self.running.values()):
+            return None
+        self.pending[project].pop(0)
+        self.running[path] = (project, cost)
+        self.served[project] += float(max(cost, 1)) / self.weights.get(project, 1)
+        self.projects[project].waits.append(time.time() - self.arrivals[path])
+        return path
+
+    def finished(self, path, failed=False):
+        if path not in self.running:
+            return
+        project, _ = self.running.pop(path)
+        metrics = self.projects[project]
+        if failed:
+            metrics.failed += 1
+        else:
+            metrics.done += 1
+        metrics.latencies.append(time.time() - self.arrivals.pop(path))
+
+    def metrics(self):
+        return dict((project, metrics.summary(len(self.pending.get(project, [])), self.running_count(project)))
+                    for project, metrics in self.projects.items())
+
+    def __len__(self):
+        return sum(len(x) for x in self.pending.values()) + len(self.running)
+
+
+def write_metrics(metrics_file, metrics):
+    tmp_file = '{}.tmp'.format(metrics_file)
+    with open(tmp_file, 'w') as fd:
+        json.dump(metrics, fd, sort_keys=True, indent=2)
+    os.rename(tmp_file, metrics_file)
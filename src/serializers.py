@@ -0,0 +1,55 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# Pretty output is indented by two spaces, the only width orjson supports, so
+# it is laid out the same whichever backend writes it.
+PRETTY_INDENT = 2
+
+
+def _dumps_orjson(obj, pretty):
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+
+def _dumps_ujson(obj, pretty):
+    return ujson.dumps(obj, indent=PRETTY_INDENT if pretty else 0).encode('utf-8')
+
+
+def _dumps_json(obj, pretty):
+    if pretty:
+        content = json.dumps(obj, indent=PRETTY_INDENT, separators=(',', ': '))
+    else:
+        content = json.dumps(obj, separators=(',', ':'))
+    return content.encode('utf-8') if not isinstance(content, bytes) else content
+
+
+JSON_BACKENDS = [
+    ('orjson', orjson, _dumps_orjson),
+    ('ujson', ujson, _dumps_ujson),
+    ('json', json, _dumps_json)
+]
+
+
+def available_backends():
+    return [name for name, module, _ in JSON_BACKENDS if module is not None]
+
+
+def dumps_json(obj, pretty=True, backend=None):
+    """
+    Serializes obj to JSON bytes with the fastest installed backend (orjson,
+    then ujson, then the standard library) unless a backend is named. Pretty
+    output is indented by two spaces whichever backend is used.
+    """
+    for name, module, dumps in JSON_BACKENDS:
+        if module is not None and backend in (None, name):
+            return dumps(obj, pretty)
+    raise ValueError('ERROR: JSON backend {} is not available'.format(backend))
@@ -0,0 +1,107 @@
+import json
+import logging
+import mmap
+import os
+import struct
+
+from transcripts import TranscriptTable, pack_transcript_table, set_transcript_table
+from intervals import TranscriptIndex, set_transcript_index_loader
+from utils import enable_normalization_cache, get_normalization_cache
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'FXSN'
+SNAPSHOT_VERSION = 1
+
+# magic, version, table of contents length
+SNAPSHOT_HEADER = struct.Struct('<4sII')
+
+
+def build_snapshot(snapshot_file, fasta, genes, converter_version):
+    """
+    Serializes the converter's derived state into one versioned file: the
+    packed transcript table, the reference .fai index and the current
+    normalization cache. Sections are 8-byte aligned and located through a
+    JSON table of contents after the header.
+    """
+    sections = [('transcripts', pack_transcript_table(genes))]
+
+    if fasta is not None and os.path.isfile('{}.fai'.format(fasta)):
+        with open('{}.fai'.format(fasta), 'rb') as fd:
+            sections.append(('fasta_index', fd.read()))
+
+    normalizations = [[list(key), list(value)] for key, value in (get_normalization_cache() or {}).items()]
+    sections.append(('normalizations', json.dumps(normalizations).encode('utf-8')))
+
+    toc = {
+        'converter_version': converter_version,
+        'fasta': fasta,
+        'genes': genes,
+        'sections': {}
+    }
+    offset = 0
+    for name, data in sections:
+        toc['sections'][name] = [offset, len(data)]
+        offset += len(data) + (-len(data) % 8)
+    toc_data = json.dumps(toc).encode('utf-8')
+    toc_data += b' ' * (-(SNAPSHOT_HEADER.size + len(toc_data)) % 8)
+
+    tmp_file = '{}.tmp'.format(snapshot_file)
+    with open(tmp_file, 'wb') as fd:
+        fd.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(toc_data)))
+        fd.write(toc_data)
+        for _, data in sections:
+            fd.write(data)
+            fd.write(b'\0' * (-len(data) % 8))
+    os.rename(tmp_file, snapshot_file)
+    logger.info('Saved snapshot with %s to %s', ', '.join(name for name, _ in sections), snapshot_file)
+
+
+def load_snapshot(snapshot_file, fasta, genes, converter_version):
+    """
+    Maps a snapshot written by build_snapshot and installs its state. The
+    transcript table is used in place from the mapping and the interval index
+    is built from it one chromosome at a time as lookups need it. Returns False when the
+    snapshot was built for another converter version or genes file.
+    """
+    with open(snapshot_file, 'rb') as fd:
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, toc_length = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError('ERROR: {} is not a version {} snapshot'.format(snapshot_file, SNAPSHOT_VERSION))
+
+    toc = json.loads(data[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + toc_length].decode('utf-8'))
+    if toc['converter_version'] != converter_version or toc['genes'] != genes:
+        logger.warning('Ignoring snapshot %s built for version %s and genes %s',
+                       snapshot_file, toc['converter_version'], toc['genes'])
+        return False
+
+    base = SNAPSHOT_HEADER.size + toc_length
+
+    def section(name):
+        offset, length = toc['sections'][name]
+        return base + offset, length
+
+    offset, _ = section('transcripts')
+    table = TranscriptTable(snapshot_file, data, offset)
+    if os.path.isfile(genes) and table.matches(genes):
+        set_transcript_table(genes, table)
+        set_transcript_index_loader(genes, lambda: TranscriptIndex(genes, table))
+    else:
+        logger.warning('Ignoring transcripts in snapshot %s, they do not match %s', snapshot_file, genes)
+
+    fasta_index = '{}.fai'.format(fasta)
+    if ('fasta_index' in toc['sections'] and toc['fasta'] == fasta and
+            os.path.isfile(fasta) and not os.path.isfile(fasta_index)):
+        offset, length = section('fasta_index')
+        with open(fasta_index, 'wb') as fd:
+            fd.write(data[offset:offset + length])
+
+    offset, length = section('normalizations')
+    normalizations = json.loads(data[offset:offset + length].decode('utf-8'))
+    enable_normalization_cache((tuple(key), tuple(value)) for key, value in normalizations)
+
+    logger.info('Loaded snapshot %s', snapshot_file)
+    return True
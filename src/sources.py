@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import os
+import posixpath
+import sys
+import tarfile
+import zipfile
+
+
+STDIN = '-'
+
+REPORT_SUFFIXES = ('.xml', '.xml.gz')
+
+
+class DigestReader(object):
+    """
+    File object wrapper that hashes everything read through it, so a streamed
+    report can be fingerprinted for the manifest without a second pass.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fd.read(size)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def is_report(name):
+    return name.lower().endswith(REPORT_SUFFIXES)
+
+
+def report_name(name):
+    """
+    Output name of a bundle member: its path in the bundle without the report
+    suffix, so members with the same file name in different directories do
+    not overwrite each other's outputs.
+    """
+    path = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+    if path == '..' or path.startswith('../'):
+        raise ValueError('ERROR: bundle member {} is outside the bundle'.format(name))
+    for suffix in REPORT_SUFFIXES:
+        if path.lower().endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def is_archive(path):
+    if path == STDIN or not os.path.isfile(path):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def _open_member(name, fd):
+    if name.lower().endswith('.gz'):
+        return gzip.GzipFile(fileobj=fd, mode='rb')
+    return fd
+
+
+def _stdin():
+    return getattr(sys.stdin, 'buffer', sys.stdin)
+
+
+def open_sources(path):
+    """
+    Yields (name, file object) for every report in path, which may be a plain
+    or gzipped XML file, a zip or tar bundle (optionally compressed) or '-' for
+    stdin. Archive members are decompressed as they are read and tar bundles
+    are walked in stream mode, so nothing is extracted to disk and only the
+    member being parsed is held open. Each file object is only valid until the
+    next one is requested.
+    """
+    if path == STDIN:
+        fd = _stdin()
+        head = fd.peek(2)[:2] if hasattr(fd, 'peek') else b''
+        yield path, gzip.GzipFile(fileobj=fd, mode='rb') if head == b'\x1f\x8b' else fd
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as bundle:
+            for info in bundle.infolist():
+                if info.filename.endswith('/') or not is_report(info.filename):
+                    continue
+                fd = bundle.open(info)
+                try:
+                    yield info.filename, _open_member(info.filename, fd)
+                finally:
+                    fd.close()
+    elif tarfile.is_tarfile(path):
+        with open(path, 'rb') as raw:
+            bundle = tarfile.open(fileobj=raw, mode='r|*')
+            try:
+                for member in bundle:
+                    if not member.isfile() or not is_report(member.name):
+                        continue
+                    yield member.name, _open_member(member.name, bundle.extractfile(member))
+            finally:
+                bundle.close()
+    else:
+        with open(path, 'rb') as fd:
+            yield path, _open_member(path, fd)
@@ -0,0 +1,126 @@
+import re
+
+from bgzf import write_sorted_vcf
+
+
+# Contigs declared in the VCF headers, with their lengths.
+VCF_CONTIGS = [
+    ('chr1', 248956422), ('chr2', 242193529), ('chr3', 198295559), ('chr4', 190214555), ('chr5', 181538259),
+    ('chr6', 170805979), ('chr7', 159345973), ('chr8', 145138636), ('chr9', 138394717), ('chr10', 133797422),
+    ('chr11', 135086622), ('chr12', 133275309), ('chr13', 114364328), ('chr14', 107043718), ('chr15', 101991189),
+    ('chr16', 90338345), ('chr17', 83257441), ('chr18', 80373285), ('chr19', 58617616), ('chr20', 64444167),
+    ('chr21', 46709983), ('chr22', 50818468), ('chrX', 156040895), ('chrY', 57227415), ('chrM', 16569)
+]
+
+VENDOR_SIGNIFICANCE = {
+    'known': 'Pathogenic',
+    'likely': 'Likely_pathogenic',
+    'unknown': 'Uncertain_significance',
+    'ambiguous': 'other'
+}
+
+SV_HEADER = [
+    '##ALT=<ID=DEL,Description="Deletion">\n',
+    '##ALT=<ID=DUP,Description="Duplication">\n',
+    '##ALT=<ID=CNV,Description="Copy number variable region">\n',
+    '##INFO=<ID=SVTYPE,Number=1,Type=String,Description="Type of structural variant">\n',
+    '##INFO=<ID=END,Number=1,Type=Integer,Description="End position of the variant">\n',
+    '##INFO=<ID=SVLEN,Number=1,Type=Integer,Description="Difference in length between REF and ALT alleles">\n',
+    '##INFO=<ID=CIPOS,Number=2,Type=Integer,Description="Confidence interval around POS">\n',
+    '##INFO=<ID=MATEID,Number=.,Type=String,Description="ID of mate breakends">\n',
+    '##INFO=<ID=GENE,Number=.,Type=String,Description="Genes reported for the variant">\n',
+    '##INFO=<ID=EXONS,Number=1,Type=String,Description="Exons affected, as N/M">\n',
+    '##INFO=<ID=RATIO,Number=1,Type=Float,Description="Copy number ratio">\n',
+    '##INFO=<ID=READPAIRS,Number=1,Type=Integer,Description="Supporting read pairs">\n',
+    '##INFO=<ID=EQUIVOCAL,Number=0,Type=Flag,Description="Reported as equivocal">\n',
+    '##INFO=<ID=VENDSIG,Number=1,Type=String,Description="Vendor Significance">\n',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n',
+    '##FORMAT=<ID=CN,Number=1,Type=Integer,Description="Copy number">\n'
+]
+
+
+def parse_position(value):
+    """
+    Splits a report position, chr12:58093932-58188144 or chr1:32782332, into
+    (chrom, start, end). 'ch17'-style contig names are read as 'chr17'.
+    """
+    chrom, span = value.split(':')
+    if chrom.startswith('ch') and not chrom.startswith('chr'):
+        chrom = 'chr' + chrom[2:]
+    start, _, end = span.partition('-')
+    return chrom, int(start), int(end or start)
+
+
+def _info_value(value):
+    return re.sub(r'[\s;=,]+', '_', value)
+
+
+def _info(fields):
+    return ';'.join(key if value is True else '{}={}'.format(key, value)
+                    for key, value in fields if value not in (None, False, ''))
+
+
+def cnv_record(cnv):
+    chrom, start, end = parse_position(cnv['@position'])
+    cnv_type = cnv.get('@type', '').lower()
+    if 'amplification' in cnv_type or 'gain' in cnv_type:
+        svtype, svlen = 'DUP', end - start + 1
+    elif 'loss' in cnv_type or 'deletion' in cnv_type:
+        svtype, svlen = 'DEL', start - end - 1
+    else:
+        svtype, svlen = 'CNV', None
+    exons = re.match(r'\s*([0-9]+)\s+of\s+([0-9]+)', cnv.get('@number-of-exons', ''))
+
+    info = _info([
+        ('SVTYPE', svtype), ('END', end), ('SVLEN', svlen), ('GENE', _info_value(cnv.get('@gene', ''))),
+        ('EXONS', '{}/{}'.format(*exons.groups()) if exons else None), ('RATIO', cnv.get('@ratio')),
+        ('EQUIVOCAL', cnv.get('@equivocal') == 'true'), ('VENDSIG', VENDOR_SIGNIFICANCE.get(cnv.get('@status')))
+    ])
+    return '{}\t{}\t.\tN\t<{}>\t.\tPASS\t{}\tGT:CN\t.:{}\n'.format(
+        chrom, start, svtype, info, cnv.get('@copy-number') or '.')
+
+
+def rearrangement_records(rearrangement, number):
+    """
+    The two breakends of a rearrangement. The report gives each side as a
+    region, so the breakend is placed at its start with CIPOS spanning it.
+    """
+    sides = [parse_position(rearrangement['@pos1']), parse_position(rearrangement['@pos2'])]
+    ids = ['bnd{}_1'.format(number), 'bnd{}_2'.format(number)]
+    target_gene = rearrangement.get('@targeted-gene', rearrangement.get('@target-gene'))
+    genes = [x for x in (target_gene, rearrangement.get('@other-gene')) if x and x != 'N/A']
+
+    records = []
+    for i, (chrom, start, end) in enumerate(sides):
+        mate_chrom, mate_start, _ = sides[1 - i]
+        alt = 'N[{}:{}['.format(mate_chrom, mate_start) if i == 0 else ']{}:{}]N'.format(mate_chrom, mate_start)
+        info = _info([
+            ('SVTYPE', 'BND'), ('MATEID', ids[1 - i]), ('CIPOS', '0,{}'.format(end - start) if end > start else None),
+            ('GENE', ','.join(_info_value(x) for x in genes)), ('READPAIRS', rearrangement.get('@supporting-read-pairs')),
+            ('EQUIVOCAL', rearrangement.get('@equivocal') == 'true'),
+            ('VENDSIG', VENDOR_SIGNIFICANCE.get(rearrangement.get('@status')))
+        ])
+        records.append('{}\t{}\t{}\tN\t{}\t.\tPASS\t{}\tGT\t.\n'.format(chrom, start, ids[i], alt, info))
+    return records
+
+
+def sv_records(cnvs, rearrangements):
+    records = [cnv_record(x) for x in cnvs]
+    for number, rearrangement in enumerate(rearrangements, 1):
+        records.extend(rearrangement_records(rearrangement, number))
+    return records
+
+
+def write_sv_vcf(records, specimen_name, fasta, sv_vcf_out_file, index_format=None):
+    """
+    Writes copy number alterations as <DUP>/<DEL>/<CNV> records and
+    rearrangements as BND pairs, sorted in process and BGZF-compressed with
+    an index when index_format is given.
+    """
+    header = ['##fileformat=VCFv4.2\n', '##source=foundation-xml-fhir\n']
+    if fasta is not None:
+        header.append('##reference=file://{}\n'.format(fasta))
+    header.extend(SV_HEADER)
+    header.extend('##contig=<ID={},length={}>\n'.format(chrom, length) for chrom, length in VCF_CONTIGS)
+    header.append('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n'.format(specimen_name))
+    write_sorted_vcf(header, records, sv_vcf_out_file, index_format)
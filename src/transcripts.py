@@ -0,0 +1,326 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+TABLE_MAGIC = b'FXTT'
+TABLE_VERSION = 1
+
+# magic, version, transcript count, exon count, genes file size, genes file mtime
+TABLE_HEADER = struct.Struct('<4sIIIQQ')
+# accession, id, gene and chrom as (offset, length) into the string pool, then
+# strand, tx start/end, cds start/end, first exon and exon count
+TABLE_TRANSCRIPT = struct.Struct('<IHIHIHIHbiiiiII')
+# exon start, end and frame
+TABLE_EXON = struct.Struct('<iib')
+
+_stores = {}
+_planned_transcripts = {}
+
+
+def _text(line):
+    return line if isinstance(line, str) else line.decode('utf-8')
+
+
+def transcript_accession(name):
+    return name.split('.')[0]
+
+
+def parse_refgene_row(line):
+    # Mirrors pyhgvs.utils.read_refgene so rows can be parsed without pyhgvs.
+    if line.startswith('#'):
+        return None
+    row = line.rstrip('\n').split('\t')
+    if len(row) != 16:
+        return None
+
+    exon_starts = [int(x) for x in row[9].split(',')[:-1]]
+    exon_ends = [int(x) for x in row[10].split(',')[:-1]]
+    exon_frames = [int(x) for x in row[15].split(',')[:-1]]
+    return {
+        'chrom': row[2],
+        'start': int(row[4]),
+        'end': int(row[5]),
+        'id': row[1],
+        'strand': row[3],
+        'cds_start': int(row[6]),
+        'cds_end': int(row[7]),
+        'gene_name': row[12],
+        'exons': list(zip(exon_starts, exon_ends)),
+        'exon_frames': exon_frames
+    }
+
+
+def build_offset_index(genes):
+    offsets = {}
+    with open(genes, 'rb') as fd:
+        offset = 0
+        for line in iter(fd.readline, b''):
+            if not line.startswith(b'#'):
+                fields = line.split(b'\t', 2)
+                if len(fields) > 2:
+                    offsets.setdefault(transcript_accession(_text(fields[1])), []).append(offset)
+            offset += len(line)
+    return offsets
+
+
+def load_offset_index(genes):
+    """
+    Returns the byte offsets of every genes file row keyed by transcript
+    accession, read from the <genes>.idx sidecar when it matches the genes
+    file and rebuilt (and saved, when the directory is writable) otherwise.
+    """
+    index_file = '{}.idx'.format(genes)
+    stat = os.stat(genes)
+
+    try:
+        with open(index_file) as fd:
+            index = json.load(fd)
+        if (index['version'] == INDEX_VERSION and index['size'] == stat.st_size and
+                index['mtime'] == int(stat.st_mtime)):
+            return index['offsets']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    offsets = build_offset_index(genes)
+    try:
+        tmp_file = '{}.tmp'.format(index_file)
+        with open(tmp_file, 'w') as fd:
+            json.dump({'version': INDEX_VERSION, 'size': stat.st_size, 'mtime': int(stat.st_mtime),
+                       'offsets': offsets}, fd)
+        os.rename(tmp_file, index_file)
+    except (IOError, OSError):
+        logger.warning('Unable to save transcript index %s', index_file)
+    return offsets
+
+
+def pack_transcript_table(genes):
+    """
+    Packs the transcript and exon coordinates of a genes file into flat
+    fixed-width tables with a string pool, sorted by accession, that
+    TranscriptTable reads in place.
+    """
+    stat = os.stat(genes)
+
+    with open(genes, 'rb') as fd:
+        records = [x for x in (parse_refgene_row(_text(line)) for line in fd) if x is not None]
+    records.sort(key=lambda x: transcript_accession(x['id']))
+
+    pool = bytearray()
+    pooled = {}
+
+    def intern(value):
+        if value not in pooled:
+            encoded = value.encode('utf-8')
+            pooled[value] = (len(pool), len(encoded))
+            pool.extend(encoded)
+        return pooled[value]
+
+    transcripts = bytearray()
+    exons = bytearray()
+    exon_count = 0
+    for record in records:
+        fields = (intern(transcript_accession(record['id'])) + intern(record['id']) +
+                  intern(record['gene_name']) + intern(record['chrom']))
+        transcripts.extend(TABLE_TRANSCRIPT.pack(*(fields + (
+            1 if record['strand'] == '+' else -1, record['start'], record['end'],
+            record['cds_start'], record['cds_end'], exon_count, len(record['exons'])))))
+        for (start, end), frame in zip(record['exons'], record['exon_frames']):
+            exons.extend(TABLE_EXON.pack(start, end, frame))
+        exon_count += len(record['exons'])
+
+    header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, len(records), exon_count,
+                               stat.st_size, int(stat.st_mtime))
+    return bytes(header + transcripts + exons + pool)
+
+
+def build_transcript_table(genes, table_file=None):
+    """
+    Writes the packed transcript table to <genes>.tbl (by default), which
+    TranscriptTable maps read-only so every worker on a host shares one copy
+    in the page cache.
+    """
+    table_file = table_file or '{}.tbl'.format(genes)
+    tmp_file = '{}.tmp'.format(table_file)
+    with open(tmp_file, 'wb') as fd:
+        fd.write(pack_transcript_table(genes))
+    os.rename(tmp_file, table_file)
+    return table_file
+
+
+class TranscriptTable(object):
+    """
+    Read-only view of a table written by build_transcript_table. Lookups
+    binary search the mmap'd transcript table; nothing is copied into the
+    process beyond the rows that are asked for.
+    """
+    def __init__(self, table_file, data=None, offset=0):
+        if data is None:
+            with open(table_file, 'rb') as fd:
+                data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = data
+        (magic, version, self.transcript_count, self.exon_count,
+         self.genes_size, self.genes_mtime) = TABLE_HEADER.unpack_from(data, offset)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError('ERROR: {} is not a version {} transcript table'.format(table_file, TABLE_VERSION))
+
+        self.transcripts_offset = offset + TABLE_HEADER.size
+        self.exons_offset = self.transcripts_offset + self.transcript_count * TABLE_TRANSCRIPT.size
+        self.strings_offset = self.exons_offset + self.exon_count * TABLE_EXON.size
+
+    def matches(self, genes):
+        stat = os.stat(genes)
+        return self.genes_size == stat.st_size and self.genes_mtime == int(stat.st_mtime)
+
+    def string(self, offset, length):
+        start = self.strings_offset + offset
+        return _text(self.data[start:start + length])
+
+    def row(self, i):
+        return TABLE_TRANSCRIPT.unpack_from(self.data, self.transcripts_offset + i * TABLE_TRANSCRIPT.size)
+
+    def accession(self, i):
+        row = self.row(i)
+        return self.string(row[0], row[1])
+
+    def span(self, i):
+        """
+        Chromosome, 0-based start, end and accession of transcript i.
+        """
+        row = self.row(i)
+        return self.string(row[6], row[7]), row[9], row[10], self.string(row[0], row[1])
+
+    def record(self, i):
+        (_, _, id_offset, id_length, gene_offset, gene_length, chrom_offset, chrom_length,
+         strand, start, end, cds_start, cds_end, exon_first, exon_count) = self.row(i)
+
+        exons = [TABLE_EXON.unpack_from(self.data, self.exons_offset + j * TABLE_EXON.size)
+                 for j in range(exon_first, exon_first + exon_count)]
+        return {
+            'chrom': self.string(chrom_offset, chrom_length),
+            'start': start,
+            'end': end,
+            'id': self.string(id_offset, id_length),
+            'strand': '+' if strand > 0 else '-',
+            'cds_start': cds_start,
+            'cds_end': cds_end,
+            'gene_name': self.string(gene_offset, gene_length),
+            'exons': [(x[0], x[1]) for x in exons],
+            'exon_frames': [x[2] for x in exons]
+        }
+
+    def records(self, accession):
+        lo, hi = 0, self.transcript_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.accession(mid) < accession:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        records = []
+        while lo < self.transcript_count and self.accession(lo) == accession:
+            records.append(self.record(lo))
+            lo += 1
+        return records
+
+
+def open_transcript_table(genes):
+    table_file = '{}.tbl'.format(genes)
+    if not os.path.isfile(table_file):
+        return None
+
+    table = TranscriptTable(table_file)
+    if not table.matches(genes):
+        logger.warning('Ignoring transcript table %s, it does not match %s', table_file, genes)
+        return None
+    return table
+
+
+class TranscriptStore(object):
+    """
+    Loads pyhgvs transcripts from a genes file on demand. Only the rows for
+    requested accessions are read, from the shared transcript table when one
+    has been built and through the offset index otherwise, so memory and load
+    time follow the report rather than the annotation file.
+    """
+    def __init__(self, genes, table=None):
+        self.genes = genes
+        self.table = table if table is not None else open_transcript_table(genes)
+        self.offsets = None
+        self.loaded = set()
+        self.transcripts = {}
+
+    def read_rows(self, names):
+        if self.offsets is None:
+            self.offsets = load_offset_index(self.genes)
+
+        accessions = set(transcript_accession(x) for x in names) - self.loaded
+        offsets = sorted(offset for x in accessions for offset in self.offsets.get(x, []))
+        self.loaded.update(accessions)
+
+        rows = []
+        with open(self.genes, 'rb') as fd:
+            for offset in offsets:
+                fd.seek(offset)
+                rows.append(_text(fd.readline()))
+        return rows
+
+    def read_records(self, names):
+        if self.table is None:
+            rows = [parse_refgene_row(x) for x in self.read_rows(names)]
+            return [x for x in rows if x is not None]
+
+        accessions = set(transcript_accession(x) for x in names) - self.loaded
+        self.loaded.update(accessions)
+        return [record for x in sorted(accessions) for record in self.table.records(x)]
+
+    def preload(self, names):
+        records = self.read_records(names)
+        if records:
+            import pyhgvs.utils as hgvs_utils
+
+        for record in records:
+            transcript = hgvs_utils.make_transcript(record)
+            self.transcripts[transcript.name] = transcript
+            self.transcripts[transcript.full_name] = transcript
+
+    def get(self, name):
+        if transcript_accession(name) not in self.loaded:
+            self.preload([name])
+        return self.transcripts.get(name)
+
+
+def plan_transcripts(genes, names):
+    if genes in _stores:
+        _stores[genes].preload(names)
+    else:
+        _planned_transcripts[genes] = set(names)
+
+
+def set_transcript_table(genes, table):
+    _stores[genes] = TranscriptStore(genes, table)
+    _stores[genes].preload(_planned_transcripts.pop(genes, []))
+
+
+def get_transcript_store(genes):
+    store = _stores.get(genes)
+    if store is None:
+        store = TranscriptStore(genes)
+        store.preload(_planned_transcripts.pop(genes, []))
+        _stores[genes] = store
+    return store
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    for genes_file in sys.argv[1:]:
+        load_offset_index(genes_file)
+        logger.info('Built transcript table %s', build_transcript_table(genes_file))
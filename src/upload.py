@@ -0,0 +1,134 @@
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+from serializers import dumps_json
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Resources the Observations refer to, sent before them, and those referring
+# to the Observations, sent after them, so a server enforcing references
+# never sees one that does not exist yet.
+REFERENCED_TYPES = ('Patient', 'Specimen', 'Sequence')
+REFERRING_TYPES = ('DiagnosticReport',)
+
+
+def create_bundle(resources, removed=()):
+    entries = [{
+        'resource': resource,
+        'request': {
+            'method': 'PUT',
+            'url': '{}/{}'.format(resource['resourceType'], resource['id'])
+        }
+    } for resource in resources]
+
+    entries.extend({
+        'request': {
+            'method': 'DELETE',
+            'url': reference
+        }
+    } for reference in removed)
+
+    return {
+        'resourceType': 'Bundle',
+        'type': 'transaction',
+        'entry': entries
+    }
+
+
+def create_batches(items, batch_size):
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def upload_stages(resources, removed=()):
+    """
+    Splits a report's resources and removed references into the groups that
+    must reach the server one after the other: the referenced resources, the
+    Observations, the DiagnosticReport and last the deletions of resources
+    the previous DiagnosticReport referred to.
+    """
+    referenced = [x for x in resources if x['resourceType'] in REFERENCED_TYPES]
+    referring = [x for x in resources if x['resourceType'] in REFERRING_TYPES]
+    rest = [x for x in resources if x['resourceType'] not in REFERENCED_TYPES + REFERRING_TYPES]
+    return [x for x in ((referenced, []), (rest, []), (referring, []), ([], list(removed))) if x[0] or x[1]]
+
+
+class FhirUploader(object):
+    """
+    Sends FHIR resources to a FHIR server as transaction Bundles over a pooled
+    keep-alive session, with a bounded number of Bundles in flight and
+    exponential backoff on connection errors and retryable status codes.
+    Resources are PUT by ID so retries and re-runs are idempotent. One
+    uploader is meant to serve every report of a run, so its connections and
+    threads are reused.
+    """
+    def __init__(self, base_url, batch_size=100, concurrency=4, retries=5, backoff=0.5, token=None, timeout=60):
+        if requests is None:
+            raise ImportError('FHIR upload requires the requests package')
+
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/fhir+json',
+            'Accept': 'application/fhir+json'
+        })
+        if token is not None:
+            self.session.headers['Authorization'] = 'Bearer {}'.format(token)
+        self.pool = ThreadPool(concurrency)
+
+    def post_bundle(self, bundle):
+        data = dumps_json(bundle, pretty=False)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.base_url, data=data, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error = 'HTTP {}'.format(response.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt >= self.retries:
+                raise IOError('ERROR: FHIR upload failed after {} attempts: {}'.format(attempt + 1, error))
+            delay = self.backoff * (2 ** attempt)
+            logger.warning('FHIR upload failed (%s), retrying in %.1fs', error, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def upload(self, resources, removed=()):
+        """
+        Uploads a report's resources in the order of upload_stages, each
+        stage's Bundles concurrently, and returns the Bundle responses.
+        """
+        responses = []
+        for stage_resources, stage_removed in upload_stages(resources, removed):
+            bundles = [create_bundle(batch) for batch in create_batches(stage_resources, self.batch_size)]
+            bundles.extend(create_bundle([], batch) for batch in create_batches(stage_removed, self.batch_size))
+            responses.extend(self.pool.map(self.post_bundle, bundles))
+
+        logger.info('Uploaded %d FHIR resources in %d bundles to %s', len(resources), len(responses), self.base_url)
+        return responses
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.session.close()
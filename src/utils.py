@@ -1,27 +1,195 @@
 import re
+from bisect import bisect_right
+from collections import OrderedDict
 
-try:
-    import pyhgvs as hgvs
-    import pyhgvs.utils as hgvs_utils
-    from pyfaidx import Fasta
-except ImportError:
-    Fasta = None
+from transcripts import get_transcript_store
+
+# pyhgvs and pyfaidx are slow to import and only needed for short variants, so
+# they are imported on first use.
 
 
 _COMP = dict(A='T', C='G', G='C', T='A', N='N',
              a='t', c='g', g='c', t='a', n='n')
 
+# Bases of context fetched on either side of a variant so normalization can
+# shift indels without going back to the reference file.
+REFERENCE_FLANK = 100
 
-def parse_hgvs(hgvs_name, fasta, genes):
-    genome = Fasta(fasta, key_function=lambda x: 'chr{}'.format(x))
+# Windows closer together than this are read as a single region.
+REFERENCE_MAX_GAP = 1000
+
+# Normalizations kept per process, a few hundred bytes each, so the cache of
+# a long-running watch or queue worker stays within tens of MB.
+NORMALIZATION_CACHE_SIZE = 100000
+
+_genomes = {}
+_planned_windows = {}
+_normalizations = None
+_normalization_stats = {'hits': 0, 'misses': 0}
+
+
+class BufferedContig(object):
+    def __init__(self, genome, chrom):
+        self.genome = genome
+        self.chrom = chrom
+
+    def __len__(self):
+        return len(self.genome.genome[self.chrom])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1]
+        start = key.start or 0
+        stop = len(self) if key.stop is None else key.stop
+        return self.genome.fetch(self.chrom, start + 1, stop)
+
+
+class BufferedGenome(object):
+    """
+    Wraps a Fasta so the reference windows planned for a report are read in a
+    few sequential passes and later slices are served from memory. Planning a
+    new report drops the previous buffers; slices outside the planned windows
+    fall through to the underlying Fasta.
+    """
+    def __init__(self, genome, max_gap=REFERENCE_MAX_GAP):
+        self.genome = genome
+        self.max_gap = max_gap
+        self.pending = []
+        self.starts = {}
+        self.regions = {}
+
+    def __contains__(self, chrom):
+        return chrom in self.genome
+
+    def __getitem__(self, chrom):
+        return BufferedContig(self, chrom)
+
+    def plan(self, windows):
+        self.pending = list(windows)
+        self.starts = {}
+        self.regions = {}
+
+    def fill(self):
+        windows, self.pending = self.pending, []
+        for chrom, start, end in merge_windows(windows, self.max_gap):
+            if chrom not in self.genome:
+                continue
+            seq = str(self.genome[chrom][start - 1:end])
+            regions = self.regions.setdefault(chrom, [])
+            regions.append((start, start + len(seq) - 1, seq))
+            regions.sort()
+            self.starts[chrom] = [region[0] for region in regions]
+
+    def fetch(self, chrom, start, end):
+        if self.pending:
+            self.fill()
+
+        i = bisect_right(self.starts.get(chrom, []), start) - 1
+        if i >= 0:
+            region_start, region_end, seq = self.regions[chrom][i]
+            if end <= region_end:
+                return seq[start - region_start:end - region_start + 1]
+        return str(self.genome[chrom][start - 1:end])
+
+
+def merge_windows(windows, max_gap=REFERENCE_MAX_GAP):
+    merged = []
+    for chrom, start, end in sorted(windows):
+        if merged and merged[-1][0] == chrom and start <= merged[-1][2] + max_gap + 1:
+            merged[-1][2] = max(merged[-1][2], end)
+        else:
+            merged.append([chrom, start, end])
+    return [tuple(window) for window in merged]
+
+
+def reference_window(cdsEffect, position, flank=REFERENCE_FLANK):
+    [chr, sPos] = position.split(':')
+    startPos = int(sPos)
+    lengths = [len(seq) for seq in re.findall(r'[ACGTNacgtn]{2,}', cdsEffect)]
+    lengths.extend(int(count) for count in re.findall(r'(?:ins|del|dup)([0-9]+)$', cdsEffect))
+    extent = max(lengths + [1])
+    return (chr, max(1, startPos - flank), startPos + extent + flank)
 
-    with open(genes) as infile:
-        transcripts = hgvs_utils.read_transcripts(infile)
 
-    def get_transcript(name):
-        return transcripts.get(name)
+def plan_reference_windows(fasta, windows):
+    if fasta in _genomes:
+        _genomes[fasta].plan(windows)
+    else:
+        _planned_windows[fasta] = list(windows)
+
+
+def get_genome(fasta):
+    genome = _genomes.get(fasta)
+    if genome is None:
+        from pyfaidx import Fasta
+        genome = BufferedGenome(Fasta(fasta, key_function=lambda x: 'chr{}'.format(x)))
+        genome.plan(_planned_windows.pop(fasta, []))
+        _genomes[fasta] = genome
+    return genome
+
+
+class LruCache(object):
+    """
+    Mapping that keeps the max_entries most recently used entries.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        return list(self.entries.items())
+
+    def update(self, entries):
+        for key, value in entries:
+            self[key] = value
+
+    def clear(self):
+        self.entries.clear()
+
+
+def enable_normalization_cache(entries=(), max_entries=NORMALIZATION_CACHE_SIZE):
+    global _normalizations
+    if _normalizations is None:
+        _normalizations = LruCache(max_entries)
+    _normalizations.update(entries)
+
+
+def get_normalization_cache():
+    return _normalizations
+
+
+def get_normalization_stats():
+    """
+    Lookups of the normalization cache in this process that were served from
+    it and that had to normalize the variant.
+    """
+    return _normalization_stats
+
+
+def parse_hgvs(hgvs_name, fasta, genes):
+    import pyhgvs as hgvs
+
+    genome = get_genome(fasta)
+    transcripts = get_transcript_store(genes)
 
-    return hgvs.parse_hgvs_name(hgvs_name, genome, get_transcript=get_transcript)
+    return hgvs.parse_hgvs_name(hgvs_name, genome, get_transcript=transcripts.get)
 
 
 def getRevComp(seq):
@@ -33,7 +201,7 @@ def getSequence(genome, chrom, start, end):
 
 
 def parse_splice(cdsEffect, position, strand, fasta):
-    genome = Fasta(fasta, key_function=lambda x: 'chr{}'.format(x))
+    genome = get_genome(fasta)
 
     [chr, sPos] = position.split(':')
     startPos=int(sPos)
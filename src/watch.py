@@ -0,0 +1,238 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import stat
+import struct
+import time
+
+from sources import is_report
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a file's size and modification time must stay the same before it
+# is taken as completely written.
+SETTLE_TIME = 5.0
+
+# Seconds between directory scans when inotify is not available.
+POLL_INTERVAL = 10.0
+
+BUNDLE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# Names transfer clients use while a file is still being written.
+PARTIAL_SUFFIXES = ('.tmp', '.part', '.filepart', '.partial')
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# struct inotify_event: wd, mask, cookie and the length of the name after it.
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def is_candidate(name):
+    lower = name.lower()
+    return not name.startswith('.') and not lower.endswith(PARTIAL_SUFFIXES) and \
+        (is_report(name) or lower.endswith(BUNDLE_SUFFIXES))
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, 'inotify_init1') else None
+
+
+class Inotify(object):
+    """
+    The paths of files and directories created, written or moved into the
+    watched directories, read from a Linux inotify descriptor through libc.
+    A watched directory that is deleted or moved away is no longer watched
+    and its own path is reported.
+    """
+    def __init__(self):
+        self.libc = _libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+
+    def add_watch(self, directory):
+        path = directory if isinstance(directory, bytes) else directory.encode('utf-8')
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_EVENTS)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for {}'.format(directory))
+        self.directories[wd] = directory
+
+    def watching(self, directory):
+        return directory in self.directories.values()
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events and returns the paths they
+        concern, or None when the kernel queue overflowed and events were
+        lost.
+        """
+        paths = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return paths
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return paths
+            raise
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                directory = self.directories.pop(wd, None)
+                if directory is not None:
+                    if mask & IN_MOVE_SELF:
+                        # Still watched under its new name, which is unknown
+                        self.libc.inotify_rm_watch(self.fd, wd)
+                    paths.add(directory)
+            elif name and wd in self.directories:
+                paths.add(os.path.join(self.directories[wd], name.decode('utf-8', 'replace')))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher(object):
+    """
+    Reports files dropped into a directory, or into its immediate
+    subdirectories other than the excluded ones, once their size and
+    modification time have not changed for settle seconds, so partially
+    delivered files are not picked up. New files are noticed through
+    inotify where the platform has it; otherwise the directories are
+    rescanned every interval seconds. Files already present are picked up
+    on the first poll.
+    """
+    def __init__(self, directory, settle=SETTLE_TIME, interval=POLL_INTERVAL, use_inotify=True, exclude=()):
+        # Normalized so subdirectories are recognized by their dirname, however
+        # the directory was written
+        self.directory = directory = os.path.abspath(directory)
+        self.settle = settle
+        self.interval = interval
+        self.exclude = set(os.path.abspath(x) for x in exclude)
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+                self.inotify.add_watch(directory)
+            except OSError as e:
+                logger.warning('Polling %s every %ss, inotify is not available: %s', directory, interval, e)
+                if self.inotify is not None:
+                    self.inotify.close()
+                    self.inotify = None
+        self.subdirectories = set()
+        self.changing = {}
+        self.emitted = set()
+        self.last_scan = None
+
+    def is_subdirectory(self, path):
+        return os.path.dirname(path) == self.directory and not os.path.basename(path).startswith('.') and \
+            os.path.abspath(path) not in self.exclude and os.path.isdir(path)
+
+    def list_subdirectory(self, path):
+        if self.inotify is not None and path not in self.subdirectories:
+            self.inotify.add_watch(path)
+        self.subdirectories.add(path)
+        try:
+            return set(os.path.join(path, x) for x in os.listdir(path))
+        except OSError:
+            return set()
+
+    def scan(self):
+        paths, subdirectories = set(), set()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if self.is_subdirectory(path):
+                subdirectories.add(path)
+                paths.update(self.list_subdirectory(path))
+            else:
+                paths.add(path)
+        # Subdirectories deleted since, which need a new watch if recreated
+        self.subdirectories &= subdirectories
+        self.last_scan = time.time()
+        self.emitted &= paths
+        return paths - self.emitted
+
+    def poll(self, timeout=1.0):
+        """
+        Waits up to timeout seconds and returns the paths of the files that
+        have settled since the last call.
+        """
+        if self.last_scan is None:
+            paths = self.scan()
+        elif self.inotify is not None:
+            paths = self.inotify.read(timeout)
+            if paths is None:
+                logger.warning('inotify queue overflowed, rescanning %s', self.directory)
+                paths = self.scan()
+            else:
+                self.emitted -= paths
+                self.subdirectories = set(x for x in self.subdirectories if self.inotify.watching(x))
+                for path in [x for x in paths if self.is_subdirectory(x)]:
+                    paths.update(self.list_subdirectory(path))
+        else:
+            time.sleep(timeout)
+            paths = self.scan() if time.time() - self.last_scan >= self.interval else set()
+
+        now = time.time()
+        ready = []
+        for path in set(x for x in paths if is_candidate(os.path.basename(x))) | set(self.changing):
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                self.changing.pop(path, None)
+                continue
+            state = (st.st_size, st.st_mtime)
+            if path not in self.changing or self.changing[path][0] != state:
+                self.changing[path] = (state, now)
+            elif now - self.changing[path][1] >= self.settle:
+                del self.changing[path]
+                self.emitted.add(path)
+                ready.append(path)
+        return sorted(ready)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def move_to(path, directory):
+    """
+    Moves path into directory with a rename, which is atomic when both are on
+    one file system. A file already there under the same name is kept and
+    the new one is prefixed with a timestamp.
+    """
+    target = os.path.join(directory, os.path.basename(path))
+    if os.path.exists(target):
+        target = os.path.join(directory, '{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), os.path.basename(path)))
+    os.rename(path, target)
+    return target
@@ -0,0 +1,301 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from scheduler import METRICS_WINDOW
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# Seconds a worker holds a job without renewing its lease.
+LEASE_TIME = 300.0
+
+MAX_ATTEMPTS = 3
+
+# Statements taking the schema from each version to the next. The database's
+# PRAGMA user_version records how many have been applied, so a queue created
+# by an older converter is upgraded in place when it is opened.
+MIGRATIONS = [
+    [
+        'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, state TEXT NOT NULL, '
+        'owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)'
+    ],
+    [
+        'ALTER TABLE jobs ADD COLUMN cost INTEGER NOT NULL DEFAULT 0',
+        'DROP INDEX jobs_state',
+        'CREATE INDEX jobs_state ON jobs (state, cost DESC, id)'
+    ],
+    [
+        # Jobs queued before projects existed have an empty project and are
+        # converted for the draining worker's -p
+        "ALTER TABLE jobs ADD COLUMN project TEXT NOT NULL DEFAULT ''",
+        'ALTER TABLE jobs ADD COLUMN created REAL NOT NULL DEFAULT 0',
+        'ALTER TABLE jobs ADD COLUMN leased REAL',
+        'UPDATE jobs SET created = updated',
+        'DROP INDEX jobs_state',
+        'CREATE INDEX jobs_state ON jobs (state, project, cost DESC, id)',
+        'CREATE TABLE projects (project TEXT PRIMARY KEY, weight REAL NOT NULL DEFAULT 1, max_running INTEGER, '
+        'served REAL NOT NULL DEFAULT 0)',
+        'INSERT INTO projects (project) SELECT DISTINCT project FROM jobs'
+    ]
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(cursor):
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0:
+        # Queues created before the version was recorded
+        columns = set(row[1] for row in cursor.execute('PRAGMA table_info(jobs)'))
+        if 'project' in columns:
+            version = 3
+        elif 'cost' in columns:
+            version = 2
+        elif columns:
+            version = 1
+    return version
+
+
+# The project to lease from next: the one with the least work served per unit
+# of weight among those with queued jobs and below their concurrency cap.
+NEXT_PROJECT = (
+    'SELECT p.project FROM projects p '
+    'WHERE EXISTS (SELECT 1 FROM jobs j WHERE j.project = p.project AND j.state = :queued) '
+    'AND (p.max_running IS NULL OR '
+    '(SELECT COUNT(*) FROM jobs j WHERE j.project = p.project AND j.state = :leased) < p.max_running) '
+    'ORDER BY p.served, p.project LIMIT 1'
+)
+
+# Least work served by the other active projects, which a project becoming
+# active starts from so its idle time earns it no credit.
+ACTIVE_SERVED = (
+    'SELECT MIN(p.served) FROM projects p WHERE p.project != :project '
+    'AND EXISTS (SELECT 1 FROM jobs j WHERE j.project = p.project AND j.state IN (:queued, :leased))'
+)
+
+
+# Nearest-rank percentile of the wait, from queueing to the last lease, and of
+# the latency, from queueing to completion, over a project's recent jobs.
+WAIT_PERCENTILE = (
+    'SELECT wait FROM (SELECT leased - created AS wait FROM jobs WHERE project = :project AND leased IS NOT NULL '
+    'ORDER BY id DESC LIMIT :window) ORDER BY wait LIMIT 1 OFFSET :rank'
+)
+LATENCY_PERCENTILE = (
+    'SELECT latency FROM (SELECT updated - created AS latency FROM jobs WHERE project = :project AND state = :done '
+    'ORDER BY id DESC LIMIT :window) ORDER BY latency LIMIT 1 OFFSET :rank'
+)
+
+
+class WorkQueue(object):
+    """
+    A queue of report paths in a sqlite database on storage shared by the
+    worker nodes, kept per project. Projects share the workers by weighted
+    fair queueing on the estimated cost of the jobs leased, with optional
+    caps on the jobs each may have leased at once. Workers lease one job at a
+    time and renew the lease while
+    they convert it; a job whose lease expires, because its worker died or
+    hung, goes back to the queue until it has been attempted max_attempts
+    times. Within a project the most costly jobs are leased first, so the
+    longest conversions do not trail at the end of a backlog. Every change runs in an immediate
+    transaction, so concurrent workers never lease the same job. The default
+    rollback journal is kept because WAL does not work over network file
+    systems.
+    """
+    def __init__(self, path, lease_time=LEASE_TIME, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self.transaction() as cursor:
+            version = schema_version(cursor)
+            if version > SCHEMA_VERSION:
+                raise ValueError('ERROR: {} was created by a newer version of the converter'.format(path))
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    cursor.execute(statement)
+            cursor.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+
+    @contextmanager
+    def transaction(self, mode='IMMEDIATE'):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN {}'.format(mode))
+            try:
+                yield cursor
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def add(self, paths, project, estimate=None):
+        """
+        Queues the paths not already queued or leased for project, with the
+        cost estimate(path) gives them, and returns how many were added. A
+        path whose job is done or failed is queued again from scratch, so a
+        report can be reprocessed once it or the converter is fixed.
+        """
+        costs = [estimate(path) if estimate is not None else 0 for path in paths]
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO projects (project) VALUES (?)', (project,))
+            active = cursor.execute('SELECT COUNT(*) FROM jobs WHERE project = ? AND state IN (?, ?)',
+                                    (project, QUEUED, LEASED)).fetchone()[0]
+            if not active:
+                served = cursor.execute(ACTIVE_SERVED, {'project': project, 'queued': QUEUED,
+                                                        'leased': LEASED}).fetchone()[0]
+                if served is not None:
+                    cursor.execute('UPDATE projects SET served = MAX(served, ?) WHERE project = ?', (served, project))
+            added = 0
+            for path, cost in zip(paths, costs):
+                cursor.execute('INSERT OR IGNORE INTO jobs (path, project, state, cost, created, updated) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', (path, project, QUEUED, cost, now, now))
+                if cursor.rowcount == 0:
+                    cursor.execute('UPDATE jobs SET project = ?, state = ?, cost = ?, owner = NULL, '
+                                   'lease_expires = NULL, attempts = 0, error = NULL, created = ?, leased = NULL, '
+                                   'updated = ? '
+                                   'WHERE path = ? AND state IN (?, ?)',
+                                   (project, QUEUED, cost, now, now, path, DONE, FAILED))
+                added += cursor.rowcount
+        return added
+
+    def set_project(self, project, weight=None, max_running=None):
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO projects (project) VALUES (?)', (project,))
+            if weight is not None:
+                cursor.execute('UPDATE projects SET weight = ? WHERE project = ?', (weight, project))
+            if max_running is not None:
+                cursor.execute('UPDATE projects SET max_running = ? WHERE project = ?', (max_running, project))
+
+    def requeue_expired(self, cursor, now):
+        cursor.execute('UPDATE jobs SET state = ?, owner = NULL, error = ?, updated = ? '
+                       'WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+                       (FAILED, 'lease expired', now, LEASED, now, self.max_attempts))
+        cursor.execute('UPDATE jobs SET state = ?, owner = NULL, updated = ? WHERE state = ? AND lease_expires < ?',
+                       (QUEUED, now, LEASED, now))
+        if cursor.rowcount > 0:
+            logger.warning('Requeued %d jobs with expired leases', cursor.rowcount)
+
+    def lease(self, owner):
+        """
+        Leases the most costly, then oldest, queued job of the next project to
+        owner and returns (job id, path, project), or None when no project
+        has a job it may start. The project is None for jobs queued before
+        queues had projects.
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            self.requeue_expired(cursor, now)
+            project = cursor.execute(NEXT_PROJECT, {'queued': QUEUED, 'leased': LEASED}).fetchone()
+            if project is None:
+                return None
+            job_id, path, cost = cursor.execute(
+                'SELECT id, path, cost FROM jobs WHERE state = ? AND project = ? ORDER BY cost DESC, id LIMIT 1',
+                (QUEUED, project[0])).fetchone()
+            cursor.execute('UPDATE jobs SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, '
+                           'leased = ?, updated = ? WHERE id = ?',
+                           (LEASED, owner, now + self.lease_time, now, now, job_id))
+            cursor.execute('UPDATE projects SET served = served + ? / weight WHERE project = ?',
+                           (max(cost, 1), project[0]))
+        return job_id, path, project[0] or None
+
+    def heartbeat(self, job_id, owner):
+        """
+        Renews owner's lease on a job. Returns False when the lease was lost
+        to another worker after it expired.
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND state = ? AND owner = ?',
+                           (now + self.lease_time, now, job_id, LEASED, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, owner):
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE jobs SET state = ?, owner = NULL, error = NULL, updated = ? '
+                           'WHERE id = ? AND state = ? AND owner = ?', (DONE, time.time(), job_id, LEASED, owner))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, owner, error):
+        """
+        Returns a failed job to the queue, or marks it failed once it has been
+        attempted max_attempts times.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, '
+                           'error = ?, updated = ? WHERE id = ? AND state = ? AND owner = ?',
+                           (self.max_attempts, FAILED, QUEUED, error, time.time(), job_id, LEASED, owner))
+            return cursor.rowcount == 1
+
+    def counts(self):
+        with self.transaction() as cursor:
+            self.requeue_expired(cursor, time.time())
+            return dict(cursor.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def metrics(self):
+        """
+        Per project job counts by state, with percentiles of the wait from
+        queueing to the last lease and of the latency from queueing to
+        completion over the last METRICS_WINDOW jobs. Runs in a deferred
+        transaction, so it never holds up workers leasing and completing
+        jobs.
+        """
+        summary = {}
+        with self.transaction('DEFERRED') as cursor:
+            rows = cursor.execute('SELECT project, state, COUNT(*), COUNT(leased) FROM jobs '
+                                  'GROUP BY project, state').fetchall()
+            waits = {}
+            for project, state, count, leased in rows:
+                metrics = summary.setdefault(project, dict((x, 0) for x in (QUEUED, LEASED, DONE, FAILED)))
+                metrics[state] = count
+                waits[project] = waits.get(project, 0) + leased
+
+            for project, metrics in summary.items():
+                for name, query, count in (('wait', WAIT_PERCENTILE, waits[project]),
+                                           ('latency', LATENCY_PERCENTILE, metrics[DONE])):
+                    count = min(count, METRICS_WINDOW)
+                    for q in (50, 95):
+                        value = None
+                        if count:
+                            rank = max(0, int(math.ceil(q / 100.0 * count)) - 1)
+                            value = cursor.execute(query, {'project': project, 'done': DONE, 'window': METRICS_WINDOW,
+                                                           'rank': rank}).fetchone()[0]
+                        metrics['{}_p{}'.format(name, q)] = value
+        return summary
+
+    def close(self):
+        self.connection.close()
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Renews a job's lease every third of the lease time while it is being
+    converted.
+    """
+    def __init__(self, queue, job_id, owner):
+        super(LeaseHeartbeat, self).__init__()
+        self.daemon = True
+        self.queue = queue
+        self.job_id = job_id
+        self.owner = owner
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_time / 3.0):
+            if not self.queue.heartbeat(self.job_id, self.owner):
+                logger.warning('Lost the lease on job %s', self.job_id)
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
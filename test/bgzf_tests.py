@@ -0,0 +1,137 @@
+from unittest import TestCase, skipIf
+from src.bgzf import BGZF_BLOCK_SIZE, reg2bin, sort_records, sort_vcf, write_bgzf_vcf
+from src.convert import convert
+import gzip
+import os.path
+import shutil
+import struct
+import tempfile
+import zlib
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+HEADER = [
+    '##fileformat=VCFv4.2\n',
+    '##contig=<ID=chr1,length=248956422>\n',
+    '##contig=<ID=chr2,length=242193529>\n',
+    '##contig=<ID=chr10,length=133797422>\n',
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+]
+
+
+def records(count):
+    lines = []
+    for i in range(count):
+        chrom = ['chr10', 'chr2', 'chr1'][i % 3]
+        lines.append('{}\t{}\tid{}\tAC\tA\t.\tPASS\tDP={}\n'.format(chrom, (i * 7919) % 5000000 + 1, i, i))
+    return lines
+
+
+class Args:
+    pass
+
+
+def read_bgzf(path, virtual_offset):
+    with open(path, 'rb') as fd:
+        fd.seek(virtual_offset >> 16)
+        header = fd.read(18)
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        block = fd.read(block_size - 18)
+    return zlib.decompress(block[:-8], -15)[virtual_offset & 0xffff:]
+
+
+class BgzfTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.vcf_file = os.path.join(self.tmp_dir, 'out.vcf.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sort_records_like_sort_v(self):
+        lines = ['chrX\t5\n', 'chr10\t20\n', 'chr2\t300\n', 'chr2\t40\n', 'chr1\t9\n']
+        self.assertEqual(sort_records(lines), ['chr1\t9\n', 'chr2\t40\n', 'chr2\t300\n', 'chr10\t20\n', 'chrX\t5\n'])
+
+    def test_reg2bin(self):
+        self.assertEqual(reg2bin(0, 1), 4681)
+        self.assertEqual(reg2bin(16383, 16385), 585)
+        self.assertEqual(reg2bin(0, 1 << 29), 0)
+
+    def test_compressed_output(self):
+        lines = records(20000)
+        write_bgzf_vcf(HEADER, lines, self.vcf_file)
+
+        with gzip.open(self.vcf_file, 'rb') as fd:
+            self.assertEqual(fd.read().decode('utf-8'), ''.join(HEADER + sort_records(lines)))
+        with open(self.vcf_file, 'rb') as fd:
+            content = fd.read()
+        self.assertGreater(content.count(b'BC\x02\x00'), len(''.join(lines)) // BGZF_BLOCK_SIZE)
+        self.assertTrue(os.path.isfile(self.vcf_file + '.tbi'))
+
+    def test_tabix_chunks_point_at_records(self):
+        write_bgzf_vcf(HEADER, records(3000), self.vcf_file)
+        with gzip.open(self.vcf_file + '.tbi', 'rb') as fd:
+            index = fd.read()
+
+        self.assertEqual(index[:4], b'TBI\1')
+        n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from('<8i', index, 4)
+        self.assertEqual((n_ref, fmt, col_seq, col_beg, col_end, chr(meta)), (3, 2, 1, 2, 0, '#'))
+        self.assertEqual(index[36:36 + l_nm].split(b'\0')[:-1], [b'chr1', b'chr2', b'chr10'])
+
+        offset = 36 + l_nm
+        n_bin, = struct.unpack_from('<i', index, offset)
+        bin, n_chunk, begin, end = struct.unpack_from('<IiQQ', index, offset + 4)
+        self.assertGreater(n_bin, 0)
+        self.assertTrue(read_bgzf(self.vcf_file, begin).startswith(b'chr1\t'))
+
+    def test_sort_vcf(self):
+        unsorted_file = os.path.join(self.tmp_dir, 'unsorted.vcf')
+        with open(unsorted_file, 'w') as fd:
+            fd.write(''.join(HEADER + records(10)))
+        sort_vcf(unsorted_file, self.vcf_file, 'csi')
+
+        with gzip.open(self.vcf_file + '.csi', 'rb') as fd:
+            self.assertEqual(fd.read(4), b'CSI\1')
+        self.assertRaises(ValueError, sort_vcf, unsorted_file, self.vcf_file, 'bai')
+
+    @skipIf(pysam is None, 'requires pysam')
+    def test_region_queries(self):
+        lines = records(20000)
+        for index_format in ('tbi', 'csi'):
+            write_bgzf_vcf(HEADER, lines, self.vcf_file, index_format)
+            vcf = pysam.TabixFile(self.vcf_file, index='{}.{}'.format(self.vcf_file, index_format))
+            for chrom, start, end in [('chr1', 0, 10000), ('chr2', 1000000, 1200000), ('chr10', 4990000, 5000000)]:
+                expected = [x.rstrip('\n') for x in sort_records(lines)
+                            if x.split('\t')[0] == chrom and start - 1 < int(x.split('\t')[1]) <= end]
+                self.assertEqual(list(vcf.fetch(chrom, start, end)), expected)
+
+    def test_no_hgvs_ignores_stale_staging(self):
+        args = Args()
+        args.xml_file = os.path.abspath('./test/data/sample.xml')
+        args.out_file = os.path.join(self.tmp_dir, 'out.json')
+        args.vcf_out_file = self.vcf_file
+        args.pdf_out_file = args.removed_out_file = args.manifest_file = None
+        args.fhir_url = None
+        args.json_format = 'compact'
+        args.sections = None
+        args.no_hgvs = True
+        args.project_id = 'project1'
+        args.subject_id = args.file_url = args.sequence_id = args.fasta = args.genes = None
+
+        # A staging file another conversion left in the working directory
+        cwd = os.getcwd()
+        with open(os.path.join(self.tmp_dir, 'unsorted.vcf'), 'w') as fd:
+            fd.writelines(HEADER + ['chr1\t100\t.\tA\tT\t.\tPASS\tDP=200\n'])
+        try:
+            os.chdir(self.tmp_dir)
+            convert(args)
+        finally:
+            os.chdir(cwd)
+
+        with gzip.open(self.vcf_file, 'rb') as fd:
+            lines = fd.read().decode('utf-8').splitlines()
+        self.assertEqual([x for x in lines if not x.startswith('#')], [])
+        self.assertTrue(lines[-1].startswith('#CHROM'))
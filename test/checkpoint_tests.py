@@ -0,0 +1,102 @@
+from unittest import TestCase
+from src.convert import convert
+from src.checkpoint import DONE, FAILED, CheckpointJournal
+import json
+import os.path
+import shutil
+import tarfile
+import tempfile
+
+
+SAMPLE = './test/data/sample.xml'
+
+
+class Args:
+    pass
+
+
+class CheckpointTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.tmp_dir, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_journal(self):
+        with open(self.journal_file) as fd:
+            return fd.read().splitlines()
+
+    def test_batched_writes(self):
+        journal = CheckpointJournal(self.journal_file, batch_size=2, interval=60)
+        journal.record('a', 'digest-a', DONE, ['a.json'])
+        self.assertEqual(self.read_journal(), [])
+        journal.record('b', None, FAILED, error='ERROR: bad report')
+        self.assertEqual(len(self.read_journal()), 2)
+        journal.record('b', 'digest-b', DONE)
+        journal.close()
+
+        journal = CheckpointJournal(self.journal_file)
+        self.assertTrue(journal.is_done('a'))
+        self.assertTrue(journal.is_done('b'))
+        self.assertFalse(journal.is_done('c'))
+        self.assertEqual(journal.reports['a']['outputs'], ['a.json'])
+        journal.close()
+
+    def test_torn_record(self):
+        with open(self.journal_file, 'w') as fd:
+            fd.write(json.dumps({'key': 'a', 'status': DONE}) + '\n{"key": "b", "sta')
+
+        journal = CheckpointJournal(self.journal_file)
+        self.assertEqual(sorted(journal.reports), ['a'])
+        journal.record('b', 'digest-b', DONE)
+        journal.close()
+
+        journal = CheckpointJournal(self.journal_file)
+        self.assertTrue(journal.is_done('b'))
+        journal.close()
+
+    def bundle(self, broken, changed=False):
+        path = os.path.join(self.tmp_dir, 'bundle.tar')
+        member = os.path.join(self.tmp_dir, 'broken.xml')
+        with open(member, 'w') as fd:
+            fd.write('<rr:ResultsReport')
+        changed_member = os.path.join(self.tmp_dir, 'changed.xml')
+        with open(SAMPLE) as fd, open(changed_member, 'w') as out:
+            out.write(fd.read() + '\n')
+        with tarfile.open(path, 'w') as bundle:
+            bundle.add(changed_member if changed else SAMPLE, arcname='a.xml')
+            bundle.add(member if broken else SAMPLE, arcname='b.xml')
+        return path
+
+    def test_resume_bundle(self):
+        args = Args()
+        args.xml_file = self.bundle(broken=True)
+        args.out_file = os.path.join(self.tmp_dir, 'json')
+        args.pdf_out_file = args.vcf_out_file = args.removed_out_file = args.manifest_file = None
+        args.checkpoint_file = self.journal_file
+        args.fhir_url = None
+        args.json_format = 'compact'
+        args.sections = ['cnv']
+        args.project_id = 'project1'
+        args.subject_id = args.file_url = args.sequence_id = args.fasta = args.genes = None
+
+        self.assertRaises(ValueError, convert, args)
+        self.assertEqual(os.listdir(args.out_file), ['a.json'])
+        records = [json.loads(x) for x in self.read_journal()]
+        self.assertEqual([(x['key'].split('!')[1], x['status']) for x in records], [('a.xml', DONE), ('b.xml', FAILED)])
+        self.assertEqual(records[0]['outputs'], [os.path.join(args.out_file, 'a.json')])
+
+        # Only the failed report is converted again
+        os.remove(os.path.join(args.out_file, 'a.json'))
+        self.bundle(broken=False)
+        convert(args)
+        self.assertEqual(os.listdir(args.out_file), ['b.json'])
+
+        # A member that changed since it was converted is converted again
+        self.bundle(broken=False, changed=True)
+        convert(args)
+        self.assertEqual(sorted(os.listdir(args.out_file)), ['a.json', 'b.json'])
+        records = [json.loads(x) for x in self.read_journal()]
+        self.assertEqual(len(records), 4)
+        self.assertTrue(all(x['key'].startswith(os.path.abspath(args.xml_file) + '!') for x in records))
@@ -0,0 +1,88 @@
+from unittest import TestCase
+from mock import patch
+from src.bgzf import write_bgzf_vcf
+from src.cohort import merge_vcfs
+import gzip
+import os.path
+import shutil
+import tempfile
+
+HEADER = [
+    '##fileformat=VCFv4.2\n',
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">\n',
+    '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele Frequency">\n',
+    '##INFO=<ID=VENDSIG,Number=1,Type=String,Description="Vendor Significance">\n',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+]
+
+
+def record(chrom, pos, ref, alt, gt, dp):
+    return '{}\t{}\t.\t{}\t{}\t.\tPASS\tDP={};AF=0.5;VENDSIG=Pathogenic\tGT:DP:AD\t{}:{}:{},{}\n'.format(
+        chrom, pos, ref, alt, dp, gt, dp, dp // 2, dp - dp // 2)
+
+
+class CohortTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.samples = {
+            'sample1': [record('chr1', 100, 'A', 'T', '0/1', 200), record('chr2', 50, 'C', 'G', '1/1', 80)],
+            'sample2': [record('chr1', 100, 'A', 'T', '0/1', 120), record('chr1', 100, 'A', 'C', '0/1', 60),
+                        record('chr10', 7, 'G', 'GA', '0/1', 90)],
+            'sample3': [record('chr2', 50, 'C', 'G', '0/1', 40)]
+        }
+        self.vcf_files = []
+        for sample, lines in sorted(self.samples.items()):
+            header = HEADER + ['#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n'.format(sample)]
+            path = os.path.join(self.tmp_dir, '{}.vcf'.format(sample))
+            if sample == 'sample2':
+                path += '.gz'
+                write_bgzf_vcf(header, lines, path)
+            else:
+                with open(path, 'w') as fd:
+                    fd.writelines(header + lines)
+            self.vcf_files.append(path)
+        self.out_file = os.path.join(self.tmp_dir, 'cohort.vcf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        with open(path) as fd:
+            return fd.read().splitlines()
+
+    def test_merge(self):
+        merge_vcfs(self.vcf_files, self.out_file)
+        lines = self.read(self.out_file)
+
+        self.assertIn('##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of Samples With Data">', lines)
+        records = [line for line in lines if not line.startswith('##')]
+        self.assertEqual(records, [
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample1\tsample2\tsample3',
+            'chr1\t100\t.\tA\tC\t.\tPASS\tVENDSIG=Pathogenic;NS=1\tGT:DP:AD\t./.\t0/1:60:30,30\t./.',
+            'chr1\t100\t.\tA\tT\t.\tPASS\tVENDSIG=Pathogenic;NS=2\tGT:DP:AD\t0/1:200:100,100\t0/1:120:60,60\t./.',
+            'chr2\t50\t.\tC\tG\t.\tPASS\tVENDSIG=Pathogenic;NS=2\tGT:DP:AD\t1/1:80:40,40\t./.\t0/1:40:20,20',
+            'chr10\t7\t.\tG\tGA\t.\tPASS\tVENDSIG=Pathogenic;NS=1\tGT:DP:AD\t./.\t0/1:90:45,45\t./.'
+        ])
+
+    def test_merge_in_passes(self):
+        merge_vcfs(self.vcf_files, self.out_file)
+        expected = self.read(self.out_file)
+
+        with patch('src.cohort.MAX_MERGE_INPUTS', 2):
+            merge_vcfs(self.vcf_files, self.out_file + '.gz', 'csi')
+        with gzip.open(self.out_file + '.gz', 'rb') as fd:
+            self.assertEqual(fd.read().decode('utf-8').splitlines(), expected)
+        self.assertTrue(os.path.isfile(self.out_file + '.gz.csi'))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['cohort.vcf', 'cohort.vcf.gz', 'cohort.vcf.gz.csi', 'sample1.vcf', 'sample2.vcf.gz',
+                          'sample2.vcf.gz.tbi', 'sample3.vcf'])
+
+    def test_duplicate_samples_renamed(self):
+        merge_vcfs([self.vcf_files[0], self.vcf_files[0]], self.out_file)
+        header = [line for line in self.read(self.out_file) if line.startswith('#CHROM')][0]
+        self.assertTrue(header.endswith('\tsample1\tsample1_2'))
+
+    def test_unsorted_input(self):
+        with open(self.vcf_files[0], 'a') as fd:
+            fd.write(record('chr1', 5, 'A', 'T', '0/1', 10))
+        self.assertRaises(ValueError, merge_vcfs, self.vcf_files, self.out_file)
@@ -0,0 +1,88 @@
+from unittest import TestCase, skipIf
+from mock import patch
+from src.convert import extract_rows, read_xml
+from src.columnar import ColumnarWriter, pyarrow
+import os.path
+import shutil
+import tempfile
+
+
+class Args:
+    pass
+
+
+@skipIf(pyarrow is None, 'requires pyarrow')
+class ColumnarTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.payload = read_xml('./test/data/sample.xml')['rr:ResultsReport']['rr:ResultsPayload']
+        self.args = Args()
+        self.args.fasta = 'genome.fasta'
+        self.args.genes = 'genes.ref'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('src.convert.hgvs_2_vcf')
+    def test_extract_rows(self, mock_hgvs_2_vcf):
+        mock_hgvs_2_vcf.return_value = 'chr1', 100, 'A', 'T'
+        rows = list(extract_rows(self.payload, self.args))
+        tables = [table for table, _ in rows]
+
+        self.assertEqual(tables.count('short_variants'), mock_hgvs_2_vcf.call_count)
+        variant = rows[0][1]
+        self.assertEqual((variant['report_id'], variant['gene'], variant['depth'], variant['allele_fraction']),
+                         ('SMP37669', 'HDAC1', 536, 0.48))
+        self.assertEqual((variant['chrom'], variant['pos'], variant['ref'], variant['alt']), ('chr1', 100, 'A', 'T'))
+
+        cnv = [row for table, row in rows if table == 'copy_numbers'][0]
+        self.assertEqual((cnv['gene'], cnv['chrom'], cnv['start'], cnv['end'], cnv['copy_number'], cnv['exons']),
+                         ('CDK4', 'chr12', 58093932, 58188144, 44, '7 of 7'))
+        rearrangement = [row for table, row in rows if table == 'rearrangements'][0]
+        self.assertEqual((rearrangement['target_gene'], rearrangement['supporting_read_pairs']), ('NF1', 83))
+        biomarkers = [row for table, row in rows if table == 'biomarkers']
+        self.assertEqual([(x['name'], x['status'], x['score']) for x in biomarkers],
+                         [('microsatellite-instability', 'MSS', None), ('tumor-mutation-burden', 'low', 0.73)])
+
+    def test_targeted_gene(self):
+        self.args.sections = ['rearrangement']
+        rearrangement = self.payload['variant-report']['rearrangements']['rearrangement']
+        rearrangement['@targeted-gene'] = rearrangement.pop('@target-gene')
+        rows = list(extract_rows(self.payload, self.args))
+        self.assertEqual([row['target_gene'] for _, row in rows], ['NF1'])
+
+    def test_sections(self):
+        self.args.sections = ['biomarkers']
+        self.assertEqual(set(table for table, _ in extract_rows(self.payload, self.args)), set(['biomarkers']))
+
+    def test_partitioned_row_groups(self):
+        import pyarrow.parquet
+
+        writer = ColumnarWriter(self.tmp_dir, 'parquet', row_group_size=4)
+        for i in range(10):
+            writer.write('biomarkers', 'project{}'.format(i % 2), {'report_id': 'report{}'.format(i), 'score': i})
+        writer.close()
+
+        directory = os.path.join(self.tmp_dir, 'biomarkers', 'project_id=project0')
+        files = os.listdir(directory)
+        self.assertEqual(len(files), 1)
+        parquet_file = pyarrow.parquet.ParquetFile(os.path.join(directory, files[0]))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.column('score').to_pylist(), [0.0, 2.0, 4.0, 6.0, 8.0])
+
+        dataset = pyarrow.parquet.read_table(os.path.join(self.tmp_dir, 'biomarkers'))
+        self.assertEqual(sorted(dataset.column('project_id').to_pylist()), ['project0'] * 5 + ['project1'] * 5)
+
+    def test_arrow(self):
+        import pyarrow.ipc
+
+        writer = ColumnarWriter(self.tmp_dir, 'arrow', row_group_size=2)
+        for i in range(3):
+            writer.write('copy_numbers', 'project1', {'gene': 'GENE{}'.format(i), 'copy_number': i})
+        writer.close()
+
+        directory = os.path.join(self.tmp_dir, 'copy_numbers', 'project_id=project1')
+        reader = pyarrow.ipc.open_file(os.path.join(directory, os.listdir(directory)[0]))
+        self.assertEqual(reader.num_record_batches, 2)
+        self.assertEqual(reader.read_all().column('gene').to_pylist(), ['GENE0', 'GENE1', 'GENE2'])
@@ -1,8 +1,10 @@
 from mock import patch
 from unittest import TestCase
-from src.convert import process
+from src.convert import positive_int, process, read_xml, SECTIONS
+import argparse
 import os.path
 import filecmp
+import copy
 
 results_payload_dict = {
     'FinalReport': {
@@ -739,3 +741,67 @@ class ConvertTest(TestCase):
         self.assertEquals(fhir_resources[0]['resourceType'], 'DiagnosticReport')
         self.assertTrue(os.path.isfile('./unsorted.vcf'))
         self.assertTrue(filecmp.cmp('./unsorted.vcf', './test/data/expected.vcf', shallow=False))
+
+
+    @patch("src.convert.parse_hgvs")
+    def test_convert_with_deterministic_ids(self, mock_parse_hgvs):
+        mock_parse_hgvs.return_value = 'chr1', 100, 'A', 'T'
+        self.args.subject_id = None
+        self.args.deterministic_ids = True
+
+        payload_dict = copy.deepcopy(results_payload_dict)
+        payload_dict['FinalReport']['ReportId'] = 'SMP1'
+        # Same change on another transcript normalizes to the same VCF tuple
+        short_variants = payload_dict['variant-report']['short-variants']['short-variant']
+        short_variants.append(dict(short_variants[0], **{'@transcript': 'NM_002'}))
+
+        first = [x['id'] for x in process(payload_dict, self.args)]
+        second = [x['id'] for x in process(payload_dict, self.args)]
+        self.assertEqual(first, second)
+        self.assertEqual(len(set(first)), len(first))
+
+        self.args.project_id = 'project2'
+        third = [x['id'] for x in process(payload_dict, self.args)]
+        self.assertFalse(set(first) & set(third))
+
+        self.assertRaises(ValueError, process, results_payload_dict, self.args)
+
+
+    @patch("src.convert.parse_hgvs")
+    def test_convert_with_no_hgvs(self, mock_parse_hgvs):
+        self.args.no_hgvs = True
+
+        fhir_resources = process(results_payload_dict, self.args)
+        self.assertFalse(mock_parse_hgvs.called)
+        self.assertEqual(len(fhir_resources), 7)
+        self.assertEqual([x['meta']['tag'][2]['code'] for x in fhir_resources[3:]],
+                         ['copy-number', 'rearrangement', 'microsatellite-instability', 'tumor-mutation-burden'])
+
+
+    def test_read_xml_skips_sections(self):
+        full = read_xml('./test/data/sample.xml')['rr:ResultsReport']['rr:ResultsPayload']
+        skipped = read_xml('./test/data/sample.xml', [SECTIONS['short-variant'], SECTIONS['pdf']])
+        skipped = skipped['rr:ResultsReport']['rr:ResultsPayload']
+
+        self.assertIn('ReportPDF', full)
+        self.assertIn('short-variants', full['variant-report'])
+        self.assertNotIn('ReportPDF', skipped)
+        self.assertNotIn('short-variants', skipped['variant-report'])
+
+        del full['ReportPDF']
+        del full['variant-report']['short-variants']
+        self.assertEqual(full, skipped)
+
+    @patch("src.convert.parse_hgvs")
+    def test_convert_with_sections(self, mock_parse_hgvs):
+        self.args.sections = ['cnv', 'biomarkers']
+
+        fhir_resources = process(results_payload_dict, self.args)
+        self.assertFalse(mock_parse_hgvs.called)
+        self.assertEqual([x['meta']['tag'][2]['code'] for x in fhir_resources[3:]],
+                         ['copy-number', 'microsatellite-instability', 'tumor-mutation-burden'])
+
+    def test_positive_int(self):
+        self.assertEqual(positive_int('3'), 3)
+        for value in ('0', '-2', 'many'):
+            self.assertRaises(argparse.ArgumentTypeError, positive_int, value)
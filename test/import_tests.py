@@ -0,0 +1,41 @@
+from unittest import TestCase, skipIf
+import os.path
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# Modules only the short-variant, upload, parsing, export, bundle, watch or
+# queue paths need; importing the CLI must not load them.
+DEFERRED_MODULES = ['pyhgvs', 'pyfaidx', 'requests', 'xmltodict', 'lxml', 'pyarrow', 'cohort', 'scheduler', 'watch',
+                    'work_queue', 'multiprocessing', 'sqlite3', 'ctypes']
+
+# Cumulative import time budget for convert, in microseconds: about twice
+# what it takes, so a regression that doubles start-up is caught.
+IMPORT_TIME_BUDGET = 120000
+
+
+def import_times(module):
+    output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                                     cwd=SRC_DIR, stderr=subprocess.STDOUT).decode('utf-8')
+    times = {}
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+@skipIf(sys.version_info < (3, 7), 'python -X importtime requires Python 3.7')
+class ImportTest(TestCase):
+    def test_deferred_imports(self):
+        times = import_times('convert')
+        self.assertIn('convert', times)
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_import_time(self):
+        # The fastest of a few imports, as the first can pay for a cold cache
+        fastest = min(import_times('convert')['convert'] for _ in range(3))
+        self.assertLess(fastest, IMPORT_TIME_BUDGET)
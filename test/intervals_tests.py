@@ -0,0 +1,73 @@
+from mock import patch
+from unittest import TestCase
+from src.intervals import IntervalTree, TranscriptIndex
+from src.transcripts import build_transcript_table
+from src.convert import hgvs_2_vcf
+import os.path
+import random
+import shutil
+import tempfile
+
+rows = [
+    '0\tNM_000001\tchr1\t+\t99\t500\t150\t450\t2\t99,300,\t200,500,\t0\tGENE1\tcmpl\tcmpl\t0,2,\n',
+    '0\tNM_000002\tchr1\t-\t1000\t2000\t1100\t1900\t2\t1000,1500,\t1200,2000,\t0\tGENE2\tcmpl\tcmpl\t0,0,\n',
+    '0\tNM_000003\tchr2\t+\t10\t90\t20\t80\t1\t10,\t90,\t0\tGENE3\tcmpl\tcmpl\t-1,\n'
+]
+
+
+class IntervalsTest(TestCase):
+    def test_interval_tree(self):
+        rng = random.Random(7)
+        intervals = []
+        for i in range(500):
+            start = rng.randint(1, 10000)
+            intervals.append((start, start + rng.randint(0, 800), i))
+        tree = IntervalTree(intervals)
+
+        for position in [0, 1, 5000, 10800, 11000] + [rng.randint(1, 11000) for _ in range(200)]:
+            expected = sorted(x[2] for x in intervals if x[0] <= position <= x[1])
+            self.assertEqual(sorted(tree.find(position)), expected)
+
+        self.assertEqual(IntervalTree([]).find(10), [])
+
+    def test_transcript_index(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            genes = os.path.join(tmp_dir, 'refGene.txt')
+            with open(genes, 'w') as fd:
+                fd.writelines(['#bin\tname\n'] + rows)
+
+            for packed in [False, True]:
+                if packed:
+                    build_transcript_table(genes)
+                index = TranscriptIndex(genes)
+                self.assertEqual(index.table is not None, packed)
+                self.assertEqual(index.transcripts_at('chr1', 99), [])
+                self.assertEqual(index.transcripts_at('chr1', 100), ['NM_000001'])
+                self.assertEqual(index.transcripts_at('chr1', 500), ['NM_000001'])
+                self.assertEqual(index.transcripts_at('chr1', 1500), ['NM_000002'])
+                self.assertEqual(index.transcripts_at('chr2', 11), ['NM_000003'])
+                self.assertEqual(index.transcripts_at('chr3', 500), [])
+                self.assertEqual(sorted(index.trees), ['chr1', 'chr2', 'chr3'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @patch("src.convert.parse_splice")
+    @patch("src.convert.parse_hgvs")
+    def test_hgvs_2_vcf_uses_index(self, mock_parse_hgvs, mock_parse_splice):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            genes = os.path.join(tmp_dir, 'refGene.txt')
+            with open(genes, 'w') as fd:
+                fd.writelines(rows)
+
+            hgvs_2_vcf('NM_000001:c.10C>A', genes, 'missense', '10C>A', 'chr1:160', '+', 'genome.fasta')
+            mock_parse_hgvs.assert_called_once_with('NM_000001:c.10C>A', 'genome.fasta', genes)
+            self.assertFalse(mock_parse_splice.called)
+
+            hgvs_2_vcf('NM_000001:c.10C>A', genes, 'missense', '10C>A', 'chr2:50', '+', 'genome.fasta')
+            hgvs_2_vcf('NM_999999:c.10C>A', genes, 'missense', '10C>A', 'chr1:160', '+', 'genome.fasta')
+            self.assertEqual(mock_parse_hgvs.call_count, 1)
+            self.assertEqual(mock_parse_splice.call_count, 2)
+        finally:
+            shutil.rmtree(tmp_dir)
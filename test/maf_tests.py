@@ -0,0 +1,61 @@
+from unittest import TestCase
+from mock import patch
+from src.convert import extract_rows, read_xml
+from src.maf import MAF_COLUMNS, MafWriter, maf_alleles, variant_classification
+import os.path
+import shutil
+import tempfile
+
+
+class Args:
+    pass
+
+
+class MafTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.args = Args()
+        self.args.fasta = 'genome.fasta'
+        self.args.genes = 'genes.ref'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_maf_alleles(self):
+        self.assertEqual(maf_alleles(100, 'A', 'T'), (100, 100, 'A', 'T', 'SNP'))
+        self.assertEqual(maf_alleles(100, 'AC', 'GT'), (100, 101, 'AC', 'GT', 'DNP'))
+        self.assertEqual(maf_alleles(100, 'ACG', 'A'), (101, 102, 'CG', '-', 'DEL'))
+        self.assertEqual(maf_alleles(100, 'A', 'ATT'), (100, 101, '-', 'TT', 'INS'))
+        self.assertEqual(maf_alleles(100, 'ACG', 'AT'), (101, 102, 'CG', 'T', 'DEL'))
+
+    def test_variant_classification(self):
+        self.assertEqual(variant_classification('missense', 'SNP'), 'Missense_Mutation')
+        self.assertEqual(variant_classification('frameshift', 'INS'), 'Frame_Shift_Ins')
+        self.assertEqual(variant_classification('nonframeshift', 'DEL'), 'In_Frame_Del')
+        self.assertEqual(variant_classification('splice', 'SNP'), 'Splice_Site')
+        self.assertEqual(variant_classification(None, 'SNP'), 'Unknown')
+
+    @patch('src.convert.hgvs_2_vcf')
+    def test_write(self, mock_hgvs_2_vcf):
+        mock_hgvs_2_vcf.return_value = 'chr1', 32782332, 'C', 'A'
+        payload = read_xml('./test/data/sample.xml')['rr:ResultsReport']['rr:ResultsPayload']
+        maf_file = os.path.join(self.tmp_dir, 'cohort.maf')
+
+        writer = MafWriter(maf_file)
+        for table, row in extract_rows(payload, self.args, writer.tables):
+            writer.write(table, 'project1', row)
+        self.assertFalse(os.path.exists(maf_file))
+        writer.close()
+
+        with open(maf_file) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(lines[0], '#version 2.4')
+        self.assertEqual(lines[1].split('\t'), MAF_COLUMNS)
+        self.assertEqual(len(lines) - 2, mock_hgvs_2_vcf.call_count)
+        row = dict(zip(MAF_COLUMNS, lines[2].split('\t')))
+        self.assertEqual((row['Hugo_Symbol'], row['Chromosome'], row['Start_Position'], row['Variant_Type']),
+                         ('HDAC1', 'chr1', '32782332', 'SNP'))
+        self.assertEqual((row['HGVSc'], row['HGVSp_Short'], row['Transcript_ID']), ('c.229C>A', 'p.R77S', 'NM_004964'))
+        self.assertEqual((row['t_depth'], row['t_ref_count'], row['t_alt_count']), ('536', '279', '257'))
+        self.assertEqual((row['Tumor_Sample_Barcode'], row['Variant_Classification']),
+                         ('SA-1612348', 'Missense_Mutation'))
@@ -0,0 +1,154 @@
+from unittest import TestCase
+from mock import patch
+from src.convert import convert, convert_sources
+from src.manifest import Manifest, file_digest
+import os.path
+import shutil
+import tarfile
+import tempfile
+
+
+class Args:
+    pass
+
+
+def resources(value):
+    return [
+        {'resourceType': 'DiagnosticReport', 'id': 'report1', 'result': [{'reference': 'Observation/obs1'}]},
+        {'resourceType': 'Observation', 'id': 'obs1', 'value': value},
+        {'resourceType': 'Observation', 'id': 'obs2', 'value': 'unchanged'}
+    ]
+
+
+class Exporter:
+    tables = ('copy_numbers',)
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, table, project_id, row):
+        self.rows.append((table, project_id, row['gene']))
+
+
+class ManifestTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.manifest_file = os.path.join(self.tmp_dir, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_skip_unchanged_report(self):
+        manifest = Manifest(self.manifest_file)
+        self.assertFalse(manifest.is_current('report.xml', 'digest1', '1.0.0'))
+
+        manifest.record('report.xml', 'digest1', '1.0.0', resources('a'))
+        manifest.save()
+
+        manifest = Manifest(self.manifest_file)
+        self.assertTrue(manifest.is_current('report.xml', 'digest1', '1.0.0'))
+        self.assertFalse(manifest.is_current('report.xml', 'digest2', '1.0.0'))
+        self.assertFalse(manifest.is_current('report.xml', 'digest1', '1.1.0'))
+
+    def test_diff(self):
+        manifest = Manifest(self.manifest_file)
+        changed, removed = manifest.diff('report.xml', resources('a'))
+        self.assertEqual(len(changed), 3)
+        self.assertEqual(removed, [])
+
+        manifest.record('report.xml', 'digest1', '1.0.0', resources('a'))
+        amended = resources('b')[1:] + [{'resourceType': 'Observation', 'id': 'obs3', 'value': 'new'}]
+        changed, removed = manifest.diff('report.xml', amended)
+        self.assertEqual([x['id'] for x in changed], ['obs1', 'obs3'])
+        self.assertEqual(removed, ['DiagnosticReport/report1'])
+
+    def test_file_digest(self):
+        self.assertEqual(file_digest('./test/data/sample.xml'), file_digest('./test/data/sample.xml'))
+        self.assertNotEqual(file_digest('./test/data/sample.xml'), file_digest('./test/data/expected.vcf'))
+
+    def test_stdin_rejected(self):
+        args = Args()
+        args.xml_file = '-'
+        args.manifest_file = self.manifest_file
+        self.assertRaises(ValueError, convert, args)
+        self.assertFalse(os.path.exists(self.manifest_file))
+
+    def convert_args(self, xml_file):
+        args = Args()
+        args.xml_file = xml_file
+        args.out_file = os.path.join(self.tmp_dir, 'out')
+        args.manifest_file = self.manifest_file
+        args.pdf_out_file = args.vcf_out_file = args.removed_out_file = None
+        args.fhir_url = None
+        args.json_format = 'compact'
+        args.sections = ['cnv']
+        args.project_id = 'project1'
+        args.subject_id = args.file_url = args.sequence_id = args.fasta = args.genes = None
+        return args
+
+    def test_options_change(self):
+        args = self.convert_args('./test/data/sample.xml')
+        args.out_file += '.json'
+        convert(args)
+        os.remove(args.out_file)
+        convert(args)
+        self.assertFalse(os.path.exists(args.out_file))
+
+        for option, value in (('project_id', 'project2'), ('sections', ['cnv', 'biomarkers'])):
+            setattr(args, option, value)
+            convert(args)
+            self.assertTrue(os.path.isfile(args.out_file))
+            os.remove(args.out_file)
+
+    @patch('src.convert.Manifest.save')
+    def test_saved_once_per_bundle(self, mock_save):
+        bundle = os.path.join(self.tmp_dir, 'bundle.tar')
+        with tarfile.open(bundle, 'w') as fd:
+            fd.add('./test/data/sample.xml', arcname='a.xml')
+            fd.add('./test/data/sample.xml', arcname='b.xml')
+        convert(self.convert_args(bundle))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp_dir, 'out'))), ['a.json', 'b.json'])
+        self.assertEqual(mock_save.call_count, 1)
+
+    def test_unchanged_reports_exported(self):
+        args = self.convert_args('./test/data/sample.xml')
+        args.out_file += '.json'
+        for converted in [True, False]:
+            manifest, exporter = Manifest(self.manifest_file), Exporter()
+            convert_sources(args, manifest, exporters=[exporter])
+            manifest.save()
+            self.assertEqual(exporter.rows[0], ('copy_numbers', 'project1', 'CDK4'))
+            self.assertEqual(os.path.isfile(args.out_file), converted)
+            if converted:
+                os.remove(args.out_file)
+
+    def test_keyed_on_absolute_path(self):
+        sample = os.path.abspath('./test/data/sample.xml')
+        args = self.convert_args('./test/data/sample.xml')
+        args.out_file += '.json'
+        convert(args)
+        os.remove(args.out_file)
+
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(sample))
+        try:
+            for xml_file in ('sample.xml', sample):
+                args.xml_file = xml_file
+                convert(args)
+                self.assertFalse(os.path.exists(args.out_file))
+        finally:
+            os.chdir(cwd)
+
+        bundle = os.path.join(self.tmp_dir, 'bundle.tar')
+        with tarfile.open(bundle, 'w') as fd:
+            fd.add(sample, arcname='a.xml')
+        args = self.convert_args(bundle)
+        convert(args)
+        shutil.rmtree(args.out_file)
+        os.chdir(self.tmp_dir)
+        try:
+            args.xml_file = 'bundle.tar'
+            convert(args)
+            self.assertFalse(os.path.exists(os.path.join(args.out_file, 'a.json')))
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,74 @@
+from unittest import TestCase, skipIf
+from src.parsers import available_backends, parse_xml
+import io
+
+SAMPLE = './test/data/sample.xml'
+
+MIXED = b'''<?xml version="1.0"?>
+<rr:Report xmlns:rr="urn:rr" xmlns:xsi="urn:xsi" xsi:type="final">
+    <!-- comment -->
+    <Item id="1">first</Item>
+    <Item id="2"/>
+    <Item>third</Item>
+    <Empty/>
+    <Mixed>before<Child>text</Child>after</Mixed>
+    <Blob>AAAA</Blob>
+    <rr:Nested xmlns="urn:default"><Leaf>&lt;value&gt;</Leaf></rr:Nested>
+</rr:Report>
+'''
+
+LAUGHS = b'''<?xml version="1.0"?>
+<!DOCTYPE lolz [
+    <!ENTITY lol "lol">
+    <!ENTITY lol1 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">
+    <!ENTITY lol2 "&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;">
+]>
+<lolz>&lol2;</lolz>
+'''
+
+
+def parse(path_or_data, backend, skip=()):
+    if isinstance(path_or_data, bytes):
+        return parse_xml(io.BytesIO(path_or_data), skip, backend)
+    with open(path_or_data, 'rb') as fd:
+        return parse_xml(fd, skip, backend)
+
+
+@skipIf(len(available_backends()) < 2, 'requires both lxml and xmltodict')
+class ParsersTest(TestCase):
+    def test_backends_agree(self):
+        for source in (SAMPLE, MIXED):
+            expected = parse(source, 'xmltodict')
+            actual = parse(source, 'lxml')
+            self.assertEqual(actual, expected)
+            self.assertEqual(list(actual), list(expected))
+
+    def test_backends_agree_on_order(self):
+        expected = parse(SAMPLE, 'xmltodict')['rr:ResultsReport']['rr:ResultsPayload']['FinalReport']
+        actual = parse(SAMPLE, 'lxml')['rr:ResultsReport']['rr:ResultsPayload']['FinalReport']
+        self.assertEqual(list(actual), list(expected))
+
+    def test_backends_skip(self):
+        skip = [('rr:Report', 'Blob'), ('rr:Report', 'Item'), ('rr:Nested', 'Leaf')]
+        expected = parse(MIXED, 'xmltodict', skip)
+        self.assertNotIn('Blob', expected['rr:Report'])
+        self.assertEqual(parse(MIXED, 'lxml', skip), expected)
+
+
+class ParserBackendTest(TestCase):
+    def test_default_backend(self):
+        self.assertEqual(parse(MIXED, None), parse(MIXED, available_backends()[0]))
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, parse, MIXED, 'minidom')
+
+    def test_entities_rejected(self):
+        for backend in available_backends():
+            self.assertRaises(ValueError, parse, LAUGHS, backend)
+
+    def test_text_over_10_mb(self):
+        # Over libxml2's text node limit without XML_PARSE_HUGE
+        report = b'<Report><Blob>' + b'A' * (11 << 20) + b'</Blob></Report>'
+        for backend in available_backends():
+            self.assertEqual(len(parse(report, backend)['Report']['Blob']), 11 << 20)
+            self.assertEqual(parse(report, backend, [('Report', 'Blob')]), {'Report': None})
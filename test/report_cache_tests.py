@@ -0,0 +1,100 @@
+from unittest import TestCase
+from mock import patch
+from src.convert import convert, read_xml
+from src.report_cache import ReportCache
+import binascii
+import json
+import os.path
+import shutil
+import tempfile
+
+
+SAMPLE = './test/data/sample.xml'
+
+
+class Args:
+    pass
+
+
+class ReportCacheTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip_without_pdf(self):
+        payload = read_xml(SAMPLE)['rr:ResultsReport']['rr:ResultsPayload']
+        cache = ReportCache(self.cache_dir)
+        self.assertIsNone(cache.get('digest1'))
+
+        cache.put('digest1', payload)
+        self.assertIn('ReportPDF', payload)
+        expected = payload.copy()
+        del expected['ReportPDF']
+        self.assertEqual(cache.get('digest1'), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = ReportCache(self.cache_dir)
+        for i, digest in enumerate(['digest1', 'digest2', 'digest3']):
+            cache.put(digest, {'value': binascii.hexlify(os.urandom(128)).decode('ascii')})
+            os.utime(cache.path(digest), (i, i))
+        size = os.path.getsize(cache.path('digest1'))
+
+        os.utime(cache.path('digest1'), (10, 10))
+        # Compressed sizes differ by a few bytes, so allow half an entry more
+        cache.max_bytes = 3 * size + size // 2
+        cache.put('digest4', {'value': binascii.hexlify(os.urandom(128)).decode('ascii')})
+
+        self.assertIsNone(cache.get('digest2'))
+        for digest in ['digest1', 'digest3', 'digest4']:
+            self.assertIsNotNone(cache.get(digest))
+
+    def test_unreadable_entries_are_misses(self):
+        cache = ReportCache(self.cache_dir)
+        cache.put('digest1', {'value': 'a'})
+        with open(cache.path('digest1'), 'rb') as fd:
+            data = fd.read()
+        for corrupt in (data[:3], data[:-4], data[:8] + b'not zlib'):
+            with open(cache.path('digest1'), 'wb') as fd:
+                fd.write(corrupt)
+            self.assertIsNone(cache.get('digest1'))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+    @patch('src.report_cache.os.utime')
+    def test_read_only_cache(self, mock_utime):
+        mock_utime.side_effect = OSError(30, 'Read-only file system')
+        cache = ReportCache(self.cache_dir)
+        cache.put('digest1', {'value': 'a'})
+        self.assertEqual(cache.get('digest1'), {'value': 'a'})
+        self.assertEqual(os.listdir(self.cache_dir), ['digest1.report'])
+
+    def test_convert_skips_parsing_cached_report(self):
+        args = Args()
+        args.xml_file = SAMPLE
+        args.out_file = os.path.join(self.tmp_dir, 'out.json')
+        args.pdf_out_file = None
+        args.vcf_out_file = None
+        args.manifest_file = None
+        args.fhir_url = None
+        args.json_format = 'compact'
+        args.sections = ['cnv', 'biomarkers']
+        args.report_cache = self.cache_dir
+        args.project_id = 'project1'
+        args.subject_id = None
+        args.file_url = None
+        args.sequence_id = None
+        args.fasta = None
+        args.genes = None
+
+        convert(args)
+        with open(args.out_file) as fd:
+            expected = json.load(fd)
+
+        with patch('src.convert.read_xml') as mock_read_xml:
+            convert(args)
+            self.assertFalse(mock_read_xml.called)
+        with open(args.out_file) as fd:
+            self.assertEqual(len(json.load(fd)), len(expected))
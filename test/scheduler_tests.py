@@ -0,0 +1,89 @@
+from unittest import TestCase
+from mock import patch
+from src.scheduler import MemoryScheduler, count_variants, current_rss, estimate_memory
+import gzip
+import io
+import os.path
+import shutil
+import tempfile
+
+
+SAMPLE = './test/data/sample.xml'
+
+
+class SchedulerTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_count_variants(self):
+        with open(SAMPLE, 'rb') as fd:
+            data = fd.read()
+        self.assertEqual(count_variants(io.BytesIO(data)), 54)
+        with patch('src.scheduler.SCAN_BLOCK_SIZE', 7):
+            self.assertEqual(count_variants(io.BytesIO(data)), 54)
+
+        # Variants after the variant report are not counted
+        self.assertEqual(count_variants(io.BytesIO(b'<short-variant /></variant-report><short-variant />')), 1)
+
+    def test_estimate_memory(self):
+        gzipped = os.path.join(self.tmp_dir, 'sample.xml.gz')
+        with open(SAMPLE, 'rb') as fd, gzip.open(gzipped, 'wb') as out:
+            out.write(fd.read())
+        self.assertEqual(estimate_memory(gzipped), estimate_memory(SAMPLE))
+        self.assertGreater(estimate_memory(SAMPLE), os.path.getsize(SAMPLE))
+        self.assertEqual(estimate_memory(os.path.join(self.tmp_dir, 'missing.xml')), 0)
+        self.assertGreater(current_rss(), 0)
+
+    def test_largest_first(self):
+        scheduler = MemoryScheduler(workers=2)
+        for path, cost in (('small', 1), ('large', 100), ('medium', 10)):
+            scheduler.add(path, cost)
+        self.assertEqual([scheduler.next(), scheduler.next(), scheduler.next()], ['large', 'medium', None])
+        scheduler.finished('large')
+        self.assertEqual(scheduler.next(), 'small')
+        self.assertEqual(len(scheduler), 2)
+
+    def test_budget(self):
+        scheduler = MemoryScheduler(workers=4, budget=100)
+        for path, cost in (('a', 60), ('b', 50), ('c', 30), ('d', 500)):
+            scheduler.add(path, cost)
+
+        # Over budget on its own, d runs alone
+        self.assertEqual((scheduler.next(), scheduler.next()), ('d', None))
+        scheduler.finished('d')
+        self.assertEqual((scheduler.next(), scheduler.next()), ('a', None))
+        scheduler.finished('a')
+        self.assertEqual((scheduler.next(), scheduler.next(), scheduler.next()), ('b', 'c', None))
+
+    def test_fair_share(self):
+        scheduler = MemoryScheduler(workers=1, weights={'interactive': 3})
+        for i in range(6):
+            scheduler.add('backfill{}'.format(i), 10, 'backfill')
+        for i in range(3):
+            scheduler.add('interactive{}'.format(i), 10, 'interactive')
+
+        started = []
+        for _ in range(6):
+            path = scheduler.next()
+            started.append(path)
+            scheduler.finished(path)
+        self.assertEqual(started, ['backfill0', 'interactive0', 'interactive1', 'interactive2', 'backfill1',
+                                   'backfill2'])
+
+    def test_project_cap(self):
+        scheduler = MemoryScheduler(workers=4, caps={'backfill': 1})
+        scheduler.add('backfill0', 1, 'backfill')
+        scheduler.add('backfill1', 1, 'backfill')
+        scheduler.add('interactive0', 1, 'interactive')
+        self.assertEqual(sorted([scheduler.next(), scheduler.next()]), ['backfill0', 'interactive0'])
+        self.assertIsNone(scheduler.next())
+
+        scheduler.finished('backfill0', failed=True)
+        self.assertEqual(scheduler.next(), 'backfill1')
+        metrics = scheduler.metrics()
+        self.assertEqual((metrics['backfill']['running'], metrics['backfill']['failed']), (1, 1))
+        self.assertEqual((metrics['interactive']['running'], metrics['interactive']['queued']), (1, 0))
+        self.assertIsNotNone(metrics['backfill']['latency_p95'])
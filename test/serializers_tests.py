@@ -0,0 +1,26 @@
+from unittest import TestCase
+from src.serializers import available_backends, dumps_json
+import json
+
+resources = [
+    {'resourceType': 'Observation', 'id': 'obs1', 'valueQuantity': {'value': 0.73, 'unit': 'mutations-per-megabase'}},
+    {'resourceType': 'Observation', 'id': 'obs2', 'extension': [{'display': 200}, {'display': 'p.R77S'}]}
+]
+
+
+class SerializersTest(TestCase):
+    def test_backends_round_trip(self):
+        self.assertIn('json', available_backends())
+        for backend in available_backends():
+            for pretty in (True, False):
+                content = dumps_json(resources, pretty, backend)
+                self.assertTrue(isinstance(content, bytes))
+                self.assertEqual(json.loads(content.decode('utf-8')), resources)
+
+    def test_layout(self):
+        self.assertEqual(dumps_json(resources, False, 'json').count(b'\n'), 0)
+        for backend in available_backends():
+            self.assertEqual(dumps_json(resources, True, backend), json.dumps(resources, indent=2).encode('utf-8'))
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, dumps_json, resources, True, 'simplejson')
@@ -0,0 +1,63 @@
+from unittest import TestCase
+from src.snapshot import build_snapshot, load_snapshot, get_normalization_cache, enable_normalization_cache
+import src.snapshot
+import os.path
+import shutil
+import sys
+import tempfile
+
+rows = [
+    '0\tNM_000001\tchr1\t+\t99\t500\t150\t450\t2\t99,300,\t200,500,\t0\tGENE1\tcmpl\tcmpl\t0,2,\n',
+    '0\tNM_000002\tchr1\t-\t1000\t2000\t1100\t1900\t2\t1000,1500,\t1200,2000,\t0\tGENE2\tcmpl\tcmpl\t0,0,\n'
+]
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.genes = os.path.join(self.tmp_dir, 'refGene.txt')
+        with open(self.genes, 'w') as fd:
+            fd.writelines(rows)
+        self.fasta = os.path.join(self.tmp_dir, 'genome.fa')
+        with open(self.fasta, 'w') as fd:
+            fd.write('>1\nACGT\n')
+        with open('{}.fai'.format(self.fasta), 'w') as fd:
+            fd.write('1\t4\t3\t4\t5\n')
+        self.snapshot_file = os.path.join(self.tmp_dir, 'converter.snapshot')
+
+        # the snapshot installs its state in the modules it was imported with
+        self.transcripts = sys.modules[src.snapshot.TranscriptTable.__module__]
+        self.intervals = sys.modules[src.snapshot.TranscriptIndex.__module__]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        # Leave the process-wide state as it was for the tests that follow
+        sys.modules[src.snapshot.get_normalization_cache.__module__]._normalizations = None
+        self.transcripts._stores.clear()
+        self.transcripts._planned_transcripts.clear()
+        self.intervals._indexes.clear()
+        self.intervals._index_loaders.clear()
+
+    def test_round_trip(self):
+        enable_normalization_cache([(('genome.fa', 'genes', 'NM_000001:c.1A>G', 'missense', '1A>G', 'chr1:200', '+'),
+                                     ('chr1', 200, 'A', 'G'))])
+        build_snapshot(self.snapshot_file, self.fasta, self.genes, '1.0.0')
+        get_normalization_cache().clear()
+        os.remove('{}.fai'.format(self.fasta))
+
+        self.assertTrue(load_snapshot(self.snapshot_file, self.fasta, self.genes, '1.0.0'))
+
+        self.assertEqual(get_normalization_cache()[('genome.fa', 'genes', 'NM_000001:c.1A>G', 'missense', '1A>G',
+                                                    'chr1:200', '+')], ('chr1', 200, 'A', 'G'))
+        with open('{}.fai'.format(self.fasta)) as fd:
+            self.assertEqual(fd.read(), '1\t4\t3\t4\t5\n')
+
+        store = self.transcripts.get_transcript_store(self.genes)
+        self.assertEqual([x['id'] for x in store.read_records(['NM_000002'])], ['NM_000002'])
+        index = self.intervals.get_transcript_index(self.genes)
+        self.assertEqual(index.transcripts_at('chr1', 1500), ['NM_000002'])
+
+    def test_version_mismatch(self):
+        build_snapshot(self.snapshot_file, self.fasta, self.genes, '1.0.0')
+        self.assertFalse(load_snapshot(self.snapshot_file, self.fasta, self.genes, '1.1.0'))
+        self.assertFalse(load_snapshot(self.snapshot_file, self.fasta, 'other-genes.txt', '1.0.0'))
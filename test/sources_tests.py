@@ -0,0 +1,151 @@
+from unittest import TestCase
+from mock import patch
+from src.convert import SECTIONS, convert, read_xml
+from src.sources import is_archive, open_sources, report_name
+import gzip
+import json
+import os.path
+import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+
+SAMPLE = './test/data/sample.xml'
+
+
+class Args:
+    pass
+
+
+class SourcesTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(SAMPLE, 'rb') as fd:
+            self.sample = fd.read()
+        self.expected = read_xml(SAMPLE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def gzipped(self):
+        path = self.path('report.xml.gz')
+        with gzip.open(path, 'wb') as fd:
+            fd.write(self.sample)
+        return path
+
+    def zipped(self):
+        path = self.path('bundle.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr('reports/a.xml', self.sample)
+            bundle.write(self.gzipped(), 'reports/b.xml.gz')
+            bundle.writestr('reports/README.txt', b'not a report')
+        return path
+
+    def tarred(self):
+        path = self.path('bundle.tar.gz')
+        with tarfile.open(path, 'w:gz') as bundle:
+            bundle.add(SAMPLE, arcname='a.xml')
+            bundle.add(self.gzipped(), arcname='b.xml.gz')
+        return path
+
+    def test_gzip_source(self):
+        path = self.gzipped()
+        self.assertFalse(is_archive(path))
+        sources = [(name, read_xml(fd)) for name, fd in open_sources(path)]
+        self.assertEqual(sources, [(path, self.expected)])
+
+    def test_zip_members_streamed(self):
+        path = self.zipped()
+        self.assertTrue(is_archive(path))
+        sources = [(name, read_xml(fd)) for name, fd in open_sources(path)]
+        self.assertEqual(sources, [('reports/a.xml', self.expected), ('reports/b.xml.gz', self.expected)])
+
+    def test_tar_members_streamed(self):
+        path = self.tarred()
+        self.assertTrue(is_archive(path))
+        sources = [(name, read_xml(fd)) for name, fd in open_sources(path)]
+        self.assertEqual(sources, [('a.xml', self.expected), ('b.xml.gz', self.expected)])
+
+    def test_pdf_over_10_mb_in_tar_member(self):
+        pdf = b'A' * (12 << 20)
+        report = self.path('large.xml')
+        with open(report, 'wb') as fd:
+            fd.write(re.sub(b'<ReportPDF>[^<]*</ReportPDF>', b'<ReportPDF>' + pdf + b'</ReportPDF>', self.sample))
+        path = self.path('large.tar.gz')
+        with tarfile.open(path, 'w:gz') as bundle:
+            bundle.add(report, arcname='large.xml')
+
+        for skip in ([], [SECTIONS['pdf']]):
+            for name, fd in open_sources(path):
+                payload = read_xml(fd, skip)['rr:ResultsReport']['rr:ResultsPayload']
+                self.assertEqual(payload.get('ReportPDF'), None if skip else pdf.decode('ascii'))
+                expected = self.expected['rr:ResultsReport']['rr:ResultsPayload']
+                self.assertEqual(payload['FinalReport'], expected['FinalReport'])
+
+    def convert_args(self, xml_file):
+        args = Args()
+        args.xml_file = xml_file
+        args.out_file = self.path('json')
+        args.pdf_out_file = self.path('pdf')
+        args.vcf_out_file = None
+        args.removed_out_file = None
+        args.manifest_file = self.path('manifest.json')
+        args.fhir_url = None
+        args.json_format = 'compact'
+        args.sections = ['cnv', 'pdf']
+        args.project_id = 'project1'
+        args.subject_id = None
+        args.file_url = None
+        args.sequence_id = None
+        args.fasta = None
+        args.genes = None
+        return args
+
+    def test_convert_bundle(self):
+        args = self.convert_args(self.tarred())
+        convert(args)
+
+        self.assertEqual(sorted(os.listdir(args.out_file)), ['a.json', 'b.json'])
+        self.assertEqual(sorted(os.listdir(args.pdf_out_file)), ['a.pdf', 'b.pdf'])
+        with open(os.path.join(args.out_file, 'a.json')) as fd:
+            self.assertTrue(json.load(fd))
+
+        # Members are fingerprinted while streamed, so an unchanged bundle is skipped
+        os.remove(os.path.join(args.out_file, 'a.json'))
+        convert(args)
+        self.assertEqual(os.listdir(args.out_file), ['b.json'])
+
+    def test_report_name(self):
+        self.assertEqual(report_name('a.xml'), 'a')
+        self.assertEqual(report_name('reports/b.XML.gz'), 'reports/b')
+        self.assertEqual(report_name('/reports/./c.xml'), 'reports/c')
+        self.assertRaises(ValueError, report_name, 'reports/../../d.xml')
+
+    def test_same_file_name_in_bundle(self):
+        path = self.path('bundle.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr('a/report.xml', self.sample)
+            bundle.writestr('b/report.xml', self.sample)
+
+        args = self.convert_args(path)
+        args.manifest_file = None
+        convert(args)
+
+        for directory in ['a', 'b']:
+            self.assertEqual(os.listdir(os.path.join(args.out_file, directory)), ['report.json'])
+            self.assertEqual(os.listdir(os.path.join(args.pdf_out_file, directory)), ['report.pdf'])
+
+    @patch('src.convert.fhir_uploader')
+    def test_one_uploader_per_bundle(self, mock_fhir_uploader):
+        args = self.convert_args(self.tarred())
+        args.manifest_file = None
+        convert(args)
+        uploader = mock_fhir_uploader.return_value
+        self.assertEqual(mock_fhir_uploader.call_count, 1)
+        self.assertEqual(uploader.upload.call_count, 2)
+        self.assertEqual(uploader.close.call_count, 1)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+from src.convert import process, read_xml
+from src.sv import cnv_record, parse_position, rearrangement_records, write_sv_vcf
+import gzip
+import os.path
+import shutil
+import tempfile
+
+
+class Args:
+    pass
+
+
+class SvTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_position(self):
+        self.assertEqual(parse_position('chr12:58093932-58188144'), ('chr12', 58093932, 58188144))
+        self.assertEqual(parse_position('ch17:29557687-29887856'), ('chr17', 29557687, 29887856))
+        self.assertEqual(parse_position('chr1:32782332'), ('chr1', 32782332, 32782332))
+
+    def test_cnv_record(self):
+        self.assertEqual(cnv_record({
+            '@copy-number': '44', '@equivocal': 'false', '@gene': 'CDK4', '@number-of-exons': '7 of 7',
+            '@position': 'chr12:58093932-58188144', '@ratio': '11.63', '@status': 'known', '@type': 'amplification'
+        }), 'chr12\t58093932\t.\tN\t<DUP>\t.\tPASS\tSVTYPE=DUP;END=58188144;SVLEN=94213;GENE=CDK4;EXONS=7/7;'
+            'RATIO=11.63;VENDSIG=Pathogenic\tGT:CN\t.:44\n')
+        self.assertIn('\t<DEL>\t.\tPASS\tSVTYPE=DEL;END=200;SVLEN=-101;GENE=CDKN2A;EQUIVOCAL;', cnv_record({
+            '@copy-number': '0', '@equivocal': 'true', '@gene': 'CDKN2A', '@position': 'chr9:100-200',
+            '@status': 'likely', '@type': 'loss'
+        }))
+
+    def test_rearrangement_records(self):
+        records = rearrangement_records({
+            '@equivocal': 'false', '@other-gene': 'N/A', '@pos1': 'ch17:29557687-29887856',
+            '@pos2': 'ch6:66426718-66427149', '@status': 'likely', '@supporting-read-pairs': '83',
+            '@target-gene': 'NF1', '@type': 'truncation'
+        }, 1)
+        self.assertEqual(records, [
+            'chr17\t29557687\tbnd1_1\tN\tN[chr6:66426718[\t.\tPASS\tSVTYPE=BND;MATEID=bnd1_2;CIPOS=0,330169;GENE=NF1;'
+            'READPAIRS=83;VENDSIG=Likely_pathogenic\tGT\t.\n',
+            'chr6\t66426718\tbnd1_2\tN\t]chr17:29557687]N\t.\tPASS\tSVTYPE=BND;MATEID=bnd1_1;CIPOS=0,431;GENE=NF1;'
+            'READPAIRS=83;VENDSIG=Likely_pathogenic\tGT\t.\n'
+        ])
+
+    def test_targeted_gene(self):
+        records = rearrangement_records({
+            '@other-gene': 'ALK', '@pos1': 'chr2:42522656', '@pos2': 'chr2:29446394', '@targeted-gene': 'EML4'
+        }, 2)
+        for record in records:
+            self.assertIn(';GENE=EML4,ALK\t', record)
+
+    def test_process_writes_sv_vcf(self):
+        args = Args()
+        args.project_id = 'project1'
+        args.subject_id = 'subject1'
+        args.fasta = None
+        args.genes = None
+        args.file_url = None
+        args.vcf_out_file = None
+        args.sequence_id = None
+        args.sections = ['cnv', 'rearrangement']
+        args.sv_vcf_out_file = os.path.join(self.tmp_dir, 'sv.vcf.gz')
+        payload = read_xml('./test/data/sample.xml')['rr:ResultsReport']['rr:ResultsPayload']
+
+        process(payload, args)
+
+        with gzip.open(args.sv_vcf_out_file, 'rb') as fd:
+            lines = fd.read().decode('utf-8').splitlines()
+        records = [line.split('\t') for line in lines if not line.startswith('#')]
+        self.assertEqual([x[:2] for x in records[:3]], [['chr6', '37138078'], ['chr6', '41853880'], ['chr6', '66426718']])
+        self.assertEqual(len([x for x in records if x[4].startswith('<')]), 5)
+        self.assertEqual([x[2] for x in records if 'SVTYPE=BND' in x[7]], ['bnd1_2', 'bnd1_1'])
+        self.assertTrue(os.path.isfile(args.sv_vcf_out_file + '.tbi'))
+
+    def test_plain_output_sorted(self):
+        sv_vcf_file = os.path.join(self.tmp_dir, 'sv.vcf')
+        write_sv_vcf(['chr2\t5\t.\tN\t<DUP>\t.\tPASS\t.\tGT:CN\t.:3\n', 'chr1\t9\t.\tN\t<DEL>\t.\tPASS\t.\tGT:CN\t.:0\n'],
+                     'sample1', None, sv_vcf_file)
+        with open(sv_vcf_file) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(lines[-3], '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample1')
+        self.assertEqual([x.split('\t')[0] for x in lines[-2:]], ['chr1', 'chr2'])
@@ -0,0 +1,60 @@
+from unittest import TestCase
+from src.transcripts import (TranscriptStore, TranscriptTable, build_offset_index, build_transcript_table,
+                             load_offset_index, parse_refgene_row)
+import json
+import os.path
+import shutil
+import tempfile
+
+rows = [
+    '#bin\tname\tchrom\tstrand\ttxStart\ttxEnd\tcdsStart\tcdsEnd\texonCount\texonStarts\texonEnds\tscore\tname2\tcdsStartStat\tcdsEndStat\texonFrames\n',
+    '0\tNM_000002\tchr2\t-\t1000\t2000\t1100\t1900\t1\t1000,\t2000,\t0\tGENE2\tcmpl\tcmpl\t0,\n',
+    '0\tNM_000001\tchr1\t+\t100\t500\t150\t450\t2\t100,300,\t200,500,\t0\tGENE1\tcmpl\tcmpl\t0,2,\n',
+    '0\tNM_000003\tchrX\t+\t10\t90\t20\t80\t1\t10,\t90,\t0\tGENE3\tcmpl\tcmpl\t-1,\n',
+    '0\tNM_000003\tchrY\t+\t10\t90\t20\t80\t1\t10,\t90,\t0\tGENE3\tcmpl\tcmpl\t-1,\n'
+]
+
+
+class TranscriptsTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.genes = os.path.join(self.tmp_dir, 'refGene.txt')
+        with open(self.genes, 'w') as fd:
+            fd.writelines(rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_offset_index(self):
+        offsets = build_offset_index(self.genes)
+        self.assertEqual(sorted(offsets.keys()), ['NM_000001', 'NM_000002', 'NM_000003'])
+        self.assertEqual(offsets['NM_000002'], [len(rows[0])])
+        self.assertEqual(len(offsets['NM_000003']), 2)
+
+        self.assertEqual(load_offset_index(self.genes), offsets)
+        with open('{}.idx'.format(self.genes)) as fd:
+            self.assertEqual(json.load(fd)['offsets'], offsets)
+
+    def test_read_only_requested_rows(self):
+        store = TranscriptStore(self.genes)
+        self.assertEqual(store.read_rows(['NM_000003.1', 'NM_000001']), [rows[2], rows[3], rows[4]])
+        self.assertEqual(store.read_rows(['NM_000001', 'NM_000002']), [rows[1]])
+        self.assertEqual(store.read_rows(['NM_999999']), [])
+
+    def test_transcript_table(self):
+        table = TranscriptTable(build_transcript_table(self.genes))
+        self.assertTrue(table.matches(self.genes))
+        self.assertEqual(table.transcript_count, 4)
+        self.assertEqual(table.records('NM_000001'), [parse_refgene_row(rows[2])])
+        self.assertEqual(table.records('NM_000002'), [parse_refgene_row(rows[1])])
+        self.assertEqual(table.records('NM_000003'), [parse_refgene_row(rows[3]), parse_refgene_row(rows[4])])
+        self.assertEqual(table.records('NM_000000'), [])
+        self.assertEqual(table.records('NM_999999'), [])
+
+    def test_store_reads_table(self):
+        expected = TranscriptStore(self.genes).read_records(['NM_000003', 'NM_000001'])
+        build_transcript_table(self.genes)
+        store = TranscriptStore(self.genes)
+        self.assertTrue(store.table is not None)
+        self.assertEqual(store.read_records(['NM_000003', 'NM_000001']), expected)
+        self.assertEqual(store.read_records(['NM_000001', 'NM_000002']), [parse_refgene_row(rows[1])])
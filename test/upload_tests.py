@@ -0,0 +1,124 @@
+from unittest import TestCase, skipIf
+from src.upload import FhirUploader, create_bundle, requests, upload_stages
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class StubFhirServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubFhirHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            stall = server.stalls > 0
+            fail = server.failures > 0
+            if stall:
+                server.stalls -= 1
+            elif fail:
+                server.failures -= 1
+            else:
+                server.bundles.append(json.loads(body))
+        if stall:
+            # Outlasts the client's read timeout, which has hung up by now
+            time.sleep(0.5)
+            return
+
+        response = b'{"resourceType": "Bundle", "type": "transaction-response"}'
+        self.send_response(503 if fail else 200)
+        self.send_header('Content-Type', 'application/fhir+json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+def resources(count):
+    return [{'resourceType': 'Observation', 'id': 'obs{}'.format(i)} for i in range(count)]
+
+
+@skipIf(requests is None, 'requests is not installed')
+class UploadTest(TestCase):
+    def setUp(self):
+        self.server = StubFhirServer(('127.0.0.1', 0), StubFhirHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.failures = 0
+        self.server.stalls = 0
+        self.server.bundles = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_create_bundle(self):
+        bundle = create_bundle(resources(1), ['Observation/old'])
+        self.assertEqual(bundle['type'], 'transaction')
+        self.assertEqual([x['request'] for x in bundle['entry']], [
+            {'method': 'PUT', 'url': 'Observation/obs0'},
+            {'method': 'DELETE', 'url': 'Observation/old'}
+        ])
+
+    def test_upload_in_batches(self):
+        uploader = FhirUploader(self.url, batch_size=3, concurrency=2)
+        responses = uploader.upload(resources(7), ['Observation/old'])
+        uploader.close()
+
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(sorted(len(x['entry']) for x in self.server.bundles), [1, 1, 3, 3])
+        uploaded = [x['request']['url'] for bundle in self.server.bundles for x in bundle['entry']]
+        self.assertEqual(sorted(uploaded), sorted(['Observation/obs{}'.format(i) for i in range(7)] + ['Observation/old']))
+
+    def test_upload_retries(self):
+        self.server.failures = 2
+        uploader = FhirUploader(self.url, batch_size=10, retries=2, backoff=0.01)
+        uploader.upload(resources(2))
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.bundles), 1)
+
+        self.server.failures = 3
+        self.assertRaises(IOError, uploader.upload, resources(2))
+        uploader.close()
+
+    def test_upload_retries_timeouts(self):
+        self.server.stalls = 1
+        uploader = FhirUploader(self.url, batch_size=10, retries=1, backoff=0.01, timeout=0.2)
+        uploader.upload(resources(2))
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(len(self.server.bundles), 1)
+        uploader.close()
+
+    def test_upload_stages(self):
+        report = [{'resourceType': 'Patient', 'id': 'patient1'}, {'resourceType': 'Specimen', 'id': 'specimen1'}] + \
+            resources(5) + [{'resourceType': 'DiagnosticReport', 'id': 'report1'}]
+        self.assertEqual([[x['id'] for x in stage] + list(removed) for stage, removed in upload_stages(report)],
+                         [['patient1', 'specimen1'], ['obs{}'.format(i) for i in range(5)], ['report1']])
+
+        uploader = FhirUploader(self.url, batch_size=2, concurrency=4)
+        uploader.upload(report, ['Observation/old'])
+        uploader.upload(resources(1))
+        uploader.close()
+        bundles = [[x['request']['url'].split('/')[0] for x in bundle['entry']] for bundle in self.server.bundles]
+        self.assertEqual(bundles[0], ['Patient', 'Specimen'])
+        self.assertEqual(sorted(bundles[1:4]), [['Observation']] + [['Observation', 'Observation']] * 2)
+        self.assertEqual(bundles[4:], [['DiagnosticReport'], ['Observation'], ['Observation']])
+        self.assertEqual(self.server.bundles[5]['entry'][0]['request']['method'], 'DELETE')
@@ -0,0 +1,48 @@
+from unittest import TestCase
+from src.utils import BufferedGenome, LruCache, merge_windows, reference_window
+
+
+class CountingGenome(dict):
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.reads = 0
+
+    def __getitem__(self, chrom):
+        self.reads += 1
+        return dict.__getitem__(self, chrom)
+
+
+class UtilsTest(TestCase):
+    def test_reference_window(self):
+        self.assertEqual(reference_window('229C>A', 'chr1:500', flank=10), ('chr1', 490, 511))
+        self.assertEqual(reference_window('863_864insCAAG', 'chr5:50', flank=10), ('chr5', 40, 64))
+        self.assertEqual(reference_window('2488_2490del3', 'chr12:5', flank=10), ('chr12', 1, 18))
+
+    def test_merge_windows(self):
+        windows = [('chr2', 10, 20), ('chr1', 500, 600), ('chr1', 100, 200), ('chr1', 150, 250)]
+        self.assertEqual(merge_windows(windows, max_gap=100),
+                         [('chr1', 100, 250), ('chr1', 500, 600), ('chr2', 10, 20)])
+        self.assertEqual(merge_windows(windows, max_gap=300),
+                         [('chr1', 100, 600), ('chr2', 10, 20)])
+
+    def test_buffered_genome(self):
+        fasta = CountingGenome(chr1='ACGTACGTACGTACGTACGT', chr2='TTTTGGGGCCCCAAAA')
+        genome = BufferedGenome(fasta, max_gap=2)
+        genome.plan([('chr1', 1, 4), ('chr1', 6, 10), ('chr2', 5, 8), ('chr3', 1, 5)])
+
+        self.assertEqual(genome['chr1'][0:4], 'ACGT')
+        self.assertEqual(genome['chr1'][5:10], 'CGTAC')
+        self.assertEqual(genome['chr2'][4:8], 'GGGG')
+        self.assertEqual(fasta.reads, 2)
+
+        self.assertEqual(genome['chr1'][14:20], 'GTACGT')
+        self.assertEqual(fasta.reads, 3)
+
+    def test_lru_cache(self):
+        cache = LruCache(2)
+        cache.update([('a', 1), ('b', 2)])
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.items(), [('a', 1), ('c', 3)])
+        self.assertEqual(len(cache), 2)
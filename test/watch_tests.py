@@ -0,0 +1,152 @@
+from unittest import TestCase, skipIf
+from mock import patch
+from src.convert import watch
+from src.watch import FolderWatcher, _libc, is_candidate, move_to
+import json
+import os.path
+import shutil
+import tempfile
+import time
+
+
+class Args:
+    pass
+
+
+class WatchTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.tmp_dir, 'inbox')
+        os.makedirs(self.inbox)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def drop(self, name, data=b'<xml/>'):
+        path = os.path.join(self.inbox, name)
+        with open(path, 'ab') as fd:
+            fd.write(data)
+        return path
+
+    def test_is_candidate(self):
+        self.assertTrue(is_candidate('report.xml'))
+        self.assertTrue(is_candidate('reports.tar.gz'))
+        self.assertFalse(is_candidate('report.xml.part'))
+        self.assertFalse(is_candidate('.report.xml'))
+        self.assertFalse(is_candidate('notes.txt'))
+
+    def test_polling_debounce(self):
+        watcher = FolderWatcher(self.inbox, settle=0, interval=0, use_inotify=False)
+        path = self.drop('report.xml')
+        self.drop('report.xml.filepart')
+
+        self.assertEqual(watcher.poll(0), [])
+        self.drop('report.xml')
+        self.assertEqual(watcher.poll(0), [])
+        self.assertEqual(watcher.poll(0), [path])
+        self.assertEqual(watcher.poll(0), [])
+
+    @skipIf(_libc() is None, 'requires inotify')
+    def test_inotify(self):
+        watcher = FolderWatcher(self.inbox, settle=0)
+        self.assertIsNotNone(watcher.inotify)
+        self.assertEqual(watcher.poll(0), [])
+
+        path = self.drop('report.xml')
+        self.assertEqual(watcher.poll(1), [])
+        self.assertEqual(watcher.poll(0), [path])
+        watcher.close()
+
+    def test_move_to(self):
+        done = os.path.join(self.tmp_dir, 'done')
+        os.makedirs(done)
+        self.assertEqual(move_to(self.drop('report.xml'), done), os.path.join(done, 'report.xml'))
+
+        target = move_to(self.drop('report.xml'), done)
+        self.assertNotEqual(target, os.path.join(done, 'report.xml'))
+        self.assertTrue(os.path.isfile(target))
+        self.assertFalse(os.path.exists(os.path.join(self.inbox, 'report.xml')))
+
+    def test_subdirectories(self):
+        watcher = FolderWatcher(self.inbox, settle=0, use_inotify=_libc() is not None,
+                                exclude=[os.path.join(self.inbox, 'done')])
+        os.makedirs(os.path.join(self.inbox, 'done'))
+        self.drop('done.xml')
+        os.rename(os.path.join(self.inbox, 'done.xml'), os.path.join(self.inbox, 'done', 'done.xml'))
+        self.assertEqual(watcher.poll(0), [])
+
+        os.makedirs(os.path.join(self.inbox, 'project2'))
+        path = os.path.join(self.inbox, 'project2', 'report.xml')
+        with open(path, 'w') as fd:
+            fd.write('<xml/>')
+        self.assertEqual(watcher.poll(0.5), [])
+        self.assertEqual(watcher.poll(0), [path])
+        watcher.close()
+
+    def test_directory_trailing_slash(self):
+        for use_inotify in sorted(set([False, _libc() is not None])):
+            watcher = FolderWatcher(self.inbox + os.sep, settle=0, interval=0, use_inotify=use_inotify)
+            os.makedirs(os.path.join(self.inbox, 'project2'))
+            path = self.drop(os.path.join('project2', 'report.xml'))
+            self.assertEqual(watcher.poll(0.5), [])
+            self.assertEqual(watcher.poll(0), [path])
+            watcher.close()
+            shutil.rmtree(os.path.join(self.inbox, 'project2'))
+
+    def test_recreated_subdirectory(self):
+        for use_inotify in sorted(set([False, _libc() is not None])):
+            watcher = FolderWatcher(self.inbox, settle=0, interval=0, use_inotify=use_inotify)
+            project = os.path.join(self.inbox, 'project2')
+            os.makedirs(project)
+            self.assertEqual(watcher.poll(0), [])
+            shutil.rmtree(project)
+            self.assertEqual(watcher.poll(0.5), [])
+
+            # Files dropped once the recreated directory has been seen
+            os.makedirs(project)
+            self.assertEqual(watcher.poll(0.5), [])
+            path = self.drop(os.path.join('project2', 'report.xml'))
+            self.assertEqual(watcher.poll(0.5), [])
+            self.assertEqual(watcher.poll(0), [path])
+            watcher.close()
+            shutil.rmtree(project)
+
+    @patch('src.convert.convert')
+    def test_watch(self, mock_convert):
+        def convert(args, uploader=None):
+            if args.xml_file.endswith('bad.xml'):
+                raise ValueError('ERROR: bad report')
+            with open(os.path.join(self.tmp_dir, os.path.basename(args.out_file)), 'w') as fd:
+                fd.write(args.project_id)
+        mock_convert.side_effect = convert
+
+        args = Args()
+        args.watch_dir = self.inbox
+        args.watch_workers = 1
+        args.settle_time = 0
+        args.poll_interval = 0
+        args.done_dir = args.failed_dir = None
+        args.out_file = os.path.join(self.tmp_dir, 'json')
+        args.pdf_out_file = args.vcf_out_file = args.sv_vcf_out_file = None
+        args.project_id = 'project1'
+        args.metrics_file = os.path.join(self.tmp_dir, 'metrics.json')
+        os.makedirs(os.path.join(self.inbox, 'project2'))
+        good, bad = self.drop('good.xml'), self.drop('bad.xml')
+        other = self.drop(os.path.join('project2', 'other.xml'))
+
+        deadline = time.time() + 30
+        watch(args, lambda: time.time() > deadline or not any(os.path.exists(x) for x in (good, bad, other)))
+
+        self.assertTrue(os.path.isfile(os.path.join(self.inbox, 'done', 'good.xml')))
+        self.assertTrue(os.path.isfile(os.path.join(self.inbox, 'done', 'other.xml')))
+        for name, project in (('good.json', 'project1'), ('other.json', 'project2')):
+            with open(os.path.join(self.tmp_dir, name)) as fd:
+                self.assertEqual(fd.read(), project)
+        self.assertTrue(os.path.isdir(os.path.join(args.out_file, 'project2')))
+        with open(args.metrics_file) as fd:
+            metrics = json.load(fd)
+        self.assertEqual((metrics['project1']['done'], metrics['project1']['failed']), (1, 1))
+        self.assertEqual(metrics['project2']['done'], 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.inbox, 'failed', 'bad.xml')))
+        with open(os.path.join(self.inbox, 'failed', 'bad.xml.error')) as fd:
+            self.assertIn('ERROR: bad report', fd.read())
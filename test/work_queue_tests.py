@@ -0,0 +1,270 @@
+from unittest import TestCase
+from mock import patch
+from src.convert import drain_queue, project_setting
+from src.scheduler import percentile
+from src.work_queue import DONE, FAILED, LEASED, MIGRATIONS, QUEUED, SCHEMA_VERSION, LeaseHeartbeat, WorkQueue
+import argparse
+import gzip
+import json
+import os.path
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+class Args:
+    pass
+
+
+class WorkQueueTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.queue_file = os.path.join(self.tmp_dir, 'queue.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lease_complete(self):
+        queue = WorkQueue(self.queue_file)
+        self.assertEqual(queue.add(['/reports/a.xml', '/reports/b.xml'], 'project1'), 2)
+        self.assertEqual(queue.add(['/reports/a.xml'], 'project1'), 0)
+
+        other = WorkQueue(self.queue_file)
+        first, second = queue.lease('node1'), other.lease('node2')
+        self.assertEqual((first[1], second[1]), ('/reports/a.xml', '/reports/b.xml'))
+        self.assertIsNone(queue.lease('node1'))
+
+        self.assertFalse(queue.complete(second[0], 'node1'))
+        self.assertTrue(queue.complete(first[0], 'node1'))
+        self.assertEqual(queue.counts(), {DONE: 1, LEASED: 1})
+        other.close()
+        queue.close()
+
+    def test_upgrade_schema(self):
+        for version in range(1, SCHEMA_VERSION):
+            queue_file = os.path.join(self.tmp_dir, 'queue{}.db'.format(version))
+            connection = sqlite3.connect(queue_file)
+            for statement in [x for statements in MIGRATIONS[:version] for x in statements]:
+                connection.execute(statement)
+            connection.execute("INSERT INTO jobs (path, state, updated) VALUES ('/reports/old.xml', 'queued', 1)")
+            connection.commit()
+            connection.close()
+
+            queue = WorkQueue(queue_file)
+            self.assertEqual(queue.add(['/reports/new.xml'], 'project1'), 1)
+            self.assertEqual(sorted(queue.lease('node1')[1:] for _ in range(2)),
+                             [('/reports/new.xml', 'project1'), ('/reports/old.xml', None)])
+            self.assertEqual(queue.connection.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+            queue.close()
+
+    def test_metrics(self):
+        queue = WorkQueue(self.queue_file)
+        queue.add(['/reports/{}.xml'.format(i) for i in range(40)], 'project1')
+        rng = random.Random(3)
+        waits, latencies = [], []
+        for i in range(30):
+            job_id, _, _ = queue.lease('node1')
+            wait, latency = rng.randint(0, 100), rng.randint(100, 200)
+            queue.connection.execute('UPDATE jobs SET created = 0, leased = ? WHERE id = ?', (wait, job_id))
+            waits.append(wait)
+            if i % 3:
+                queue.complete(job_id, 'node1')
+                queue.connection.execute('UPDATE jobs SET updated = ? WHERE id = ?', (latency, job_id))
+                latencies.append(latency)
+        queue.add(['/reports/other.xml'], 'project2')
+        queue.set_project('project1', max_running=1)
+        self.assertEqual(queue.lease('node1')[2], 'project2')
+
+        metrics = queue.metrics()
+        self.assertEqual(metrics['project1'], {
+            QUEUED: 10, LEASED: 10, DONE: 20, FAILED: 0,
+            'wait_p50': percentile(waits, 50), 'wait_p95': percentile(waits, 95),
+            'latency_p50': percentile(latencies, 50), 'latency_p95': percentile(latencies, 95)
+        })
+        self.assertEqual(metrics['project2'][LEASED], 1)
+        self.assertIsNone(metrics['project2']['latency_p50'])
+        queue.close()
+
+    def test_largest_first(self):
+        queue = WorkQueue(self.queue_file)
+        costs = {'/reports/a.xml': 10, '/reports/b.xml': 30, '/reports/c.xml': 10}
+        queue.add(sorted(costs), 'project1', costs.get)
+        self.assertEqual([queue.lease('node1')[1] for _ in range(3)],
+                         ['/reports/b.xml', '/reports/a.xml', '/reports/c.xml'])
+        queue.close()
+
+    def test_fair_share(self):
+        queue = WorkQueue(self.queue_file)
+        queue.set_project('interactive', weight=3)
+        queue.add(['/backfill/{}.xml'.format(i) for i in range(10)], 'backfill')
+        queue.add(['/interactive/{}.xml'.format(i) for i in range(4)], 'interactive')
+
+        projects = [queue.lease('node1')[2] for _ in range(8)]
+        self.assertEqual(projects.count('interactive'), 4)
+        self.assertEqual(projects[:4].count('interactive'), 3)
+        queue.close()
+
+    def test_no_idle_credit(self):
+        queue = WorkQueue(self.queue_file)
+        queue.add(['/backfill/{}.xml'.format(i) for i in range(10)], 'backfill')
+        for _ in range(5):
+            queue.lease('node1')
+
+        # A project that becomes active starts level with the others
+        queue.add(['/late/{}.xml'.format(i) for i in range(3)], 'late')
+        self.assertEqual([queue.lease('node1')[2] for _ in range(4)], ['backfill', 'late', 'backfill', 'late'])
+        queue.close()
+
+    def test_project_cap(self):
+        queue = WorkQueue(self.queue_file)
+        queue.set_project('backfill', max_running=1)
+        queue.add(['/backfill/0.xml', '/backfill/1.xml'], 'backfill')
+        job_id, _, _ = queue.lease('node1')
+        self.assertIsNone(queue.lease('node2'))
+        queue.complete(job_id, 'node1')
+        self.assertEqual(queue.lease('node2')[1], '/backfill/1.xml')
+        queue.close()
+
+    def test_expired_lease(self):
+        queue = WorkQueue(self.queue_file, lease_time=0.05, max_attempts=2)
+        queue.add(['/reports/a.xml'], 'project1')
+        job_id, _, _ = queue.lease('node1')
+        self.assertIsNone(queue.lease('node2'))
+
+        time.sleep(0.1)
+        self.assertEqual(queue.lease('node2'), (job_id, '/reports/a.xml', 'project1'))
+        self.assertFalse(queue.heartbeat(job_id, 'node1'))
+        self.assertTrue(queue.heartbeat(job_id, 'node2'))
+
+        time.sleep(0.1)
+        self.assertIsNone(queue.lease('node3'))
+        self.assertEqual(queue.counts(), {FAILED: 1})
+        queue.close()
+
+    def test_fail_retries(self):
+        queue = WorkQueue(self.queue_file, max_attempts=2)
+        queue.add(['/reports/a.xml'], 'project1')
+        job_id, _, _ = queue.lease('node1')
+        queue.fail(job_id, 'node1', 'error')
+        self.assertEqual(queue.counts(), {QUEUED: 1})
+        job_id, _, _ = queue.lease('node1')
+        queue.fail(job_id, 'node1', 'error')
+        self.assertEqual(queue.counts(), {FAILED: 1})
+        queue.close()
+
+    def test_requeue_finished(self):
+        queue = WorkQueue(self.queue_file, max_attempts=1)
+        queue.add(['/reports/a.xml', '/reports/b.xml', '/reports/c.xml'], 'project1')
+        a, b = queue.lease('node1')[0], queue.lease('node1')[0]
+        queue.complete(a, 'node1')
+        queue.fail(b, 'node1', 'error')
+        self.assertEqual(queue.counts(), {DONE: 1, FAILED: 1, QUEUED: 1})
+
+        costs = {'/reports/a.xml': 5, '/reports/b.xml': 7}
+        self.assertEqual(queue.add(['/reports/a.xml', '/reports/b.xml', '/reports/c.xml'], 'project2', costs.get), 2)
+        self.assertEqual(queue.counts(), {QUEUED: 3})
+        rows = queue.connection.execute('SELECT path, project, cost, attempts, error FROM jobs ORDER BY path').fetchall()
+        self.assertEqual(rows, [('/reports/a.xml', 'project2', 5, 0, None), ('/reports/b.xml', 'project2', 7, 0, None),
+                                ('/reports/c.xml', 'project1', 0, 0, None)])
+
+        leased = queue.lease('node1')
+        self.assertEqual(queue.add([leased[1]], 'project1'), 0)
+        self.assertEqual(queue.counts(), {LEASED: 1, QUEUED: 2})
+        queue.close()
+
+    def test_heartbeat(self):
+        queue = WorkQueue(self.queue_file, lease_time=0.15)
+        queue.add(['/reports/a.xml'], 'project1')
+        job_id, _, _ = queue.lease('node1')
+        heartbeat = LeaseHeartbeat(queue, job_id, 'node1')
+        heartbeat.start()
+        time.sleep(0.3)
+        self.assertIsNone(queue.lease('node2'))
+        heartbeat.stop()
+        self.assertTrue(queue.complete(job_id, 'node1'))
+        queue.close()
+
+    @patch('src.convert.convert')
+    def test_drain_queue(self, mock_convert):
+        def convert(args, uploader=None):
+            if args.xml_file.endswith('bad.xml'):
+                raise ValueError('ERROR: bad report')
+        mock_convert.side_effect = convert
+
+        queue = WorkQueue(self.queue_file)
+        queue.add(['/reports/good.xml', '/reports/bad.xml'], 'project1')
+
+        args = Args()
+        args.queue_file = self.queue_file
+        args.lease_time = 60
+        args.project_id = None
+        args.metrics_file = os.path.join(self.tmp_dir, 'metrics.json')
+        args.out_file = os.path.join(self.tmp_dir, 'json')
+        args.pdf_out_file = args.vcf_out_file = args.sv_vcf_out_file = None
+        drain_queue(args)
+
+        self.assertEqual([call[0][0].out_file for call in mock_convert.call_args_list],
+                         [os.path.join(self.tmp_dir, 'json', 'project1', 'good.json')] +
+                         [os.path.join(self.tmp_dir, 'json', 'project1', 'bad.json')] * 3)
+        self.assertEqual(mock_convert.call_args[0][0].project_id, 'project1')
+        self.assertEqual(queue.counts(), {DONE: 1, FAILED: 1})
+        with open(args.metrics_file) as fd:
+            metrics = json.load(fd)['project1']
+        self.assertEqual((metrics[DONE], metrics[FAILED], metrics[QUEUED]), (1, 1, 0))
+        self.assertIsNotNone(metrics['latency_p95'])
+        queue.close()
+
+    def test_project_setting(self):
+        weight, cap = project_setting(float, 0, exclusive=True), project_setting(int, 1)
+        self.assertEqual(weight('a=b=0.5'), ('a=b', 0.5))
+        self.assertEqual(cap('project1=2'), ('project1', 2))
+        for value in ('project1', '=2', 'project1=0', 'project1=-1', 'project1=nan', 'project1=inf'):
+            self.assertRaises(argparse.ArgumentTypeError, weight, value)
+        self.assertRaises(argparse.ArgumentTypeError, cap, 'project1=0')
+
+    @patch('src.convert.hgvs_2_vcf')
+    def test_workers_share_working_directory(self, mock_hgvs_2_vcf):
+        mock_hgvs_2_vcf.return_value = 'chr1', 100, 'A', 'T'
+        reports = []
+        for name in ('a.xml', 'b.xml', 'c.xml', 'd.xml'):
+            reports.append(os.path.join(self.tmp_dir, name))
+            shutil.copyfile('./test/data/sample.xml', reports[-1])
+        queue = WorkQueue(self.queue_file)
+        queue.add(reports, 'project1')
+        queue.close()
+
+        args = Args()
+        args.queue_file = self.queue_file
+        args.lease_time = 3
+        args.project_id = 'project1'
+        args.out_file = os.path.join(self.tmp_dir, 'json')
+        args.vcf_out_file = os.path.join(self.tmp_dir, 'vcf')
+        args.vcf_index = 'tbi'
+        args.pdf_out_file = args.sv_vcf_out_file = args.removed_out_file = args.manifest_file = None
+        args.fhir_url = None
+        args.json_format = 'compact'
+        args.sections = None
+        args.subject_id = args.file_url = args.sequence_id = args.fasta = args.genes = None
+
+        # Two workers started from the same directory
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            workers = [threading.Thread(target=drain_queue, args=(args,)) for _ in range(2)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            os.chdir(cwd)
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'unsorted.vcf')))
+        counts = []
+        for name in ('a', 'b', 'c', 'd'):
+            with gzip.open(os.path.join(args.vcf_out_file, name + '.vcf.gz'), 'rb') as fd:
+                counts.append(len([x for x in fd.read().decode('utf-8').splitlines() if not x.startswith('#')]))
+        self.assertGreater(counts[0], 0)
+        self.assertEqual(counts, counts[:1] * 4)